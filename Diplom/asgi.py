@@ -13,4 +13,18 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Diplom.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Импорт после настройки Django: модуль использует модели
+from shop.events import stock_events_app  # noqa: E402
+
+# Долгие соединения потока событий обслуживаются в обход middleware Django
+STREAM_ROUTES = {
+    '/api/v1/events/stock': stock_events_app,
+}
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] in STREAM_ROUTES:
+        return await STREAM_ROUTES[scope['path']](scope, receive, send)
+    return await django_application(scope, receive, send)
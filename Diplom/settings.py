@@ -48,11 +48,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'shop.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'shop.db_router.ReplicaStickinessMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -87,6 +89,45 @@ DATABASES = {
     }
 }
 
+# Реплики для чтения каталога и истории заказов: пути к копиям базы
+# через запятую. Без DB_REPLICAS все запросы идут в основную базу.
+DB_REPLICAS = [path.strip() for path in os.getenv('DB_REPLICAS', '').split(',')
+               if path.strip()]
+for index, path in enumerate(DB_REPLICAS):
+    DATABASES[f'replica{index + 1}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / path,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['shop.db_router.ReplicaRouter']
+
+# Сколько секунд после записи клиент читает из основной базы
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 5))
+
+# Общий кэш всех процессов (веб-воркеры, планировщик, команды): токены,
+# лимиты частоты, версия каталога, липкость реплик. С REDIS_URL - Redis
+# (нужен пакет redis), иначе файлы в CACHE_DIR, общие для процессов
+# одного сервера
+REDIS_URL = os.getenv('REDIS_URL', '')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('CACHE_DIR', BASE_DIR / '.cache'),
+            'OPTIONS': {
+                'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 10000)),
+            },
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -130,9 +171,96 @@ AUTH_USER_MODEL = 'shop.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'shop.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
+    # Число доверенных прокси перед приложением: при 0 адрес клиента
+    # берется из REMOTE_ADDR, а X-Forwarded-For, который подставляет сам
+    # клиент, не учитывается
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', 0)),
+    # Лимиты для shop.throttling: ключ "<throttle_scope>.<kind>"
+    'DEFAULT_THROTTLE_RATES': {
+        'login.ip': '20/min',
+        'login.email': '5/min',
+        'login.global': '50/s',
+        'register.ip': '5/min',
+        'register.global': '20/s',
+        'confirm.ip': '20/min',
+        'confirm.email': '5/min',
+        'password_reset.ip': '5/min',
+        'password_reset.email': '3/hour',
+        'password_reset_confirm.ip': '10/min',
+        'details.token': '10/min',
+        'basket.token': '120/min',
+        'order.token': '30/min',
+        'partner_update.token': '10/hour',
+        'partner_stock.token': '600/min',
+    },
+}
+
+DJANGO_REST_PASSWORDRESET_THROTTLE_CLASSES = (
+    'shop.throttling.IPRateThrottle',
+    'shop.throttling.EmailRateThrottle',
+)
+
+# Кэш токенов: размер LRU и TTL (секунды) в памяти процесса, TTL общего кэша
+TOKEN_AUTH_CACHE = {
+    'MAX_SIZE': int(os.getenv('TOKEN_AUTH_CACHE_SIZE', 10000)),
+    'TTL': int(os.getenv('TOKEN_AUTH_CACHE_TTL', 10)),
+    'SHARED_TTL': int(os.getenv('TOKEN_AUTH_SHARED_CACHE_TTL', 300)),
+}
+
+# Запросы дольше этого порога пишутся в журнал вместе с запросами SQL
+METRICS_SLOW_REQUEST_SECONDS = float(
+    os.getenv('METRICS_SLOW_REQUEST_SECONDS', 1))
+# Ключ доступа к /metrics; без него метрики отдаются только адресам из
+# METRICS_ALLOWED_IPS (через запятую), по умолчанию никому
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+METRICS_ALLOWED_IPS = [address.strip() for address in os.getenv(
+    'METRICS_ALLOWED_IPS', '').split(',') if address.strip()]
+
+# Поток событий об остатках (shop.events): предел подключений на процесс,
+# размер очереди клиента и интервал пустых сообщений (секунды)
+STOCK_EVENTS = {
+    'MAX_CONNECTIONS': int(os.getenv('STOCK_EVENTS_MAX_CONNECTIONS', 1000)),
+    'QUEUE_SIZE': int(os.getenv('STOCK_EVENTS_QUEUE_SIZE', 1000)),
+    'KEEPALIVE': int(os.getenv('STOCK_EVENTS_KEEPALIVE', 15)),
+}
+
+# Время жизни кэша списка категорий (секунды); изменения каталога
+# сбрасывают кэш сразу через версию каталога (shop.catalog)
+CATEGORY_CACHE_TIMEOUT = int(os.getenv('CATEGORY_CACHE_TIMEOUT', 3600))
+
+# Индекс подсказок /products/suggest перестраивается в фоне после изменения
+# каталога не чаще SUGGEST_REBUILD_INTERVAL и целиком не реже
+# SUGGEST_FULL_REBUILD (секунды)
+SUGGEST_REBUILD_INTERVAL = int(os.getenv('SUGGEST_REBUILD_INTERVAL', 30))
+SUGGEST_FULL_REBUILD = int(os.getenv('SUGGEST_FULL_REBUILD', 3600))
+
+# Движок страниц каталога (shop.catalog_engine): orm или numpy (нужен
+# пакет numpy). Изменения дочитываются по updated_at с перекрытием
+# OVERLAP, полная перезагрузка не реже FULL_RELOAD (секунды)
+CATALOG_ENGINE = {
+    'BACKEND': os.getenv('CATALOG_ENGINE', 'orm'),
+    'OVERLAP': int(os.getenv('CATALOG_ENGINE_OVERLAP', 60)),
+    'FULL_RELOAD': int(os.getenv('CATALOG_ENGINE_FULL_RELOAD', 3600)),
+}
+
+# Списки админки по большим таблицам считают строки не дальше этого предела
+ADMIN_COUNT_LIMIT = int(os.getenv('ADMIN_COUNT_LIMIT', 10000))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'shop': {
+            'handlers': ['console'],
+            'level': os.getenv('SHOP_LOG_LEVEL', 'INFO'),
+        },
+    },
 }
 
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
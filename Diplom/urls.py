@@ -1,7 +1,10 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from shop.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('', include('shop.urls')),  # Подключаем маршруты из приложения
-]
\ No newline at end of file
+]
@@ -1,11 +1,161 @@
 # admin.py
-from django.contrib import admin
+import csv
+from itertools import chain
+
+from django import forms
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 
+from .catalog_engine import log_deleted_product_infos
+from .events import publish_stock_removed, stock_values
 from .models import User, Shop, Category, Product, ProductInfo, Parameter, \
     ProductParameter, Order, OrderItem, Contact, \
-    ConfirmEmailToken
+    ConfirmEmailToken, ShopOrder, ArchivedOrder, ArchivedOrderItem, \
+    ArchivedShopOrder, EmailOutbox, WebhookEvent, PriceListRefresh, ProductOffers
+from .services import numeric_value, revert_orders_sales, \
+    sync_product_parameters, refresh_product_offers, rebuild_category_stats
+from .signals import order_state_changed, stock_changed
+
+# Строк в пачке при чтении выгрузки и ID заказов в одном сигнале
+EXPORT_CHUNK_SIZE = 2000
+SIGNAL_BATCH_SIZE = 900
+# Начало ячейки, с которого Excel и LibreOffice читают формулу
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+class Echo:
+    """
+    Буфер для csv.writer, который сразу возвращает записанную строку
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_cell(value):
+    # Текст, похожий на формулу, выгружается как строка
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def stream_csv(queryset, columns, filename):
+    """
+    Потоковая выгрузка queryset в CSV
+
+    columns - пары (заголовок, поле для values_list). Строки читаются
+    через iterator() пачками и не накапливаются ни в памяти, ни в ответе.
+    Текстовые ячейки, начинающиеся с =, +, -, @, экранируются апострофом.
+    """
+    writer = csv.writer(Echo())
+    headers = [header for header, field in columns]
+    rows = queryset.values_list(*(field for header, field in columns))
+    # BOM нужен, чтобы Excel открыл кириллицу в UTF-8
+    lines = chain(['\ufeff', writer.writerow(headers)],
+                  (writer.writerow([csv_cell(value) for value in row])
+                   for row in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE)))
+    response = StreamingHttpResponse(lines,
+                                     content_type='text/csv; charset=utf-8')
+    stamp = timezone.localtime().strftime('%Y%m%d-%H%M%S')
+    response['Content-Disposition'] = \
+        f'attachment; filename="{filename}-{stamp}.csv"'
+    return response
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор списков админки без точного COUNT(*) по большой таблице
+
+    Без фильтров число строк берется из статистики ANALYZE
+    (sqlite_stat1), иначе считается не больше ADMIN_COUNT_LIMIT строк.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        limit = settings.ADMIN_COUNT_LIMIT
+        if not queryset.query.where:
+            # Заниженная устаревшая оценка вывела бы всю таблицу одной
+            # страницей, поэтому малые оценки перепроверяются подсчетом
+            estimate = self.estimate_table_rows(queryset)
+            if estimate is not None and estimate >= limit:
+                return estimate
+        return queryset.order_by()[:limit].count()
+
+    @staticmethod
+    def estimate_table_rows(queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != 'sqlite':
+            return None
+        with connection.cursor() as cursor:
+            # Таблица статистики появляется после первого ANALYZE
+            cursor.execute("SELECT 1 FROM sqlite_schema "
+                           "WHERE name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s '
+                           'LIMIT 1', [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        return int(row[0].split()[0]) if row else None
+
+
+class LargeTableAdminMixin:
+    """
+    Режим админки для таблиц каталога и заказов на миллионы строк
+
+    Страница списка выполняет фиксированное число запросов: оценка числа
+    строк вместо COUNT(*), связи для __str__ загружаются одним JOIN,
+    поиск только по началу индексированных полей, связи выбираются
+    автодополнением.
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # Первая страница читается по первичному ключу без сортировки всей
+    # таблицы, для заказов это тот же порядок, что и по дате
+    ordering = ('-pk',)
+
+    def get_queryset(self, request):
+        # Те же связи нужны автодополнению и форме изменения
+        queryset = super().get_queryset(request)
+        if isinstance(self.list_select_related, (list, tuple)):
+            queryset = queryset.select_related(*self.list_select_related)
+        return queryset
+
+    def get_action_form_data(self, request):
+        # Значения дополнительных полей формы действий, выбор действия
+        # проверяется по тем же вариантам, что и в списке
+        form = self.action_form(request.POST)
+        form.fields['action'].choices = self.get_action_choices(request)
+        return form.cleaned_data if form.is_valid() else {}
+
+    def get_search_results(self, request, queryset, search_term):
+        # Префикс сравнивается со всей строкой поиска, а не с каждым словом
+        search_term = search_term.strip()
+        if search_term and '"' not in search_term:
+            search_term = f'"{search_term}"'
+        return super().get_search_results(request, queryset, search_term)
+
+
+class ProductInfoActionForm(ActionForm):
+    value = forms.IntegerField(label='Значение', required=False)
+
+
+class OrderActionForm(ActionForm):
+    state = forms.ChoiceField(
+        label='Статус', required=False,
+        choices=[('', '---------')] + [
+            (state, name) for state, name in Order.STATE_CHOICES
+            if state in Order.STATE_TRANSITIONS])
 
 
 @admin.register(User)
@@ -47,6 +197,14 @@ class ShopAdmin(admin.ModelAdmin):
     search_fields = ('name', 'user__email')
     raw_id_fields = ('user',)
 
+    # Сводка предложений учитывает только активные магазины
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if 'state' in form.changed_data:
+            offers = ProductInfo.objects.filter(shop_id=obj.id)
+            refresh_product_offers(offers.values('product_id'))
+            rebuild_category_stats(offers.values('product__category_id'))
+
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -56,18 +214,109 @@ class CategoryAdmin(admin.ModelAdmin):
 
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('name', 'category')
     list_filter = ('category',)
-    search_fields = ('name', 'category__name')
+    list_select_related = ('category',)
+    search_fields = ('^name',)
+    autocomplete_fields = ('category',)
 
 
 @admin.register(ProductInfo)
-class ProductInfoAdmin(admin.ModelAdmin):
+class ProductInfoAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('product', 'shop', 'external_id', 'price', 'quantity')
     list_filter = ('shop',)
-    search_fields = ('product__name', 'shop__name', 'external_id')
-    raw_id_fields = ('product', 'shop')
+    list_select_related = ('product__category', 'shop')
+    search_fields = ('^product__name',)
+    autocomplete_fields = ('product', 'shop')
+    readonly_fields = ('parameters',)
+    action_form = ProductInfoActionForm
+    actions = ('export_csv', 'set_price', 'change_price_percent',
+               'set_quantity')
+
+    export_columns = (
+        ('id', 'id'),
+        ('external_id', 'external_id'),
+        ('shop', 'shop__name'),
+        ('category', 'product__category__name'),
+        ('product', 'product__name'),
+        ('model', 'model'),
+        ('price', 'price'),
+        ('price_rrc', 'price_rrc'),
+        ('quantity', 'quantity'),
+    )
+
+    @admin.action(description='Выгрузить в CSV')
+    def export_csv(self, request, queryset):
+        return stream_csv(queryset, self.export_columns, 'product-infos')
+
+    def action_value(self, request, minimum):
+        # Значение из формы действий, None и сообщение, если оно неверно
+        value = self.get_action_form_data(request).get('value')
+        if value is None or value < minimum:
+            self.message_user(request, f'Укажите целое значение не меньше '
+                                       f'{minimum}', messages.ERROR)
+            return None
+        return value
+
+    # Изменение и удаление товара обновляют сводки и поток событий
+    # stock, как импорт и изменение остатков партнером
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        self.refresh_summaries({obj.product_id, form.initial.get(
+            'product') or obj.product_id})
+        transaction.on_commit(lambda: stock_changed.send(
+            sender=type(self), product_info_ids=[obj.id]))
+
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, ProductInfo.objects.filter(id=obj.id))
+
+    def delete_queryset(self, request, queryset):
+        offers = list(stock_values(queryset))
+        product_ids = set(queryset.values_list('product_id', flat=True))
+        super().delete_queryset(request, queryset)
+        log_deleted_product_infos(offer['id'] for offer in offers)
+        self.refresh_summaries(product_ids)
+        transaction.on_commit(lambda: publish_stock_removed(offers))
+
+    @staticmethod
+    def refresh_summaries(product_ids):
+        refresh_product_offers(product_ids)
+        rebuild_category_stats(Product.objects.filter(
+            id__in=product_ids).values('category_id'))
+
+    def report_updated(self, request, queryset, **values):
+        # ИД читаются до UPDATE: фильтр списка может зависеть от
+        # изменяемых полей
+        product_info_ids = list(queryset.values_list('id', flat=True))
+        count = queryset.update(**values, updated_at=timezone.now())
+        # Цены и остатки входят в сводки предложений и категорий и в поток
+        # событий stock
+        refresh_product_offers(queryset.values('product_id'))
+        rebuild_category_stats(queryset.values('product__category_id'))
+        transaction.on_commit(lambda: stock_changed.send(
+            sender=type(self), product_info_ids=product_info_ids))
+        self.message_user(request, f'Обновлено позиций: {count}',
+                          messages.SUCCESS)
+
+    @admin.action(description='Установить цену')
+    def set_price(self, request, queryset):
+        price = self.action_value(request, 0)
+        if price is not None:
+            self.report_updated(request, queryset, price=price)
+
+    @admin.action(description='Изменить цену на процент')
+    def change_price_percent(self, request, queryset):
+        percent = self.action_value(request, -99)
+        if percent is not None:
+            self.report_updated(request, queryset,
+                                price=F('price') * (100 + percent) / 100)
+
+    @admin.action(description='Установить количество')
+    def set_quantity(self, request, queryset):
+        quantity = self.action_value(request, 0)
+        if quantity is not None:
+            self.report_updated(request, queryset, quantity=quantity)
 
 
 @admin.register(Parameter)
@@ -77,34 +326,142 @@ class ParameterAdmin(admin.ModelAdmin):
 
 
 @admin.register(ProductParameter)
-class ProductParameterAdmin(admin.ModelAdmin):
+class ProductParameterAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('product_info', 'parameter', 'value')
     list_filter = ('parameter',)
-    search_fields = ('product_info__product__name', 'parameter__name')
-    raw_id_fields = ('product_info', 'parameter')
+    list_select_related = ('product_info__product__category',
+                           'product_info__shop', 'parameter')
+    search_fields = ('^product_info__product__name',)
+    autocomplete_fields = ('product_info', 'parameter')
+
+    readonly_fields = ('value_numeric',)
+
+    # Изменения значений переносятся в JSON поле товара, из которого
+    # параметры читает API
+    def save_model(self, request, obj, form, change):
+        obj.value_numeric = numeric_value(obj.value)
+        super().save_model(request, obj, form, change)
+        sync_product_parameters({obj.product_info_id,
+                                 form.initial.get('product_info',
+                                                  obj.product_info_id)})
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        sync_product_parameters([obj.product_info_id])
+
+    def delete_queryset(self, request, queryset):
+        product_info_ids = set(queryset.values_list('product_info_id',
+                                                    flat=True))
+        super().delete_queryset(request, queryset)
+        sync_product_parameters(product_info_ids)
 
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('id', 'user', 'state', 'dt', 'contact')
     list_filter = ('state', 'dt')
-    search_fields = ('user__email', 'user__first_name', 'user__last_name')
-    raw_id_fields = ('user', 'contact')
-    date_hierarchy = 'dt'
+    list_select_related = ('user', 'contact')
+    search_fields = ('^user__email',)
+    autocomplete_fields = ('user', 'contact')
+    action_form = OrderActionForm
+    actions = ('export_csv', 'set_state')
+
+    export_columns = (
+        ('id', 'id'),
+        ('dt', 'dt'),
+        ('state', 'state'),
+        ('email', 'user__email'),
+        ('city', 'contact__city'),
+        ('phone', 'contact__phone'),
+        ('total_sum', 'total_sum'),
+    )
+
+    @admin.action(description='Выгрузить в CSV')
+    def export_csv(self, request, queryset):
+        # Сумма заказа берется из подзаказов магазинов по индексу
+        # (order, shop), без группировки всей выгрузки
+        totals = ShopOrder.objects.filter(order=OuterRef('pk')).order_by() \
+            .values('order').annotate(total=Sum('total_sum')).values('total')
+        return stream_csv(queryset.annotate(total_sum=Subquery(totals)),
+                          self.export_columns, 'orders')
+
+    @admin.action(description='Изменить статус')
+    def set_state(self, request, queryset):
+        """
+        Смена статуса одним UPDATE с теми же правилами, что и у магазина
+
+        Заказы, из статуса которых переход не разрешен, пропускаются.
+        Отмена вычитает заказы из сводки продаж, покупатели получают
+        письма о новом статусе.
+        """
+        state = self.get_action_form_data(request).get('state')
+        allowed_from = Order.STATE_TRANSITIONS.get(state)
+        if not allowed_from:
+            self.message_user(request, 'Выберите новый статус',
+                              messages.ERROR)
+            return
+
+        with transaction.atomic():
+            eligible = queryset.filter(state__in=allowed_from).order_by()
+            order_ids = list(eligible.values_list('id', flat=True))
+            if state == 'canceled':
+                revert_orders_sales(eligible.values('id'))
+            updated_count = eligible.update(state=state)
+            for start in range(0, len(order_ids), SIGNAL_BATCH_SIZE):
+                order_state_changed.send(
+                    sender=self.__class__,
+                    order_ids=order_ids[start:start + SIGNAL_BATCH_SIZE],
+                    state=state)
+
+        self.message_user(request, f'Обновлено заказов: {updated_count}',
+                          messages.SUCCESS)
 
 
 @admin.register(OrderItem)
-class OrderItemAdmin(admin.ModelAdmin):
+class OrderItemAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('order', 'product_info', 'quantity')
-    search_fields = ('order__user__email', 'product_info__product__name')
-    raw_id_fields = ('order', 'product_info')
+    list_select_related = ('order', 'product_info__product__category',
+                           'product_info__shop')
+    search_fields = ('^order__user__email',)
+    autocomplete_fields = ('order', 'product_info')
+
+
+@admin.register(ShopOrder)
+class ShopOrderAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = ('order', 'shop', 'dt', 'total_sum', 'items_count')
+    list_filter = ('shop', 'dt')
+    list_select_related = ('order', 'shop')
+    autocomplete_fields = ('order', 'shop')
+
+
+class ArchivedOrderItemInline(admin.TabularInline):
+    model = ArchivedOrderItem
+    extra = 0
+    can_delete = False
+
+
+class ArchivedShopOrderInline(admin.TabularInline):
+    model = ArchivedShopOrder
+    extra = 0
+    can_delete = False
+
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'state', 'dt', 'total_sum', 'archived_at')
+    list_filter = ('state',)
+    search_fields = ('user__email',)
+    raw_id_fields = ('user',)
+    date_hierarchy = 'dt'
+    inlines = (ArchivedOrderItemInline, ArchivedShopOrderInline)
 
 
 @admin.register(Contact)
-class ContactAdmin(admin.ModelAdmin):
+class ContactAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('user', 'city', 'street', 'house', 'phone')
-    search_fields = ('user__email', 'city', 'street')
-    raw_id_fields = ('user',)
+    list_select_related = ('user',)
+    search_fields = ('^user__email',)
+    autocomplete_fields = ('user',)
 
 
 @admin.register(ConfirmEmailToken)
@@ -113,3 +470,45 @@ class ConfirmEmailTokenAdmin(admin.ModelAdmin):
     search_fields = ('user__email', 'key')
     raw_id_fields = ('user',)
     readonly_fields = ('created_at',)
+
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'to', 'status', 'attempts', 'next_attempt_at',
+                    'sent_at')
+    list_filter = ('status',)
+    search_fields = ('subject',)
+    readonly_fields = ('created_at', 'sent_at', 'last_error')
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ('event', 'shop', 'status', 'attempts', 'next_attempt_at',
+                    'delivered_at')
+    list_filter = ('status', 'event')
+    raw_id_fields = ('shop',)
+    readonly_fields = ('created_at', 'delivered_at', 'last_error')
+
+
+@admin.register(PriceListRefresh)
+class PriceListRefreshAdmin(admin.ModelAdmin):
+    list_display = ('shop', 'outcome', 'last_run_at', 'duration',
+                    'next_run_at')
+    list_filter = ('outcome',)
+    raw_id_fields = ('shop',)
+    readonly_fields = ('last_run_at', 'duration', 'outcome', 'error', 'etag',
+                       'last_modified')
+
+
+@admin.register(ProductOffers)
+class ProductOffersAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = ('product', 'min_price', 'max_price', 'cheapest_shop',
+                    'total_quantity', 'offers_count')
+    list_select_related = ('product__category', 'cheapest_shop')
+    search_fields = ('^product__name',)
+    # Сводка пересчитывается сервисом refresh_product_offers
+    readonly_fields = ('product', 'min_price', 'max_price', 'cheapest_offer',
+                       'cheapest_shop', 'total_quantity', 'offers_count')
+
+    def has_add_permission(self, request):
+        return False
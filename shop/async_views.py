@@ -0,0 +1,94 @@
+# async_views.py
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import AuthenticationFailed
+
+from .authentication import CachedTokenAuthentication
+from .catalog import category_listing
+from .models import Shop
+from .serializers import ShopSerializer, \
+    ProductInfoSerializer
+from .views import ProductInfoView, ProductDetailView
+
+# Размер пачки для aiterator, с ним работает prefetch_related
+CHUNK_SIZE = 500
+
+
+def json_response(data, status=200):
+    return JsonResponse(data, status=status, safe=False,
+                        json_dumps_params={'ensure_ascii': False})
+
+
+async def get_user(request):
+    """
+    Пользователь запроса по токену или сессии, None для анонимного
+    """
+    auth = request.headers.get('Authorization', '').split()
+    if auth and auth[0].lower() == CachedTokenAuthentication.keyword.lower():
+        if len(auth) != 2:
+            return None
+        try:
+            user, _ = await sync_to_async(
+                CachedTokenAuthentication().authenticate_credentials)(auth[1])
+        except AuthenticationFailed:
+            return None
+        return user
+
+    user = await request.auser()
+    return user if user.is_authenticated else None
+
+
+@require_GET
+async def category_list(request):
+    """
+    Асинхронный список категорий товаров со статистикой из кэша
+    """
+    return json_response(await sync_to_async(category_listing)())
+
+
+@require_GET
+async def shop_list(request):
+    """
+    Асинхронный список активных магазинов
+    """
+    shops = Shop.objects.filter(state=True)
+    return json_response([
+        ShopSerializer(shop).data
+        async for shop in shops.aiterator(chunk_size=CHUNK_SIZE)
+    ])
+
+
+@require_GET
+async def product_list(request):
+    """
+    Асинхронный поиск товаров с фильтрацией по магазину и категории
+    """
+    try:
+        queryset = ProductInfoView.build_queryset(request.GET)
+        page = ProductInfoView.page_params(request.GET)
+    except ValueError as error:
+        return json_response({'Status': False, 'Error': str(error)},
+                             status=400)
+    if page is not None:
+        queryset = ProductInfoView.paginate(queryset, request.GET, page)
+    return json_response([
+        ProductInfoSerializer(product_info).data
+        async for product_info in queryset.aiterator(chunk_size=CHUNK_SIZE)
+    ])
+
+
+@require_GET
+async def product_detail(request, pk):
+    """
+    Асинхронное получение детальной информации о товаре по ID
+    """
+    if await get_user(request) is None:
+        return json_response(
+            {'Status': False, 'Error': 'Требуется авторизация'}, status=403)
+
+    product_info = await ProductDetailView.build_queryset(pk).afirst()
+    if not product_info:
+        return json_response(
+            {'Status': False, 'Error': 'Товар не найден'}, status=404)
+    return json_response(ProductInfoSerializer(product_info).data)
@@ -0,0 +1,147 @@
+# authentication.py
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.authentication import TokenAuthentication
+
+
+class TokenCache:
+    """
+    Ограниченный LRU-кэш токенов в памяти процесса с коротким TTL
+
+    Значения хранятся в сериализованном виде, поэтому каждый запрос
+    получает собственный экземпляр пользователя.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, payload = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return pickle.loads(payload)
+
+    def set(self, key, value):
+        payload = pickle.dumps(value)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def count(self, counter):
+        with self._lock:
+            self.stats[counter] += 1
+
+    def hit_rate(self):
+        total = sum(self.stats.values())
+        if not total:
+            return 0.0
+        return (self.stats['local_hits'] + self.stats['shared_hits']) / total
+
+
+_config = getattr(settings, 'TOKEN_AUTH_CACHE', {})
+token_cache = TokenCache(max_size=_config.get('MAX_SIZE', 10000),
+                         ttl=_config.get('TTL', 10))
+SHARED_TTL = _config.get('SHARED_TTL', 300)
+
+
+def _shared_key(key):
+    return f'auth:token:{key}'
+
+
+def invalidate_token(key):
+    """
+    Сброс закэшированного токена
+
+    Запись удаляется сразу и еще раз после фиксации транзакции, чтобы
+    параллельный запрос не вернул в кэш данные до изменения. Общий кэш
+    (CACHES) один для всех процессов и очищается сразу, в других процессах
+    запись доживает не дольше TTL локального кэша TOKEN_AUTH_CACHE['TTL'].
+    """
+    def delete():
+        token_cache.delete(key)
+        cache.delete(_shared_key(key))
+
+    delete()
+    transaction.on_commit(delete)
+
+
+def invalidate_user_tokens(*user_ids):
+    """
+    Сброс всех закэшированных токенов пользователей
+    """
+    from rest_framework.authtoken.models import Token
+
+    for key in Token.objects.filter(user_id__in=user_ids).values_list(
+            'key', flat=True):
+        invalidate_token(key)
+
+
+def revoke_user_tokens(*user_ids):
+    """
+    Удаление токенов пользователей после смены пароля
+
+    Кэш сбрасывается обработчиком удаления токена, клиенты входят заново.
+    """
+    from rest_framework.authtoken.models import Token
+
+    Token.objects.filter(user_id__in=user_ids).delete()
+
+
+def token_cache_stats():
+    """
+    Счетчики попаданий в кэш токенов текущего процесса
+    """
+    return dict(token_cache.stats, hit_rate=token_cache.hit_rate(),
+                size=len(token_cache._entries))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Аутентификация по токену с кэшированием пары токен - пользователь
+
+    Сначала проверяется LRU-кэш процесса, затем общий кэш, и только
+    при промахе выполняется запрос Token + User к базе.
+    """
+
+    def authenticate_credentials(self, key):
+        credentials = token_cache.get(key)
+        if credentials is not None:
+            token_cache.count('local_hits')
+            return credentials
+
+        credentials = cache.get(_shared_key(key))
+        if credentials is not None:
+            token_cache.count('shared_hits')
+        else:
+            token_cache.count('misses')
+            credentials = super().authenticate_credentials(key)
+            cache.set(_shared_key(key), credentials, SHARED_TTL)
+
+        token_cache.set(key, credentials)
+        return credentials
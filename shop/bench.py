@@ -0,0 +1,142 @@
+# bench.py
+import itertools
+import math
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(values, pct):
+    """
+    Перцентиль по методу ближайшего ранга
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+
+def summarize(latencies, errors, elapsed):
+    """
+    Сводка по одной конечной точке: пропускная способность и перцентили
+    задержки в миллисекундах
+    """
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': errors,
+        'rps': round(count / elapsed, 1) if elapsed else None,
+        'mean_ms': round(sum(latencies) / count * 1000, 2) if count else None,
+        **{
+            f'p{pct}_ms': round(percentile(latencies, pct) * 1000, 2)
+            if count else None
+            for pct in (50, 95, 99)
+        },
+    }
+
+
+def run_load(tasks, concurrency, duration=None):
+    """
+    Нагрузка из concurrency потоков
+
+    tasks - список функций task(session) -> (имя точки, HTTP статус)
+    или список шагов [(имя точки, HTTP статус, задержка), ...] для
+    сценариев из нескольких запросов (см. scenario_task).
+
+    Без duration каждая задача выполняется один раз, с duration задачи
+    повторяются по кругу заданное число секунд. Возвращает сводку по
+    каждой точке и общую под ключом "total".
+    """
+    import requests
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    local = threading.local()
+
+    source = itertools.cycle(tasks) if duration else iter(tasks)
+    source_lock = threading.Lock()
+    deadline = time.monotonic() + duration if duration else None
+
+    def next_task():
+        with source_lock:
+            return next(source, None)
+
+    def worker():
+        local.session = requests.Session()
+        while deadline is None or time.monotonic() < deadline:
+            task = next_task()
+            if task is None:
+                break
+            started = time.perf_counter()
+            try:
+                result = task(local.session)
+            except requests.RequestException:
+                result = getattr(task, 'name', 'unknown'), None
+            if not isinstance(result, list):
+                result = [(*result, time.perf_counter() - started)]
+            with lock:
+                for name, status, latency in result:
+                    latencies[name].append(latency)
+                    if status is None or status >= 400:
+                        errors[name] += 1
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    elapsed = time.monotonic() - started
+
+    report = {name: summarize(values, errors[name], elapsed)
+              for name, values in sorted(latencies.items())}
+    report['total'] = summarize(
+        [value for values in latencies.values() for value in values],
+        sum(errors.values()), elapsed)
+    return report
+
+
+def get_task(name, url, headers=None):
+    """
+    Задача GET запроса для run_load
+    """
+    def task(session):
+        return name, session.get(url, headers=headers, timeout=30).status_code
+    task.name = name
+    return task
+
+
+def scenario_task(name, scenario):
+    """
+    Задача из нескольких запросов для run_load
+
+    scenario(call) выполняет шаги через call(имя точки, метод, url,
+    **параметры requests) и получает ответы. Каждый шаг учитывается
+    в отчете отдельно; сетевая ошибка прерывает сценарий и засчитывается
+    как ошибка шага.
+    """
+    import requests
+
+    def task(session):
+        steps = []
+
+        def call(step, method, url, **kwargs):
+            started = time.perf_counter()
+            try:
+                response = session.request(method, url, timeout=30,
+                                           **kwargs)
+            except requests.RequestException:
+                steps.append((step, None, time.perf_counter() - started))
+                raise
+            steps.append((step, response.status_code,
+                          time.perf_counter() - started))
+            return response
+
+        try:
+            scenario(call)
+        except requests.RequestException:
+            pass
+        return steps
+    task.name = name
+    return task
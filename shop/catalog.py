@@ -0,0 +1,73 @@
+# catalog.py
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Category, CategoryShopStats
+
+# Версия каталога входит в ключи кэша: после изменения каталога старые
+# записи больше не читаются и истекают сами
+CATALOG_VERSION_KEY = 'catalog:version'
+
+
+def catalog_version() -> int:
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Начальное значение от времени, чтобы после потери ключа версия
+        # не совпала с одной из прежних
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version() -> None:
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        catalog_version()
+
+
+def invalidate_catalog() -> None:
+    """
+    Новая версия каталога после фиксации текущей транзакции
+    """
+    transaction.on_commit(bump_catalog_version)
+
+
+def build_category_listing() -> list[dict]:
+    """
+    Категории с числом товаров и товаров в наличии, всего и по активным
+    магазинам, из сводки CategoryShopStats
+    """
+    listing = {
+        category.id: {'id': category.id, 'name': category.name,
+                      'products_count': 0, 'in_stock_count': 0, 'shops': []}
+        for category in Category.objects.all()
+    }
+    for stats in CategoryShopStats.objects.select_related('shop').order_by(
+            'shop__name', 'shop_id'):
+        category = listing.get(stats.category_id)
+        if category is None:
+            continue
+        counts = {'products_count': stats.products_count,
+                  'in_stock_count': stats.in_stock_count}
+        if stats.shop is None:
+            category.update(counts)
+        else:
+            category['shops'].append(
+                {'id': stats.shop.id, 'name': stats.shop.name, **counts})
+    return list(listing.values())
+
+
+def category_listing() -> list[dict]:
+    """
+    Список категорий целиком из кэша, сборка только при смене версии
+    """
+    key = f'catalog:categories:{catalog_version()}'
+    listing = cache.get(key)
+    if listing is None:
+        listing = build_category_listing()
+        cache.set(key, listing, settings.CATEGORY_CACHE_TIMEOUT)
+    return listing
@@ -0,0 +1,223 @@
+# catalog_engine.py
+import itertools
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .catalog import catalog_version
+from .models import DeletedProductInfo, ProductInfo, Shop
+
+try:
+    import numpy as np
+except ImportError:
+    # Движок необязателен: без numpy страницы каталога читаются через ORM
+    np = None
+
+COLUMNS = ('id', 'shop_id', 'category_id', 'price', 'price_rrc', 'quantity')
+# Ключ сортировки по цене: цена в старших битах, ID в младших
+ID_BITS = 32
+
+
+def load_columns(queryset):
+    """
+    Колонки товаров запроса по возрастанию ID
+
+    Порядок задается здесь, а не в запросе: ORDER BY id заставил бы
+    SQLite обходить таблицу по ключу вместо индекса updated_at.
+    """
+    rows = queryset.order_by().values_list(
+        'id', 'shop_id', Coalesce('product__category_id', Value(0)),
+        'price', 'price_rrc', 'quantity')
+    data = np.fromiter(itertools.chain.from_iterable(rows),
+                       dtype=np.int64).reshape(-1, len(COLUMNS))
+    data = data[np.argsort(data[:, 0], kind='stable')]
+    return {name: data[:, column].copy()
+            for column, name in enumerate(COLUMNS)}
+
+
+def merge_columns(columns, changes):
+    """
+    Новые колонки с измененными и добавленными товарами
+    """
+    ids, changed_ids = columns['id'], changes['id']
+    if not len(changed_ids):
+        # Колонки снимка не меняются, их можно разделить
+        return columns
+    positions = np.searchsorted(ids, changed_ids)
+    found = positions < len(ids)
+    found[found] = ids[positions[found]] == changed_ids[found]
+    merged = {name: column.copy() for name, column in columns.items()}
+    for name in COLUMNS:
+        merged[name][positions[found]] = changes[name][found]
+    if not found.all():
+        merged = {name: np.concatenate((merged[name], changes[name][~found]))
+                  for name in COLUMNS}
+        order = np.argsort(merged['id'], kind='stable')
+        merged = {name: column[order] for name, column in merged.items()}
+    return merged
+
+
+class CatalogEngine:
+    """
+    Товары каталога в колонках numpy для фильтров и сортировки страниц
+
+    Фильтры по магазину, категории, цене и наличию считаются маской по
+    колонкам, сортировка по цене - частичной сортировкой ключа
+    (цена, ID). Движок отдает только ИД страницы, товары читаются из базы.
+    Снимок колонок не меняется: обновление строит новый движок.
+    """
+
+    def __init__(self, columns, active_shop_ids, version, loaded_at,
+                 full_loaded_at):
+        self.columns = columns
+        self.version = version
+        # Время базы, от которого дочитываются изменения, и момент полной
+        # загрузки по часам процесса
+        self.loaded_at = loaded_at
+        self.full_loaded_at = full_loaded_at
+        self.active = np.isin(columns['shop_id'], active_shop_ids)
+        ids = columns['id']
+        if not len(ids) or ids[-1] < 2 ** ID_BITS:
+            self.price_keys = (columns['price'] << ID_BITS) | ids
+        else:
+            self.price_keys = None
+
+    @staticmethod
+    def active_shop_ids():
+        return np.fromiter(Shop.objects.filter(state=True).values_list(
+            'id', flat=True), dtype=np.int64)
+
+    @classmethod
+    def load(cls, version):
+        loaded_at = timezone.now()
+        return cls(load_columns(ProductInfo.objects.all()),
+                   cls.active_shop_ids(), version, loaded_at,
+                   time.monotonic())
+
+    def refresh(self, version):
+        """
+        Движок с изменениями после прошлой загрузки
+
+        Измененные и новые товары читаются по индексу updated_at, удаленные -
+        из журнала DeletedProductInfo по индексу deleted_at, оба с
+        перекрытием на незавершенные тогда транзакции.
+        """
+        loaded_at = timezone.now()
+        since = self.loaded_at - timedelta(
+            seconds=settings.CATALOG_ENGINE['OVERLAP'])
+        columns = merge_columns(self.columns, load_columns(
+            ProductInfo.objects.filter(updated_at__gte=since)))
+        deleted = np.fromiter(DeletedProductInfo.objects.filter(
+            deleted_at__gte=since).values_list('product_info_id', flat=True),
+            dtype=np.int64)
+        if len(deleted):
+            kept = ~np.isin(columns['id'], deleted)
+            columns = {name: column[kept] for name, column in columns.items()}
+        return CatalogEngine(columns, self.active_shop_ids(), version,
+                             loaded_at, self.full_loaded_at)
+
+    def search(self, filters, sort, offset, limit):
+        """
+        ИД товаров страницы в порядке сортировки
+
+        filters: shop_id, category_id, price_min, price_max, in_stock;
+        sort: None (по ID), 'price' или '-price' (при равной цене по ID
+        в том же направлении), как у ORM.
+        """
+        columns = self.columns
+        mask = self.active.copy()
+        if filters['shop_id'] is not None:
+            mask &= columns['shop_id'] == filters['shop_id']
+        if filters['category_id'] is not None:
+            mask &= columns['category_id'] == filters['category_id']
+        if filters['price_min'] is not None:
+            mask &= columns['price'] >= filters['price_min']
+        if filters['price_max'] is not None:
+            mask &= columns['price'] <= filters['price_max']
+        if filters['in_stock']:
+            mask &= columns['quantity'] > 0
+        positions = np.flatnonzero(mask)
+
+        end = offset + limit
+        if sort is None or limit <= 0:
+            page = positions[offset:end]
+        elif self.price_keys is None:
+            order = np.lexsort((columns['id'][positions],
+                                columns['price'][positions]))
+            if sort == '-price':
+                order = order[::-1]
+            page = positions[order[offset:end]]
+        else:
+            keys = self.price_keys[positions]
+            if sort == '-price':
+                keys = -keys
+            # Упорядочиваются только первые end ключей
+            if end < len(keys):
+                order = np.argpartition(keys, end - 1)[:end]
+                order = order[np.argsort(keys[order])]
+            else:
+                order = np.argsort(keys)
+            page = positions[order[offset:end]]
+        return columns['id'][page].tolist()
+
+
+_engine = None
+_refresh_lock = threading.Lock()
+
+
+def log_deleted_product_infos(product_info_ids):
+    """
+    Запись удаленных товаров в журнал движка каталога пачкой
+
+    Журнал читает только движок numpy. Записи старше полной перезагрузки
+    движка с перекрытием больше не читаются и удаляются здесь же по
+    индексу deleted_at, без состояния в памяти процесса.
+    """
+    options = settings.CATALOG_ENGINE
+    if options['BACKEND'] != 'numpy' or np is None:
+        return
+    rows = [DeletedProductInfo(product_info_id=product_info_id)
+            for product_info_id in product_info_ids]
+    if not rows:
+        return
+    retention = options['FULL_RELOAD'] + options['OVERLAP']
+    DeletedProductInfo.objects.filter(
+        deleted_at__lt=timezone.now() - timedelta(seconds=retention)
+    ).delete()
+    DeletedProductInfo.objects.bulk_create(rows, batch_size=1000)
+
+
+def get_catalog_engine():
+    """
+    Движок текущей версии каталога или None, если он выключен
+
+    Первый запрос процесса загружает товары целиком, после смены версии
+    каталога один поток дочитывает изменения, остальные запросы тем
+    временем получают прежний снимок.
+    """
+    global _engine
+    options = settings.CATALOG_ENGINE
+    if options['BACKEND'] != 'numpy' or np is None:
+        return None
+    engine = _engine
+    version = catalog_version()
+    if engine is not None and engine.version == version and \
+            time.monotonic() - engine.full_loaded_at < options['FULL_RELOAD']:
+        return engine
+    if not _refresh_lock.acquire(blocking=engine is None):
+        return engine
+    try:
+        engine = _engine
+        if engine is None or time.monotonic() - engine.full_loaded_at \
+                >= options['FULL_RELOAD']:
+            _engine = CatalogEngine.load(version)
+        elif engine.version != version:
+            _engine = engine.refresh(version)
+        return _engine
+    finally:
+        _refresh_lock.release()
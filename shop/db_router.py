@@ -0,0 +1,100 @@
+# db_router.py
+import hashlib
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+# Модели каталога и истории заказов, которые можно читать с реплик
+REPLICA_MODELS = {
+    'shop', 'category', 'product', 'productinfo', 'parameter',
+    'productparameter', 'order', 'orderitem', 'shoporder', 'archivedorder',
+    'archivedorderitem', 'salesdailyrollup', 'deletedproductinfo',
+}
+
+_use_primary = ContextVar('db_use_primary', default=False)
+_wrote = ContextVar('db_wrote', default=False)
+# Реплики читаются только в запросах: команды, планировщик и фоновые
+# обработчики работают с основной базой
+_in_request = ContextVar('db_in_request', default=False)
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias != 'default']
+
+
+class ReplicaRouter:
+    """
+    Маршрутизация чтения каталога и истории заказов на реплики
+
+    Запись всегда идет в основную базу. Чтение остается в основной базе
+    вне HTTP запросов, внутри транзакций, в изменяющих запросах и в
+    течение REPLICA_STICKY_SECONDS после собственной записи клиента.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != 'shop' \
+                or model._meta.model_name not in REPLICA_MODELS:
+            return 'default'
+        replicas = replica_aliases()
+        if not replicas or not _in_request.get() or _use_primary.get() \
+                or connections['default'].in_atomic_block:
+            return 'default'
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        _wrote.set(True)
+        _use_primary.set(True)
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Реплики заполняются копированием основной базы
+        return db == 'default'
+
+
+def client_key(request):
+    # Ключ клиента без обращения к базе: токен, сессия или IP
+    auth = request.META.get('HTTP_AUTHORIZATION')
+    session = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    ident = auth or session or request.META.get('REMOTE_ADDR', '')
+    return 'db:sticky:' + hashlib.sha256(ident.encode()).hexdigest()
+
+
+class ReplicaStickinessMiddleware:
+    """
+    Закрепление клиента за основной базой после его записи
+
+    Обеспечивает чтение собственных изменений: пока не истек интервал
+    REPLICA_STICKY_SECONDS после записи, все чтения клиента идут
+    в основную базу. Отметка о записи хранится в общем кэше (CACHES),
+    поэтому действует во всех процессах.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not replica_aliases():
+            return self.get_response(request)
+
+        key = client_key(request)
+        use_primary = request.method not in ('GET', 'HEAD', 'OPTIONS') \
+            or bool(cache.get(key))
+        primary_token = _use_primary.set(use_primary)
+        wrote_token = _wrote.set(False)
+        request_token = _in_request.set(True)
+        try:
+            response = self.get_response(request)
+            if _wrote.get():
+                cache.set(key, True,
+                          getattr(settings, 'REPLICA_STICKY_SECONDS', 5))
+        finally:
+            _use_primary.reset(primary_token)
+            _wrote.reset(wrote_token)
+            _in_request.reset(request_token)
+        return response
@@ -0,0 +1,260 @@
+# events.py
+import asyncio
+import json
+import threading
+
+from django.conf import settings
+from django.db.models import F
+from django.http import QueryDict
+
+from .models import ProductInfo
+
+# Значений в одном IN-списке при выборке измененных товаров
+LOOKUP_BATCH_SIZE = 500
+# Событий в одной записи в поток клиента
+WRITE_BATCH_SIZE = 100
+
+# Признак переполнения очереди клиента
+OVERFLOW = object()
+
+
+class TooManySubscribers(Exception):
+    """
+    Достигнут предел одновременных подключений к потоку событий
+    """
+
+
+class Subscription:
+    """
+    Подписка клиента на события с фильтром по магазинам и категориям
+
+    Очередь ограничена: если клиент не успевает читать, очередь
+    сбрасывается и клиент получает событие overflow, после которого
+    переподключается и заново читает каталог.
+    """
+
+    def __init__(self, broker, loop, queue_size, shop_ids, category_ids):
+        self.broker = broker
+        self.loop = loop
+        self.queue = asyncio.Queue(queue_size)
+        self.shop_ids = shop_ids
+        self.category_ids = category_ids
+        self.overflowed = False
+
+    def matches(self, event):
+        if self.shop_ids and event['shop_id'] not in self.shop_ids:
+            return False
+        # События магазина касаются всех категорий
+        return not (self.category_ids and 'category_id' in event
+                    and event['category_id'] not in self.category_ids)
+
+    def push(self, events):
+        # Вызывается в потоке цикла событий клиента
+        if self.overflowed:
+            return
+        for event in events:
+            try:
+                self.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.overflowed = True
+                while not self.queue.empty():
+                    self.queue.get_nowait()
+                self.queue.put_nowait(OVERFLOW)
+                return
+
+    async def stream(self, keepalive):
+        """
+        Поток text/event-stream; подписка снимается при отключении клиента
+        """
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    event = await asyncio.wait_for(self.queue.get(),
+                                                   keepalive)
+                except asyncio.TimeoutError:
+                    yield ': ping\n\n'
+                    continue
+                events = [event]
+                while len(events) < WRITE_BATCH_SIZE and \
+                        not self.queue.empty():
+                    events.append(self.queue.get_nowait())
+                if OVERFLOW in events:
+                    yield 'event: overflow\ndata: {}\n\n'
+                    return
+                yield ''.join(
+                    f'event: {event["type"]}\n'
+                    f'data: {json.dumps(event, ensure_ascii=False)}\n\n'
+                    for event in events)
+        finally:
+            self.broker.unsubscribe(self)
+
+
+class EventBroker:
+    """
+    Раздача событий каталога подписчикам внутри процесса
+
+    Публиковать можно из любого потока: события передаются в цикл событий
+    каждого подписчика через call_soon_threadsafe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+
+    @property
+    def has_subscribers(self):
+        return bool(self._subscriptions)
+
+    def subscribe(self, shop_ids=frozenset(), category_ids=frozenset()):
+        options = settings.STOCK_EVENTS
+        with self._lock:
+            if len(self._subscriptions) >= options['MAX_CONNECTIONS']:
+                raise TooManySubscribers
+            subscription = Subscription(
+                self, asyncio.get_running_loop(), options['QUEUE_SIZE'],
+                frozenset(shop_ids), frozenset(category_ids))
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, events):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            matching = [event for event in events
+                        if subscription.matches(event)]
+            if not matching:
+                continue
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.push,
+                                                       matching)
+            except RuntimeError:
+                # Цикл событий клиента уже закрыт
+                self.unsubscribe(subscription)
+
+
+broker = EventBroker()
+
+
+def stock_values(queryset):
+    # Поля события stock для товаров запроса
+    return queryset.values('id', 'shop_id', 'price', 'price_rrc', 'quantity',
+                           category_id=F('product__category_id'))
+
+
+def publish_stock_changes(product_info_ids):
+    """
+    События stock с текущими ценой и остатком измененных товаров
+
+    Без подписчиков товары не читаются.
+    """
+    if not broker.has_subscribers:
+        return
+    product_info_ids = list(product_info_ids)
+    for start in range(0, len(product_info_ids), LOOKUP_BATCH_SIZE):
+        broker.publish([
+            {'type': 'stock', **values}
+            for values in stock_values(ProductInfo.objects.filter(
+                id__in=product_info_ids[start:start + LOOKUP_BATCH_SIZE]))
+        ])
+
+
+def publish_stock_removed(offers):
+    """
+    События stock с нулевым остатком удаленных товаров
+
+    offers - значения stock_values, прочитанные до удаления.
+    """
+    if not broker.has_subscribers:
+        return
+    broker.publish([{'type': 'stock', **values, 'quantity': 0}
+                    for values in offers])
+
+
+def publish_shop_state(shop_ids, state):
+    """
+    События shop_state о включении и отключении магазинов
+    """
+    if not broker.has_subscribers:
+        return
+    broker.publish([{'type': 'shop_state', 'shop_id': shop_id,
+                     'state': state} for shop_id in shop_ids])
+
+
+def id_filter(query, name):
+    return frozenset(int(value) for value in query.get(name, '').split(',')
+                     if value)
+
+
+async def send_json(send, status, data, headers=()):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'),
+                            *headers]})
+    await send({'type': 'http.response.body',
+                'body': json.dumps(data, ensure_ascii=False).encode()})
+
+
+async def stock_events_app(scope, receive, send):
+    """
+    ASGI приложение потока событий /api/v1/events/stock
+
+    Фильтры: shop_id и category_id, несколько значений через запятую.
+    Работает без middleware Django: соединение держит только очередь
+    подписки, отключение клиента снимает подписку сразу.
+    """
+    if scope['method'] != 'GET':
+        await send_json(send, 405, {'Status': False,
+                                    'Error': 'Метод не поддерживается'})
+        return
+    query = QueryDict(scope.get('query_string', b''))
+    try:
+        shop_ids = id_filter(query, 'shop_id')
+        category_ids = id_filter(query, 'category_id')
+    except ValueError:
+        await send_json(send, 400, {'Status': False,
+                                    'Error': 'Неверный фильтр'})
+        return
+    try:
+        subscription = broker.subscribe(shop_ids, category_ids)
+    except TooManySubscribers:
+        await send_json(send, 503, {'Status': False,
+                                    'Error': 'Слишком много подключений'},
+                        [(b'retry-after', b'10')])
+        return
+
+    async def write():
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [
+                        (b'content-type', b'text/event-stream; charset=utf-8'),
+                        (b'cache-control', b'no-cache'),
+                        (b'x-accel-buffering', b'no'),
+                    ]})
+        stream = subscription.stream(settings.STOCK_EVENTS['KEEPALIVE'])
+        try:
+            async for chunk in stream:
+                await send({'type': 'http.response.body',
+                            'body': chunk.encode(), 'more_body': True})
+        finally:
+            await stream.aclose()
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def wait_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    tasks = {asyncio.ensure_future(write()),
+             asyncio.ensure_future(wait_disconnect())}
+    try:
+        done, pending = await asyncio.wait(
+            tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        broker.unsubscribe(subscription)
@@ -0,0 +1,45 @@
+# backend/management/commands/archive_orders.py
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from shop.services import archive_orders_batch
+
+
+class Command(BaseCommand):
+    help = 'Move old delivered and canceled orders into archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=365,
+                            help='Archive orders older than this many days')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Orders moved per transaction')
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help='Stop after this many batches')
+        parser.add_argument('--vacuum', action='store_true',
+                            help='Run VACUUM after archiving (SQLite)')
+
+    def handle(self, *args, **options):
+        older_than = timezone.now() - timedelta(days=options['days'])
+        self.stdout.write(
+            f'Архивируем заказы старше {older_than:%d.%m.%Y}')
+
+        total = 0
+        batches = 0
+        while options['max_batches'] is None \
+                or batches < options['max_batches']:
+            moved = archive_orders_batch(older_than, options['batch_size'])
+            if not moved:
+                break
+            total += moved
+            batches += 1
+            self.stdout.write(f'  Пачка {batches}: {moved} заказов')
+
+        if options['vacuum'] and connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('VACUUM')
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Перенесено в архив заказов: {total}'))
@@ -0,0 +1,42 @@
+# backend/management/commands/backfill_sales_rollups.py
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from shop.services import rebuild_sales_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild daily sales rollups from orders and the order archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', type=str,
+                            help='First day (YYYY-MM-DD), default 1 year ago')
+        parser.add_argument('--to', dest='date_to', type=str,
+                            help='Last day (YYYY-MM-DD), default today')
+        parser.add_argument('--chunk-days', type=int, default=31,
+                            help='Days rebuilt per transaction')
+
+    def handle(self, *args, **options):
+        try:
+            date_to = date.fromisoformat(options['date_to']) \
+                if options['date_to'] else timezone.localdate()
+            date_from = date.fromisoformat(options['date_from']) \
+                if options['date_from'] else date_to - timedelta(days=365)
+        except ValueError as e:
+            raise CommandError(f'Неверная дата: {e}')
+
+        total = 0
+        chunk_start = date_from
+        while chunk_start <= date_to:
+            chunk_end = min(
+                chunk_start + timedelta(days=options['chunk_days'] - 1),
+                date_to)
+            rows = rebuild_sales_rollups(chunk_start, chunk_end)
+            total += rows
+            self.stdout.write(f'  {chunk_start} - {chunk_end}: {rows} строк')
+            chunk_start = chunk_end + timedelta(days=1)
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Сводка продаж пересчитана, строк: {total}'))
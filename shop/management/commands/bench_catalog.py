@@ -0,0 +1,70 @@
+# backend/management/commands/bench_catalog.py
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+from shop.bench import run_load, get_task
+from shop.models import ProductInfo
+
+
+class Command(BaseCommand):
+    help = ('Compare catalog endpoints: sync views under WSGI against '
+            'async views under ASGI')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wsgi-url', required=True,
+                            help='Base URL of the WSGI server, '
+                                 'e.g. http://127.0.0.1:8000')
+        parser.add_argument('--asgi-url', required=True,
+                            help='Base URL of the ASGI server, '
+                                 'e.g. http://127.0.0.1:8001')
+        parser.add_argument('--concurrency', type=int, default=100)
+        parser.add_argument('--requests', type=int, default=2000,
+                            help='Requests per endpoint and server')
+        parser.add_argument('--output', help='Write the report as JSON')
+
+    def endpoints(self):
+        product_info = ProductInfo.objects.filter(shop__state=True).first()
+        if product_info is None:
+            raise CommandError('В базе нет товаров для нагрузки')
+        token = Token.objects.first()
+        headers = {'Authorization': f'Token {token.key}'} if token else None
+
+        endpoints = [
+            ('categories', 'categories', None),
+            ('shops', 'shops', None),
+            ('products', f'products?category_id='
+                         f'{product_info.product.category_id}', None),
+        ]
+        if headers:
+            endpoints.append(('product-detail',
+                              f'products/{product_info.id}/', headers))
+        return endpoints
+
+    def handle(self, *args, **options):
+        modes = {
+            'wsgi': f'{options["wsgi_url"].rstrip("/")}/api/v1/',
+            'asgi': f'{options["asgi_url"].rstrip("/")}/api/v1/async/',
+        }
+        report = {}
+        for name, path, headers in self.endpoints():
+            report[name] = {}
+            for mode, base_url in modes.items():
+                tasks = [get_task(name, base_url + path, headers)] \
+                    * options['requests']
+                result = run_load(tasks, options['concurrency'])
+                report[name][mode] = result[name]
+
+        self.stdout.write(f'{"endpoint":<16}{"mode":<6}{"rps":>10}'
+                          f'{"p50 ms":>10}{"p99 ms":>10}{"errors":>8}')
+        for name, modes_report in report.items():
+            for mode, stats in modes_report.items():
+                self.stdout.write(
+                    f'{name:<16}{mode:<6}{stats["rps"]:>10}'
+                    f'{stats["p50_ms"]:>10}{stats["p99_ms"]:>10}'
+                    f'{stats["errors"]:>8}')
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, indent=2)
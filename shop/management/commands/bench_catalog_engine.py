@@ -0,0 +1,101 @@
+# backend/management/commands/bench_catalog_engine.py
+import json
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.http import QueryDict
+
+from shop import catalog_engine
+from shop.catalog import catalog_version
+from shop.models import ProductInfo, Shop, Category
+from shop.views import ProductInfoView
+
+
+class Command(BaseCommand):
+    help = ('Compare catalog pages read through the ORM against the '
+            'in-memory NumPy catalog engine')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Runs per query, the median is shown')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help='Write the report as JSON')
+
+    def handle(self, *args, **options):
+        if catalog_engine.np is None:
+            raise CommandError('Для движка каталога нужен пакет numpy')
+        if not ProductInfo.objects.exists():
+            raise CommandError(
+                'Нет товаров, запустите seed_benchmark_data')
+
+        started = time.perf_counter()
+        engine = catalog_engine.CatalogEngine.load(catalog_version())
+        load_ms = round((time.perf_counter() - started) * 1000, 2)
+        started = time.perf_counter()
+        engine.refresh(engine.version)
+        refresh_ms = round((time.perf_counter() - started) * 1000, 2)
+
+        rng = random.Random(options['seed'])
+        queries = self.queries(rng, options['page_size'])
+        report = {}
+        for name, query in queries.items():
+            params = QueryDict(query)
+            page = ProductInfoView.page_params(params)
+            report[name] = {
+                'query': query,
+                'orm_ms': self.measure(lambda: list(ProductInfoView.paginate(
+                    ProductInfoView.build_queryset(params), params, page)),
+                    options['repeat']),
+                'engine_ms': self.measure(
+                    lambda: ProductInfoView.engine_page(params, page, engine),
+                    options['repeat']),
+            }
+
+        self.stdout.write(f'{"query":<16}{"orm ms":>10}{"engine ms":>12}')
+        for name, timings in report.items():
+            self.stdout.write(f'{name:<16}{timings["orm_ms"]:>10}'
+                              f'{timings["engine_ms"]:>12}')
+        self.stdout.write(f'Загрузка движка: {load_ms} мс, '
+                          f'обновление без изменений: {refresh_ms} мс')
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump({'queries': report, 'load_ms': load_ms,
+                           'refresh_ms': refresh_ms,
+                           'products': len(engine.columns['id']),
+                           'repeat': options['repeat']},
+                          file, indent=2, ensure_ascii=False)
+
+    @staticmethod
+    def queries(rng, page_size):
+        # Типичные запросы анонимного просмотра каталога
+        shop_id = rng.choice(list(Shop.objects.filter(
+            state=True).values_list('id', flat=True)))
+        category_id = rng.choice(list(Category.objects.values_list(
+            'id', flat=True)))
+        prices = ProductInfo.objects.aggregate(low=Min('price'),
+                                               high=Max('price'))
+        middle = (prices['low'] + prices['high']) // 2
+        page = f'limit={page_size}'
+        return {
+            'first page': page,
+            'deep page': f'{page}&offset={page_size * 100}',
+            'shop by price': f'shop_id={shop_id}&sort=price&{page}',
+            'category': f'category_id={category_id}&in_stock=1'
+                        f'&sort=-price&{page}',
+            'price range': f'price_min={prices["low"]}&price_max={middle}'
+                           f'&sort=price&{page}&offset={page_size * 10}',
+        }
+
+    @staticmethod
+    def measure(operation, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            operation()
+            timings.append(time.perf_counter() - started)
+        return round(statistics.median(timings) * 1000, 2)
@@ -0,0 +1,150 @@
+# backend/management/commands/bench_parameters.py
+import json
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Prefetch
+
+from shop.models import ProductInfo, ProductParameter, ParameterValue
+
+
+class Rollback(Exception):
+    """
+    Отмена транзакции после замера записи
+    """
+
+
+class Command(BaseCommand):
+    help = ('Compare reading, filtering and writing product parameters: '
+            'ProductParameter rows against the ProductInfo.parameters '
+            'JSON column')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=100,
+                            help='Products read or written per operation')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Runs per operation, the median is shown')
+        parser.add_argument('--parameter', default='Цвет',
+                            help='Parameter name for the filter benchmark')
+        parser.add_argument('--value', default='черный',
+                            help='Parameter value for the filter benchmark')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help='Write the report as JSON')
+
+    def handle(self, *args, **options):
+        ids = list(ProductInfo.objects.values_list('id', flat=True))
+        if not ids:
+            raise CommandError(
+                'Нет товаров, запустите seed_benchmark_data')
+        rng = random.Random(options['seed'])
+        page_size = min(options['page_size'], len(ids))
+        pages = [rng.sample(ids, page_size)
+                 for _ in range(options['repeat'])]
+        name, value = options['parameter'], options['value']
+
+        operations = {
+            'read': (self.read_eav, self.read_json),
+            'filter': (lambda page: self.filter_eav(name, value),
+                       lambda page: self.filter_json(name, value)),
+            'write': (self.write_eav, self.write_json),
+        }
+        report = {}
+        for operation, (eav, json_column) in operations.items():
+            report[operation] = {
+                'eav_ms': self.measure(eav, pages),
+                'json_ms': self.measure(json_column, pages),
+            }
+
+        self.stdout.write(f'{"operation":<10}{"eav ms":>10}{"json ms":>10}')
+        for operation, timings in report.items():
+            self.stdout.write(f'{operation:<10}{timings["eav_ms"]:>10}'
+                              f'{timings["json_ms"]:>10}')
+        plan = self.filter_plan(name, value)
+        self.stdout.write('План фильтра по JSON: ' + '; '.join(plan))
+
+        if options['output']:
+            report.update(products=len(ids), page_size=page_size,
+                          repeat=options['repeat'], filter_plan=plan)
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, indent=2, ensure_ascii=False)
+
+    @staticmethod
+    def measure(operation, pages):
+        # Каждая операция возвращает время своей части в секундах
+        timings = [operation(page) for page in pages]
+        return round(statistics.median(timings) * 1000, 2)
+
+    @staticmethod
+    def timed(function):
+        started = time.perf_counter()
+        function()
+        return time.perf_counter() - started
+
+    def read_eav(self, page):
+        def read():
+            return {
+                info.id: {parameter.parameter.name: parameter.value
+                          for parameter in info.product_parameters.all()}
+                for info in ProductInfo.objects.filter(id__in=page).only(
+                    'id').prefetch_related(Prefetch(
+                        'product_parameters',
+                        queryset=ProductParameter.objects.select_related(
+                            'parameter')))
+            }
+        return self.timed(read)
+
+    def read_json(self, page):
+        return self.timed(lambda: dict(ProductInfo.objects.filter(
+            id__in=page).values_list('id', 'parameters')))
+
+    def filter_eav(self, name, value):
+        return self.timed(lambda: ProductInfo.objects.filter(
+            product_parameters__parameter__name=name,
+            product_parameters__value=value).count())
+
+    def filter_json(self, name, value):
+        return self.timed(lambda: ProductInfo.objects.alias(
+            param=ParameterValue(name)).filter(param=value).count())
+
+    @staticmethod
+    def filter_plan(name, value):
+        sql, params = ProductInfo.objects.alias(
+            param=ParameterValue(name)).filter(param=value).values(
+            'id').query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def rolled_back(self, write):
+        # Запись замеряется в транзакции, которая затем отменяется
+        elapsed = None
+        try:
+            with transaction.atomic():
+                elapsed = self.timed(write)
+                raise Rollback
+        except Rollback:
+            return elapsed
+
+    def write_eav(self, page):
+        # Перезапись значений товаров, как при импорте прайс-листа
+        rows = list(ProductParameter.objects.filter(
+            product_info_id__in=page).values_list(
+            'product_info_id', 'parameter_id', 'value'))
+
+        def write():
+            ProductParameter.objects.filter(product_info_id__in=page).delete()
+            ProductParameter.objects.bulk_create([
+                ProductParameter(product_info_id=info_id,
+                                 parameter_id=parameter_id, value=value)
+                for info_id, parameter_id, value in rows
+            ], batch_size=1000)
+        return self.rolled_back(write)
+
+    def write_json(self, page):
+        infos = list(ProductInfo.objects.filter(id__in=page).only(
+            'id', 'parameters'))
+        return self.rolled_back(
+            lambda: ProductInfo.objects.bulk_update(infos, ['parameters']))
@@ -0,0 +1,54 @@
+# backend/management/commands/dispatch_webhooks.py
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from shop.webhooks import dispatch_pending
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued partner webhook events as batched signed POSTs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Events taken from the queue per round')
+        parser.add_argument('--per-shop', type=int, default=100,
+                            help='Events per POST to one shop')
+        parser.add_argument('--concurrency', type=int, default=10,
+                            help='Simultaneous deliveries')
+        parser.add_argument('--max-attempts', type=int, default=8,
+                            help='Attempts before an event is marked failed')
+        parser.add_argument('--backoff', type=int, default=30,
+                            help='Base retry delay in seconds, doubled '
+                                 'after every failed attempt')
+        parser.add_argument('--timeout', type=float, default=10,
+                            help='HTTP timeout per delivery in seconds')
+        parser.add_argument('--lease', type=int, default=300,
+                            help='Seconds claimed events stay hidden from '
+                                 'other dispatchers')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling the queue')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds between polls in --loop mode')
+
+    def handle(self, *args, **options):
+        asyncio.run(self.run(options))
+
+    async def run(self, options):
+        while True:
+            delivered, failed = await dispatch_pending(
+                batch_size=options['batch_size'],
+                per_shop=options['per_shop'],
+                concurrency=options['concurrency'],
+                max_attempts=options['max_attempts'],
+                backoff=options['backoff'],
+                timeout=options['timeout'],
+                lease=options['lease'],
+            )
+            if delivered or failed:
+                self.stdout.write(
+                    f'Доставлено событий: {delivered}, ошибок: {failed}')
+            if not options['loop']:
+                break
+            if not delivered and not failed:
+                await asyncio.sleep(options['interval'])
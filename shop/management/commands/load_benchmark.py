@@ -0,0 +1,168 @@
+# backend/management/commands/load_benchmark.py
+import itertools
+import json
+import random
+import subprocess
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from shop.bench import run_load, scenario_task
+from shop.management.commands.seed_benchmark_data import EMAIL_DOMAIN
+from shop.models import Contact, Order, ProductInfo
+
+
+def git_revision():
+    """
+    Текущий коммит и признак незафиксированных изменений
+    """
+    def git(*args):
+        return subprocess.run(['git', *args], cwd=settings.BASE_DIR,
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    try:
+        return git('rev-parse', 'HEAD'), bool(git('status', '--porcelain'))
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+class Command(BaseCommand):
+    help = ('Drive the API with concurrent buyer and partner scenarios '
+            'over the seeded benchmark dataset and write a JSON report')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000',
+                            help='Base URL of the running server')
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--duration', type=float, default=60,
+                            help='Seconds to keep the load running')
+        parser.add_argument('--users', type=int, default=200,
+                            help='Seeded buyers taking part in the run')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', default='load_benchmark.json',
+                            help='Path of the JSON report')
+
+    def handle(self, *args, **options):
+        base_url = f'{options["url"].rstrip("/")}/api/v1/'
+        rng = random.Random(options['seed'])
+
+        buyers = list(Token.objects.filter(
+            user__email__endswith=f'@{EMAIL_DOMAIN}', user__type='buyer'
+        ).values_list('user_id', 'key')[:options['users']])
+        partners = list(Token.objects.filter(
+            user__email__endswith=f'@{EMAIL_DOMAIN}', user__type='shop'
+        ).values_list('key', flat=True))
+        if not buyers or not partners:
+            raise CommandError(
+                'Нет данных для нагрузки, запустите seed_benchmark_data')
+
+        contacts = dict(Contact.objects.filter(
+            user_id__in=[user_id for user_id, _ in buyers]
+        ).values_list('user_id', 'id'))
+        offers = list(ProductInfo.objects.filter(shop__state=True).values_list(
+            'id', 'shop_id', 'product__category_id')[:10000])
+
+        buyer_tasks = [
+            scenario_task('buyer', self.buyer_scenario(
+                base_url, key, contacts[user_id], offers,
+                random.Random(rng.random())))
+            for user_id, key in buyers
+        ]
+        partner_tasks = [
+            scenario_task('partner', self.partner_scenario(base_url, key))
+            for key in partners
+        ]
+        # Партнерские сценарии равномерно перемешаны с покупательскими
+        step = max(len(buyer_tasks) // len(partner_tasks), 1)
+        tasks = []
+        for index, buyer_task in enumerate(buyer_tasks):
+            tasks.append(buyer_task)
+            if index % step == 0:
+                tasks.append(
+                    partner_tasks[index // step % len(partner_tasks)])
+
+        self.stdout.write(
+            f'Нагрузка {options["duration"]} с, '
+            f'{options["concurrency"]} клиентов на {base_url}')
+        started_at = timezone.now()
+        endpoints = run_load(tasks, options['concurrency'],
+                             options['duration'])
+
+        commit, dirty = git_revision()
+        report = {
+            'commit': commit,
+            'dirty': dirty,
+            'started_at': started_at.isoformat(),
+            'url': options['url'],
+            'concurrency': options['concurrency'],
+            'duration': options['duration'],
+            'dataset': {
+                'product_infos': ProductInfo.objects.count(),
+                'orders': Order.objects.exclude(state='basket').count(),
+                'buyers': len(buyers),
+                'partners': len(partners),
+            },
+            'endpoints': endpoints,
+        }
+        with open(options['output'], 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2, ensure_ascii=False)
+
+        self.stdout.write(f'{"endpoint":<16}{"requests":>9}{"rps":>9}'
+                          f'{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}'
+                          f'{"errors":>8}')
+        for name, stats in endpoints.items():
+            self.stdout.write(
+                f'{name:<16}{stats["requests"]:>9}{stats["rps"]:>9}'
+                f'{stats["p50_ms"]:>9}{stats["p95_ms"]:>9}'
+                f'{stats["p99_ms"]:>9}{stats["errors"]:>8}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Отчет записан в {options["output"]}'))
+
+    @staticmethod
+    def buyer_scenario(base_url, key, contact_id, offers, rng):
+        """
+        Просмотр каталога, поиск, корзина и оформление заказа
+        """
+        headers = {'Authorization': f'Token {key}'}
+
+        def scenario(call):
+            offer_id, shop_id, category_id = rng.choice(offers)
+            call('categories', 'GET', f'{base_url}categories')
+            call('products', 'GET',
+                 f'{base_url}products?category_id={category_id}')
+            call('search', 'GET', f'{base_url}products?shop_id={shop_id}'
+                                  f'&category_id={category_id}')
+            call('product-detail', 'GET', f'{base_url}products/{offer_id}/',
+                 headers=headers)
+            call('basket-add', 'POST', f'{base_url}basket', headers=headers,
+                 data={'items': json.dumps(
+                     [{'product_info': offer_id, 'quantity': 1}])})
+            baskets = call('basket', 'GET', f'{base_url}basket',
+                           headers=headers).json()
+            if not isinstance(baskets, list) or not baskets:
+                return
+            basket = baskets[0]
+            call('basket-update', 'PUT', f'{base_url}basket', headers=headers,
+                 data={'items': json.dumps([
+                     {'id': item['id'], 'quantity': 2}
+                     for item in itertools.islice(
+                         basket['ordered_items'], 3)
+                 ])})
+            call('order', 'POST', f'{base_url}order', headers=headers,
+                 data={'id': basket['id'], 'contact': contact_id})
+            call('orders', 'GET', f'{base_url}order', headers=headers)
+        return scenario
+
+    @staticmethod
+    def partner_scenario(base_url, key):
+        """
+        Просмотр заказов магазина
+        """
+        headers = {'Authorization': f'Token {key}'}
+
+        def scenario(call):
+            call('partner-orders', 'GET', f'{base_url}partner/orders',
+                 headers=headers)
+        return scenario
@@ -0,0 +1,121 @@
+# backend/management/commands/profile_imports.py
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Зависимости, которые должны загружаться только при использовании
+WATCHED_MODULES = ('requests', 'yaml', 'ujson', 'numpy')
+
+# Запуск рабочего процесса: WSGI приложение и первый запрос к нему
+STARTUP_SCRIPT = '''
+import json, sys, time
+started = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+ready = time.perf_counter()
+
+from wsgiref.util import setup_testing_defaults
+environ = {'PATH_INFO': sys.argv[1], 'HTTP_HOST': 'localhost'}
+setup_testing_defaults(environ)
+status = []
+body = application(environ, lambda code, headers: status.append(code))
+b''.join(body)
+done = time.perf_counter()
+
+print(json.dumps({
+    'startup_ms': (ready - started) * 1000,
+    'first_request_ms': (done - started) * 1000,
+    'status': status[0],
+    'loaded': sorted(name for name in %r if name in sys.modules),
+}))
+'''
+
+
+def parse_importtime(output):
+    """
+    Разбор вывода -X importtime: имя модуля -> (собственное время,
+    время с вложенными импортами) в микросекундах
+    """
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+class Command(BaseCommand):
+    help = ('Profile worker cold start: module import times via '
+            '-X importtime and time to the first request')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/api/v1/categories',
+                            help='Path of the first request')
+        parser.add_argument('--top', type=int, default=20,
+                            help='Slowest modules to show')
+        parser.add_argument('--runs', type=int, default=5,
+                            help='Cold starts to time, the median is shown')
+        parser.add_argument('--output', help='Write the report as JSON')
+
+    def run_worker(self, *flags):
+        env = dict(os.environ,
+                   DJANGO_SETTINGS_MODULE=os.environ.get(
+                       'DJANGO_SETTINGS_MODULE', 'Diplom.settings'))
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, *flags, '-c', STARTUP_SCRIPT % (WATCHED_MODULES,),
+             self.path],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        elapsed = (time.perf_counter() - started) * 1000
+        if result.returncode:
+            raise CommandError(result.stderr)
+        stats = json.loads(result.stdout.strip().splitlines()[-1])
+        stats['process_ms'] = elapsed
+        return stats, result.stderr
+
+    def handle(self, *args, **options):
+        self.path = options['path']
+
+        _, importtime = self.run_worker('-X', 'importtime')
+        modules = parse_importtime(importtime)
+        top = sorted(modules.items(), key=lambda item: item[1][1],
+                     reverse=True)[:options['top']]
+
+        # Время запуска меряется без -X importtime: профилирование само
+        # замедляет импорт
+        runs = [self.run_worker()[0] for _ in range(options['runs'])]
+        summary = {
+            key: round(statistics.median(run[key] for run in runs), 1)
+            for key in ('startup_ms', 'first_request_ms', 'process_ms')
+        }
+
+        self.stdout.write(f'{"module":<50}{"self ms":>10}{"total ms":>10}')
+        for name, (self_us, cumulative_us) in top:
+            self.stdout.write(f'{name:<50}{self_us / 1000:>10.1f}'
+                              f'{cumulative_us / 1000:>10.1f}')
+        self.stdout.write('')
+        self.stdout.write(
+            f'Запуск приложения: {summary["startup_ms"]} мс, '
+            f'до первого ответа: {summary["first_request_ms"]} мс '
+            f'(статус {runs[0]["status"]}), процесс целиком: '
+            f'{summary["process_ms"]} мс, медиана {len(runs)} запусков')
+        loaded = runs[0]['loaded']
+        self.stdout.write('Загружены при старте: '
+                          + (', '.join(loaded) if loaded else 'нет'))
+
+        if options['output']:
+            report = dict(summary, path=self.path, runs=len(runs),
+                          status=runs[0]['status'], loaded=loaded,
+                          modules={name: {'self_us': self_us,
+                                          'cumulative_us': cumulative_us}
+                                   for name, (self_us, cumulative_us)
+                                   in top})
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, indent=2)
@@ -0,0 +1,13 @@
+# backend/management/commands/rebuild_category_stats.py
+from django.core.management.base import BaseCommand
+
+from shop.services import rebuild_category_stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild CategoryShopStats product counts for all categories'
+
+    def handle(self, *args, **options):
+        rows = rebuild_category_stats()
+        self.stdout.write(self.style.SUCCESS(
+            f'Статистика категорий пересчитана, строк: {rows}'))
@@ -0,0 +1,23 @@
+# backend/management/commands/rebuild_product_offers.py
+from django.core.management.base import BaseCommand
+
+from shop.models import Product
+from shop.services import refresh_product_offers
+
+
+class Command(BaseCommand):
+    help = 'Rebuild ProductOffers price comparison summaries for all products'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Products refreshed per transaction')
+
+    def handle(self, *args, **options):
+        ids = Product.objects.order_by('id').values_list('id', flat=True)
+        refreshed, last_id = 0, 0
+        while batch := list(ids.filter(id__gt=last_id)[
+                :options['batch_size']]):
+            last_id = batch[-1]
+            refreshed += refresh_product_offers(batch, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Сводки предложений пересчитаны: {refreshed}'))
@@ -0,0 +1,47 @@
+# backend/management/commands/refresh_price_lists.py
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from shop.price_refresh import refresh_due_shops
+
+
+class Command(BaseCommand):
+    help = 'Periodically refresh active shops price lists from Shop.url'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=3600,
+                            help='Seconds between refreshes of one shop')
+        parser.add_argument('--jitter', type=int, default=300,
+                            help='Random spread of refresh times in seconds')
+        parser.add_argument('--concurrency', type=int, default=10,
+                            help='Simultaneous downloads')
+        parser.add_argument('--timeout', type=float, default=30,
+                            help='HTTP timeout per download in seconds')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running as a scheduler')
+        parser.add_argument('--poll', type=float, default=30,
+                            help='Seconds between schedule checks')
+
+    def handle(self, *args, **options):
+        asyncio.run(self.run(options))
+
+    async def run(self, options):
+        while True:
+            refreshes = await refresh_due_shops(
+                interval=options['interval'],
+                jitter=options['jitter'],
+                concurrency=options['concurrency'],
+                timeout=options['timeout'],
+            )
+            for refresh in refreshes:
+                message = (f'{refresh.shop}: {refresh.outcome} '
+                           f'за {refresh.duration:.2f} с')
+                if refresh.outcome == 'error':
+                    self.stderr.write(
+                        self.style.ERROR(f'{message} ({refresh.error})'))
+                else:
+                    self.stdout.write(message)
+            if not options['loop']:
+                break
+            await asyncio.sleep(options['poll'])
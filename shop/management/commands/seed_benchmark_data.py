@@ -0,0 +1,247 @@
+# backend/management/commands/seed_benchmark_data.py
+import random
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from shop.models import User, Shop, Category, Product, ProductInfo, \
+    Parameter, ProductParameter, Contact, Order, OrderItem, ShopOrder, \
+    INDEXED_PARAMETERS
+from shop.services import numeric_value, rebuild_sales_rollups, \
+    refresh_product_offers, rebuild_category_stats
+
+# Все записи набора отмечены доменом почты и префиксом названий
+EMAIL_DOMAIN = 'bench.example'
+NAME_PREFIX = 'Bench'
+PASSWORD = 'bench-password'
+
+ORDER_STATES = ('delivered', 'canceled', 'sent', 'assembled', 'confirmed',
+                'new')
+ORDER_STATE_WEIGHTS = (70, 10, 5, 5, 5, 5)
+HISTORY_DAYS = 365
+COLORS = ('черный', 'белый', 'серебристый', 'золотистый', 'красный',
+          'синий', 'зеленый')
+MEMORY_SIZES = (32, 64, 128, 256, 512)
+
+
+class Command(BaseCommand):
+    help = ('Seed a reproducible benchmark dataset: shops, catalog, users, '
+            'contacts, baskets and order history')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shops', type=int, default=20)
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--products', type=int, default=20000)
+        parser.add_argument('--offers', type=int, default=5,
+                            help='ProductInfo rows per product, each in '
+                                 'a different shop')
+        parser.add_argument('--parameters', type=int, default=4,
+                            help='Generated parameters per ProductInfo in '
+                                 'addition to the indexed ones')
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--orders', type=int, default=20,
+                            help='Order history length per user')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--reset', action='store_true',
+                            help='Delete a previously seeded dataset first')
+
+    def handle(self, *args, **options):
+        if options['offers'] > options['shops']:
+            raise CommandError('--offers не может быть больше --shops')
+
+        seeded = User.objects.filter(email__endswith=f'@{EMAIL_DOMAIN}')
+        if seeded.exists():
+            if not options['reset']:
+                raise CommandError(
+                    'Набор данных уже создан, используйте --reset')
+            self.reset()
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        started = time.monotonic()
+        with transaction.atomic():
+            shops = self.seed_shops(options['shops'])
+            offers = self.seed_catalog(shops, options['categories'],
+                                       options['products'], options['offers'],
+                                       options['parameters'])
+            users = self.seed_users(options['users'])
+            self.seed_orders(users, offers, options['orders'])
+            refresh_product_offers({offer.product_id for offer in offers},
+                                   self.batch_size)
+            rebuild_category_stats()
+
+        today = timezone.localdate()
+        rebuild_sales_rollups(today - timedelta(days=HISTORY_DAYS), today)
+        self.stdout.write(self.style.SUCCESS(
+            f'Набор данных создан за {time.monotonic() - started:.1f} с, '
+            f'пароль пользователей: {PASSWORD}'))
+
+    def reset(self):
+        # Удаление пользователей каскадом удаляет магазины, товары
+        # магазинов, контакты и заказы
+        with transaction.atomic():
+            User.objects.filter(email__endswith=f'@{EMAIL_DOMAIN}').delete()
+            Category.objects.filter(name__startswith=NAME_PREFIX).delete()
+            Parameter.objects.filter(name__startswith=NAME_PREFIX).delete()
+        self.stdout.write('Предыдущий набор данных удален')
+
+    def create(self, model, objects):
+        created = model.objects.bulk_create(objects,
+                                            batch_size=self.batch_size)
+        self.stdout.write(f'  {model.__name__}: {len(created)}')
+        return created
+
+    def seed_shops(self, count):
+        password = make_password(PASSWORD)
+        owners = self.create(User, [
+            User(email=f'shop{index}@{EMAIL_DOMAIN}', type='shop',
+                 is_active=True, password=password,
+                 company=f'{NAME_PREFIX} shop {index}')
+            for index in range(count)
+        ])
+        self.create(Token, [Token(key=Token.generate_key(), user=owner)
+                            for owner in owners])
+        return self.create(Shop, [
+            Shop(name=f'{NAME_PREFIX} shop {index}', user=owner)
+            for index, owner in enumerate(owners)
+        ])
+
+    def seed_catalog(self, shops, categories_count, products_count,
+                     offers_count, parameters_count):
+        categories = self.create(Category, [
+            Category(name=f'{NAME_PREFIX} category {index}')
+            for index in range(categories_count)
+        ])
+        parameters = self.create(Parameter, [
+            Parameter(name=f'{NAME_PREFIX} parameter {index}')
+            for index in range(max(parameters_count * 5, 1))
+        ])
+        # Индексируемые параметры общие с реальным каталогом и при --reset
+        # не удаляются
+        indexed = [Parameter.objects.get_or_create(name=name)[0]
+                   for name in INDEXED_PARAMETERS]
+        products = self.create(Product, [
+            Product(name=f'{NAME_PREFIX} product {index}',
+                    category=self.rng.choice(categories))
+            for index in range(products_count)
+        ])
+
+        external_ids = defaultdict(int)
+        offers = []
+        for product in products:
+            for shop in self.rng.sample(shops, offers_count):
+                external_ids[shop.id] += 1
+                price = self.rng.randrange(100, 100000, 10)
+                values = self.indexed_values()
+                values.update(
+                    (parameter.name, str(self.rng.randint(1, 1000)))
+                    for parameter in self.rng.sample(parameters,
+                                                     parameters_count))
+                offers.append(ProductInfo(
+                    product=product, shop=shop,
+                    external_id=external_ids[shop.id],
+                    model=f'M-{product.id}-{shop.id}',
+                    quantity=self.rng.randint(0, 500), price=price,
+                    price_rrc=price + price // 10, parameters=values))
+        offers = self.create(ProductInfo, offers)
+
+        parameter_ids = {parameter.name: parameter.id
+                         for parameter in parameters + indexed}
+        self.create(ProductParameter, [
+            ProductParameter(product_info=offer,
+                             parameter_id=parameter_ids[name], value=value,
+                             value_numeric=numeric_value(value))
+            for offer in offers
+            for name, value in offer.parameters.items()
+        ])
+        self.create(Category.shops.through, [
+            Category.shops.through(category_id=category_id, shop_id=shop_id)
+            for category_id, shop_id in {
+                (offer.product.category_id, offer.shop_id)
+                for offer in offers
+            }
+        ])
+        return offers
+
+    def indexed_values(self):
+        # Значения индексируемых параметров в формате прайс-листов
+        return {
+            'Цвет': self.rng.choice(COLORS),
+            'Встроенная память (Гб)': str(self.rng.choice(MEMORY_SIZES)),
+            'Диагональ (дюйм)': str(self.rng.randrange(50, 70) / 10),
+        }
+
+    def seed_users(self, count):
+        password = make_password(PASSWORD)
+        users = self.create(User, [
+            User(email=f'user{index}@{EMAIL_DOMAIN}', type='buyer',
+                 is_active=True, password=password,
+                 first_name=f'{NAME_PREFIX} {index}')
+            for index in range(count)
+        ])
+        self.create(Token, [Token(key=Token.generate_key(), user=user)
+                            for user in users])
+        self.create(Contact, [
+            Contact(user=user, city='Москва', street='Тверская',
+                    house=str(self.rng.randint(1, 100)),
+                    phone=f'+7900{index:07d}')
+            for index, user in enumerate(users)
+        ])
+        return users
+
+    def seed_orders(self, users, offers, orders_per_user):
+        contacts = dict(Contact.objects.filter(user__in=users)
+                        .values_list('user_id', 'id'))
+        now = timezone.now()
+
+        # Заказы создаются в порядке времени, чтобы после вставки
+        # проставить dt диапазонами ID (bulk_create заполняет auto_now_add)
+        planned = sorted(
+            ((self.rng.randrange(HISTORY_DAYS * 24), user)
+             for user in users for _ in range(orders_per_user)),
+            key=lambda plan: plan[0])
+        orders = self.create(Order, [
+            Order(user=user, contact_id=contacts[user.id],
+                  state=self.rng.choices(ORDER_STATES,
+                                         ORDER_STATE_WEIGHTS)[0])
+            for _, user in planned
+        ] + [Order(user=user, state='basket') for user in users])
+
+        hours = defaultdict(list)
+        order_dt = {}
+        for (hours_ago, _), order in zip(planned, orders):
+            hours[hours_ago].append(order.id)
+        for hours_ago, ids in hours.items():
+            dt = now - timedelta(hours=hours_ago,
+                                 minutes=self.rng.randrange(60))
+            Order.objects.filter(id__gte=min(ids), id__lte=max(ids)) \
+                .update(dt=dt)
+            order_dt.update(dict.fromkeys(ids, dt))
+
+        items = []
+        shop_orders = {}
+        for order in orders:
+            for offer in self.rng.sample(offers, self.rng.randint(1, 4)):
+                quantity = self.rng.randint(1, 3)
+                if order.state == 'basket':
+                    items.append(OrderItem(order=order, product_info=offer,
+                                           quantity=quantity))
+                    continue
+                items.append(OrderItem(order=order, product_info=offer,
+                                       quantity=quantity, price=offer.price))
+                shop_order = shop_orders.get((order.id, offer.shop_id))
+                if shop_order is None:
+                    shop_order = shop_orders[order.id, offer.shop_id] = \
+                        ShopOrder(order=order, shop_id=offer.shop_id,
+                                  dt=order_dt[order.id])
+                shop_order.total_sum += quantity * offer.price
+                shop_order.items_count += 1
+        self.create(OrderItem, items)
+        self.create(ShopOrder, list(shop_orders.values()))
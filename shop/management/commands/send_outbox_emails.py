@@ -0,0 +1,50 @@
+# backend/management/commands/send_outbox_emails.py
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from shop.services import send_outbox_batch
+
+
+class Command(BaseCommand):
+    help = 'Send queued emails from the outbox over a reused SMTP connection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Emails taken from the outbox per batch')
+        parser.add_argument('--max-attempts', type=int, default=5,
+                            help='Attempts before an email is marked failed')
+        parser.add_argument('--backoff', type=int, default=60,
+                            help='Base retry delay in seconds, doubled '
+                                 'after every failed attempt')
+        parser.add_argument('--lease', type=int, default=300,
+                            help='Seconds a claimed batch is hidden from '
+                                 'other workers')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling the outbox')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds between polls in --loop mode')
+
+    def handle(self, *args, **options):
+        connection = get_connection(fail_silently=False)
+        try:
+            while True:
+                sent, failed = send_outbox_batch(
+                    connection, options['batch_size'],
+                    options['max_attempts'], options['backoff'],
+                    options['lease'])
+                if sent or failed:
+                    self.stdout.write(
+                        f'Отправлено: {sent}, ошибок: {failed}')
+
+                # Пока очередь полная, следующую пачку берем сразу
+                if sent + failed >= options['batch_size']:
+                    continue
+                if not options['loop']:
+                    break
+                # Простаивающее соединение закрываем до следующей пачки
+                connection.close()
+                time.sleep(options['interval'])
+        finally:
+            connection.close()
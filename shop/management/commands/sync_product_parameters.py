@@ -0,0 +1,26 @@
+# backend/management/commands/sync_product_parameters.py
+from django.core.management.base import BaseCommand
+
+from shop.models import ProductInfo
+from shop.services import sync_product_parameters
+
+
+class Command(BaseCommand):
+    help = ('Copy ProductParameter rows into the ProductInfo.parameters '
+            'JSON column')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shop', type=int, dest='shop_id',
+                            help='Only products of this shop')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Products updated per bulk_update')
+
+    def handle(self, *args, **options):
+        product_info_ids = None
+        if options['shop_id']:
+            product_info_ids = ProductInfo.objects.filter(
+                shop_id=options['shop_id']).values('id')
+        synced = sync_product_parameters(product_info_ids,
+                                         options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Параметры перенесены, товаров: {synced}'))
@@ -0,0 +1,50 @@
+# backend/management/commands/sync_replica.py
+import os
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.db_router import replica_aliases
+
+
+class Command(BaseCommand):
+    help = 'Copy the primary SQLite database into the read replicas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep copying at a fixed interval')
+        parser.add_argument('--interval', type=float, default=2,
+                            help='Seconds between copies in --loop mode')
+
+    def handle(self, *args, **options):
+        aliases = replica_aliases()
+        if not aliases:
+            raise CommandError('Реплики не настроены, укажите DB_REPLICAS')
+
+        while True:
+            for alias in aliases:
+                started = time.monotonic()
+                self.copy(settings.DATABASES['default']['NAME'],
+                          settings.DATABASES[alias]['NAME'])
+                self.stdout.write(
+                    f'{alias}: скопировано за '
+                    f'{time.monotonic() - started:.3f} с')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    @staticmethod
+    def copy(source_path, replica_path):
+        # Копия через backup API согласована даже при идущей записи,
+        # а замена файла целиком не дает читателям увидеть половину копии
+        tmp_path = f'{replica_path}.tmp'
+        source = sqlite3.connect(source_path)
+        target = sqlite3.connect(tmp_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        os.replace(tmp_path, replica_path)
@@ -0,0 +1,273 @@
+# metrics.py
+import hmac
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+
+from .authentication import token_cache_stats
+from .throttling import throttle_stats
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограммы задержки в секундах
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Сколько запросов SQL хранится для журнала медленных запросов
+MAX_LOGGED_QUERIES = 200
+
+_current = ContextVar('metrics_request', default=None)
+_serializer_depth = ContextVar('metrics_serializer_depth', default=0)
+
+
+class RequestStats:
+    """
+    Счетчики одного запроса: SQL и время сериализации
+    """
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        # Обертка connection.execute_wrapper вокруг каждого запроса SQL
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.sql_count += 1
+            self.sql_time += duration
+            if len(self.queries) < MAX_LOGGED_QUERIES:
+                self.queries.append((duration, sql))
+
+
+class RouteMetrics:
+    """
+    Накопленные метрики одного именованного маршрута
+    """
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.latency = 0.0
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+        self.response_bytes = 0
+        self.statuses = {}
+
+    def observe(self, duration, stats, status, size):
+        index = bisect_left(LATENCY_BUCKETS, duration)
+        if index < len(self.buckets):
+            self.buckets[index] += 1
+        self.count += 1
+        self.latency += duration
+        self.sql_count += stats.sql_count
+        self.sql_time += stats.sql_time
+        self.serializer_time += stats.serializer_time
+        self.response_bytes += size
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+
+class MetricsRegistry:
+    """
+    Метрики запросов текущего процесса по именам маршрутов
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def observe(self, route, duration, stats, status, size):
+        with self._lock:
+            metrics = self._routes.get(route)
+            if metrics is None:
+                metrics = self._routes[route] = RouteMetrics()
+            metrics.observe(duration, stats, status, size)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                route: dict(vars(metrics), buckets=list(metrics.buckets),
+                            statuses=dict(metrics.statuses))
+                for route, metrics in self._routes.items()
+            }
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+
+
+registry = MetricsRegistry()
+
+
+class TimedSerializerMixin:
+    """
+    Учет времени сериализации ответа в метриках текущего запроса
+
+    Время считается только для сериализатора верхнего уровня, вложенные
+    сериализаторы в него уже входят.
+    """
+
+    def to_representation(self, instance):
+        stats = _current.get()
+        depth = _serializer_depth.get()
+        if stats is None or depth:
+            token = _serializer_depth.set(depth + 1)
+            try:
+                return super().to_representation(instance)
+            finally:
+                _serializer_depth.reset(token)
+
+        token = _serializer_depth.set(1)
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            stats.serializer_time += time.perf_counter() - started
+            _serializer_depth.reset(token)
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match._func_path
+
+
+def response_size(response):
+    if response.streaming:
+        return int(response.get('Content-Length') or 0)
+    return len(response.content)
+
+
+class MetricsMiddleware:
+    """
+    Сбор метрик запроса: задержка, число и время запросов SQL, время
+    сериализации и размер ответа
+
+    Запросы дольше METRICS_SLOW_REQUEST_SECONDS пишутся в журнал вместе
+    с самыми долгими запросами SQL.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(
+                        connections[alias].execute_wrapper(stats))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        duration = time.perf_counter() - started
+
+        route = route_name(request)
+        registry.observe(route, duration, stats, response.status_code,
+                         response_size(response))
+        if duration >= getattr(settings, 'METRICS_SLOW_REQUEST_SECONDS', 1):
+            self.log_slow_request(request, route, duration, stats)
+        return response
+
+    @staticmethod
+    def log_slow_request(request, route, duration, stats):
+        slowest = sorted(stats.queries, reverse=True)[:5]
+        logger.warning(
+            'Медленный запрос %s %s (%s): %.3f с, '
+            'SQL: %d запросов за %.3f с, сериализация %.3f с\n%s',
+            request.method, request.path, route, duration, stats.sql_count,
+            stats.sql_time, stats.serializer_time,
+            '\n'.join(f'{sql_time:.4f} с: {sql}'
+                      for sql_time, sql in slowest))
+
+
+def _labels(**labels):
+    return ','.join(f'{name}="{value}"' for name, value in labels.items())
+
+
+def render_metrics():
+    """
+    Метрики процесса в текстовом формате Prometheus
+    """
+    routes = sorted(registry.snapshot().items())
+
+    lines = ['# TYPE http_request_duration_seconds histogram']
+    for route, metrics in routes:
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',),
+                                metrics['buckets'] + [None]):
+            cumulative = metrics['count'] if count is None \
+                else cumulative + count
+            lines.append('http_request_duration_seconds_bucket{%s} %d'
+                         % (_labels(route=route, le=bound), cumulative))
+        lines += [
+            'http_request_duration_seconds_sum{%s} %.6f'
+            % (_labels(route=route), metrics['latency']),
+            'http_request_duration_seconds_count{%s} %d'
+            % (_labels(route=route), metrics['count']),
+        ]
+
+    lines.append('# TYPE http_requests_total counter')
+    for route, metrics in routes:
+        for status, count in sorted(metrics['statuses'].items()):
+            lines.append('http_requests_total{%s} %d'
+                         % (_labels(route=route, status=status), count))
+
+    for name, field, fmt in (
+            ('http_sql_queries_total', 'sql_count', '%d'),
+            ('http_sql_duration_seconds_total', 'sql_time', '%.6f'),
+            ('http_serializer_duration_seconds_total', 'serializer_time',
+             '%.6f'),
+            ('http_response_bytes_total', 'response_bytes', '%d')):
+        lines.append(f'# TYPE {name} counter')
+        for route, metrics in routes:
+            lines.append(f'{name}{{%s}} {fmt}'
+                         % (_labels(route=route), metrics[field]))
+
+    token_stats = token_cache_stats()
+    lines.append('# TYPE token_cache_lookups_total counter')
+    for result in ('local_hits', 'shared_hits', 'misses'):
+        lines.append('token_cache_lookups_total{%s} %d'
+                     % (_labels(result=result), token_stats[result]))
+    lines += [
+        '# TYPE token_cache_size gauge',
+        f'token_cache_size {token_stats["size"]}',
+        '# TYPE throttle_rejections_total counter',
+    ]
+    for key, count in sorted(throttle_stats().items()):
+        lines.append('throttle_rejections_total{%s} %d'
+                     % (_labels(scope=key), count))
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """
+    Конечная точка /metrics для Prometheus
+
+    Если задан METRICS_TOKEN, запрос должен содержать заголовок
+    "Authorization: Bearer <METRICS_TOKEN>". Без ключа метрики получают
+    только адреса из METRICS_ALLOWED_IPS, остальным доступ закрыт.
+    """
+    expected = getattr(settings, 'METRICS_TOKEN', '')
+    if expected:
+        provided = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(provided, f'Bearer {expected}'):
+            return HttpResponse(status=401)
+    elif request.META.get('REMOTE_ADDR') not in getattr(
+            settings, 'METRICS_ALLOWED_IPS', ()):
+        return HttpResponse(status=403)
+    return HttpResponse(render_metrics(),
+                        content_type='text/plain; version=0.0.4')
@@ -0,0 +1,86 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+
+
+def split_existing_orders(apps, schema_editor):
+    # Разбиваем уже оформленные заказы на подзаказы магазинов
+    Order = apps.get_model('shop', 'Order')
+    OrderItem = apps.get_model('shop', 'OrderItem')
+    ShopOrder = apps.get_model('shop', 'ShopOrder')
+
+    order_dates = dict(
+        Order.objects.exclude(state='basket').values_list('id', 'dt'))
+    totals = OrderItem.objects.filter(
+        order_id__in=list(order_dates)
+    ).values('order_id', 'product_info__shop_id').annotate(
+        total_sum=Sum(F('quantity') * F('product_info__price')),
+        items_count=Count('id'),
+    ).order_by()
+
+    ShopOrder.objects.bulk_create([
+        ShopOrder(
+            order_id=row['order_id'],
+            shop_id=row['product_info__shop_id'],
+            dt=order_dates[row['order_id']],
+            total_sum=row['total_sum'] or 0,
+            items_count=row['items_count'],
+        )
+        for row in totals
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='productinfo',
+            options={'verbose_name': 'Информация о продукте', 'verbose_name_plural': 'Информационный список о продуктах'},
+        ),
+        migrations.AlterField(
+            model_name='productinfo',
+            name='external_id',
+            field=models.PositiveIntegerField(verbose_name='Внешний ИД'),
+        ),
+        migrations.AlterField(
+            model_name='productinfo',
+            name='price_rrc',
+            field=models.PositiveIntegerField(verbose_name='Рекомендуемая розничная цена'),
+        ),
+        migrations.AlterField(
+            model_name='productinfo',
+            name='product',
+            field=models.ForeignKey(blank=True, on_delete=django.db.models.deletion.CASCADE, related_name='product_infos', to='shop.product', verbose_name='Продукт'),
+        ),
+        migrations.AlterField(
+            model_name='productinfo',
+            name='shop',
+            field=models.ForeignKey(blank=True, on_delete=django.db.models.deletion.CASCADE, related_name='product_infos', to='shop.shop', verbose_name='Магазин'),
+        ),
+        migrations.CreateModel(
+            name='ShopOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dt', models.DateTimeField(verbose_name='Дата создания')),
+                ('total_sum', models.PositiveIntegerField(default=0, verbose_name='Сумма')),
+                ('items_count', models.PositiveIntegerField(default=0, verbose_name='Количество позиций')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shop_orders', to='shop.order', verbose_name='Заказ')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shop_orders', to='shop.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Заказ магазина',
+                'verbose_name_plural': 'Заказы магазинов',
+                'ordering': ('-dt',),
+                'indexes': [models.Index(fields=['shop', '-dt'], name='shop_order_shop_dt_idx')],
+                'constraints': [models.UniqueConstraint(fields=('order', 'shop'), name='unique_shop_order')],
+            },
+        ),
+        migrations.RunPython(split_existing_orders,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0003_order_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('external_id', models.PositiveIntegerField(blank=True, null=True, verbose_name='Внешний ИД')),
+                ('revenue', models.PositiveBigIntegerField(default=0, verbose_name='Выручка')),
+                ('units', models.PositiveIntegerField(default=0, verbose_name='Продано единиц')),
+                ('orders_count', models.PositiveIntegerField(default=0, verbose_name='Заказов')),
+                ('product_info', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sales_rollups', to='shop.productinfo', verbose_name='Информация о продукте')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollups', to='shop.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Продажи за день',
+                'verbose_name_plural': 'Продажи по дням',
+                'ordering': ('-day',),
+                'constraints': [models.UniqueConstraint(fields=('shop', 'day', 'product_info'), name='unique_sales_daily_rollup')],
+            },
+        ),
+    ]
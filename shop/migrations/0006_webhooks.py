@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:29
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0005_email_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shop',
+            name='webhook_secret',
+            field=models.CharField(blank=True, max_length=64, verbose_name='Ключ подписи уведомлений'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='webhook_url',
+            field=models.URLField(blank=True, null=True, verbose_name='Адрес для уведомлений'),
+        ),
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.CharField(max_length=40, verbose_name='Событие')),
+                ('payload', models.JSONField(default=dict, verbose_name='Данные')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает доставки'), ('delivered', 'Доставлено'), ('failed', 'Ошибка')], default='pending', max_length=10, verbose_name='Статус')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Следующая попытка')),
+                ('last_error', models.TextField(blank=True, verbose_name='Последняя ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('delivered_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата доставки')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='webhook_events', to='shop.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Событие для магазина',
+                'verbose_name_plural': 'События для магазинов',
+                'ordering': ('id',),
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='webhook_event_pending_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0006_webhooks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceListRefresh',
+            fields=[
+                ('shop', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='price_list_refresh', serialize=False, to='shop.shop', verbose_name='Магазин')),
+                ('next_run_at', models.DateTimeField(db_index=True, verbose_name='Следующий запуск')),
+                ('last_run_at', models.DateTimeField(blank=True, null=True, verbose_name='Последний запуск')),
+                ('duration', models.FloatField(blank=True, null=True, verbose_name='Длительность, с')),
+                ('outcome', models.CharField(blank=True, choices=[('ok', 'Обновлен'), ('not_modified', 'Без изменений'), ('error', 'Ошибка')], max_length=15, verbose_name='Результат')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('etag', models.CharField(blank=True, max_length=255, verbose_name='ETag')),
+                ('last_modified', models.CharField(blank=True, max_length=64, verbose_name='Last-Modified')),
+            ],
+            options={
+                'verbose_name': 'Обновление прайс-листа',
+                'verbose_name_plural': 'Обновления прайс-листов',
+            },
+        ),
+    ]
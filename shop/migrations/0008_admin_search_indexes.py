@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:51
+
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('shop', '0007_price_list_refresh'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(django.db.models.functions.comparison.Collate('name', 'NOCASE'), name='product_name_nocase_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(django.db.models.functions.comparison.Collate('email', 'NOCASE'), name='user_email_nocase_idx'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:58
+
+import shop.models
+from django.db import migrations, models
+
+
+def copy_product_parameters(apps, schema_editor):
+    # Переносим существующие значения ProductParameter в JSON поле
+    # пачками по диапазонам ID товаров
+    ProductInfo = apps.get_model('shop', 'ProductInfo')
+    ProductParameter = apps.get_model('shop', 'ProductParameter')
+
+    ids = ProductInfo.objects.order_by('id').values_list('id', flat=True)
+    last_id = 0
+    while batch := list(ids.filter(id__gt=last_id)[:1000]):
+        last_id = batch[-1]
+        parameters = {info_id: {} for info_id in batch}
+        for info_id, name, value in ProductParameter.objects.filter(
+            product_info_id__gte=batch[0], product_info_id__lte=last_id
+        ).order_by('product_info_id', 'id').values_list(
+            'product_info_id', 'parameter__name', 'value'
+        ):
+            parameters[info_id][name] = value
+        ProductInfo.objects.bulk_update([
+            ProductInfo(id=info_id, parameters=values)
+            for info_id, values in parameters.items()
+        ], ['parameters'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_admin_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productinfo',
+            name='parameters',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Параметры'),
+        ),
+        migrations.AddIndex(
+            model_name='productinfo',
+            index=models.Index(shop.models.ParameterValue('Цвет'), name='product_info_color_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productinfo',
+            index=models.Index(shop.models.ParameterValue('Встроенная память (Гб)'), name='product_info_memory_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productinfo',
+            index=models.Index(shop.models.ParameterValue('Диагональ (дюйм)'), name='product_info_diagonal_idx'),
+        ),
+        migrations.RunPython(copy_product_parameters,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:03
+
+import math
+
+from django.db import migrations, models
+
+
+def fill_numeric_values(apps, schema_editor):
+    # Числовые значения существующих параметров, пачками по диапазонам ID
+    ProductParameter = apps.get_model('shop', 'ProductParameter')
+
+    rows = ProductParameter.objects.order_by('id').only('id', 'value')
+    last_id = 0
+    while batch := list(rows.filter(id__gt=last_id)[:1000]):
+        last_id = batch[-1].id
+        updated = []
+        for row in batch:
+            try:
+                number = float(row.value.strip().replace(',', '.'))
+            except ValueError:
+                continue
+            if math.isfinite(number):
+                row.value_numeric = number
+                updated.append(row)
+        ProductParameter.objects.bulk_update(updated, ['value_numeric'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_product_info_parameters_json'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productparameter',
+            name='value_numeric',
+            field=models.FloatField(blank=True, null=True, verbose_name='Числовое значение'),
+        ),
+        migrations.RunPython(fill_numeric_values,
+                             migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='parameter',
+            index=models.Index(fields=['name'], name='parameter_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productinfo',
+            index=models.Index(fields=['price'], name='product_info_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productinfo',
+            index=models.Index(fields=['shop', 'price'], name='product_info_shop_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productparameter',
+            index=models.Index(fields=['parameter', 'value_numeric'], name='product_parameter_numeric_idx'),
+        ),
+    ]
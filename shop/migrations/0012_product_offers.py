@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_product_offers(apps, schema_editor):
+    # Сводки по существующим предложениям, пачками по диапазонам ID
+    # продуктов; дальше сводки обновляет refresh_product_offers
+    ProductInfo = apps.get_model('shop', 'ProductInfo')
+    ProductOffers = apps.get_model('shop', 'ProductOffers')
+
+    offers = ProductInfo.objects.filter(shop__state=True, quantity__gt=0)
+    cheapest = offers.filter(
+        product_id=models.OuterRef('product_id')).order_by('price', 'id')
+    product_ids = offers.order_by('product_id').values_list(
+        'product_id', flat=True).distinct()
+    last_id = 0
+    while batch := list(product_ids.filter(product_id__gt=last_id)[:1000]):
+        last_id = batch[-1]
+        ProductOffers.objects.bulk_create([
+            ProductOffers(**row)
+            for row in offers.filter(product_id__in=batch).values(
+                'product_id'
+            ).annotate(
+                min_price=models.Min('price'),
+                max_price=models.Max('price'),
+                total_quantity=models.Sum('quantity'),
+                offers_count=models.Count('id'),
+                cheapest_offer_id=models.Subquery(
+                    cheapest.values('id')[:1]),
+                cheapest_shop_id=models.Subquery(
+                    cheapest.values('shop_id')[:1]),
+            ).order_by()
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0011_product_info_shop_external_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductOffers',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='offers_summary', serialize=False, to='shop.product', verbose_name='Продукт')),
+                ('min_price', models.PositiveIntegerField(verbose_name='Минимальная цена')),
+                ('max_price', models.PositiveIntegerField(verbose_name='Максимальная цена')),
+                ('total_quantity', models.PositiveIntegerField(verbose_name='Общий остаток')),
+                ('offers_count', models.PositiveIntegerField(verbose_name='Предложений')),
+                ('cheapest_offer', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='shop.productinfo', verbose_name='Самое дешевое предложение')),
+                ('cheapest_shop', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='shop.shop', verbose_name='Самый дешевый магазин')),
+            ],
+            options={
+                'verbose_name': 'Предложения продукта',
+                'verbose_name_plural': 'Предложения продуктов',
+                'indexes': [models.Index(fields=['min_price'], name='product_offers_min_price_idx'), models.Index(fields=['offers_count'], name='product_offers_count_idx')],
+            },
+        ),
+        migrations.RunPython(fill_product_offers,
+                             migrations.RunPython.noop),
+    ]
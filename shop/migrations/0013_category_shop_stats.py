@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_category_stats(apps, schema_editor):
+    # Сводка по предложениям активных магазинов: строки по магазинам и
+    # строка без магазина с числом разных продуктов категории
+    ProductInfo = apps.get_model('shop', 'ProductInfo')
+    CategoryShopStats = apps.get_model('shop', 'CategoryShopStats')
+
+    offers = ProductInfo.objects.filter(shop__state=True)
+    in_stock = models.Q(quantity__gt=0)
+    rows = [
+        CategoryShopStats(category_id=row['product__category_id'],
+                          shop_id=row['shop_id'],
+                          products_count=row['products_count'],
+                          in_stock_count=row['in_stock_count'])
+        for row in offers.values('product__category_id', 'shop_id').annotate(
+            products_count=models.Count('id'),
+            in_stock_count=models.Count('id', filter=in_stock),
+        ).order_by()
+    ] + [
+        CategoryShopStats(category_id=row['product__category_id'],
+                          products_count=row['products_count'],
+                          in_stock_count=row['in_stock_count'])
+        for row in offers.values('product__category_id').annotate(
+            products_count=models.Count('product_id', distinct=True),
+            in_stock_count=models.Count('product_id', distinct=True,
+                                        filter=in_stock),
+        ).order_by()
+    ]
+    CategoryShopStats.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_product_offers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryShopStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('products_count', models.PositiveIntegerField(verbose_name='Товаров')),
+                ('in_stock_count', models.PositiveIntegerField(verbose_name='В наличии')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shop_stats', to='shop.category', verbose_name='Категория')),
+                ('shop', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='category_stats', to='shop.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Статистика категории',
+                'verbose_name_plural': 'Статистика категорий',
+                'constraints': [models.UniqueConstraint(fields=('category', 'shop'), name='unique_category_shop_stats')],
+            },
+        ),
+        migrations.RunPython(fill_category_stats,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0014_product_info_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='shoporder',
+            options={'ordering': ('-dt', '-order'), 'verbose_name': 'Заказ магазина', 'verbose_name_plural': 'Заказы магазинов'},
+        ),
+        migrations.RemoveIndex(
+            model_name='shoporder',
+            name='shop_order_shop_dt_idx',
+        ),
+        migrations.AlterField(
+            model_name='shoporder',
+            name='dt',
+            field=models.DateTimeField(verbose_name='Дата оформления'),
+        ),
+        migrations.AddIndex(
+            model_name='shoporder',
+            index=models.Index(fields=['shop', '-dt', '-order'], name='shop_order_shop_dt_id_idx'),
+        ),
+    ]
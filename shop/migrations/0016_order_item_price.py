@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:48
+
+from django.db import migrations, models
+
+
+def fill_order_item_prices(apps, schema_editor):
+    # Для уже оформленных заказов точной цены нет, берется текущая
+    OrderItem = apps.get_model('shop', 'OrderItem')
+    ProductInfo = apps.get_model('shop', 'ProductInfo')
+    OrderItem.objects.exclude(order__state='basket').update(
+        price=models.Subquery(ProductInfo.objects.filter(
+            id=models.OuterRef('product_info_id')).values('price')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0015_shop_order_dt_cursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='price',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Цена при оформлении'),
+        ),
+        migrations.RunPython(fill_order_item_prices,
+                             migrations.RunPython.noop),
+    ]
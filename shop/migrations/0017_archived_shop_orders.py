@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_archived_shop_orders(apps, schema_editor):
+    # Подзаказы уже заархивированных заказов восстанавливаются по позициям
+    ArchivedOrderItem = apps.get_model('shop', 'ArchivedOrderItem')
+    ArchivedShopOrder = apps.get_model('shop', 'ArchivedShopOrder')
+    rows = ArchivedOrderItem.objects.values(
+        'order_id', 'order__dt', 'shop_id').annotate(
+        total_sum=models.Sum(models.F('quantity') * models.F('price')),
+        items_count=models.Count('id'),
+    ).order_by()
+    ArchivedShopOrder.objects.bulk_create([
+        ArchivedShopOrder(order_id=row['order_id'], shop_id=row['shop_id'],
+                          dt=row['order__dt'], total_sum=row['total_sum'],
+                          items_count=row['items_count'])
+        for row in rows
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0016_order_item_price'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedShopOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shop_id', models.PositiveBigIntegerField(verbose_name='ID магазина')),
+                ('dt', models.DateTimeField(verbose_name='Дата оформления')),
+                ('total_sum', models.PositiveIntegerField(default=0, verbose_name='Сумма')),
+                ('items_count', models.PositiveIntegerField(default=0, verbose_name='Количество позиций')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shop_orders', to='shop.archivedorder', verbose_name='Заказ')),
+            ],
+            options={
+                'verbose_name': 'Архивный заказ магазина',
+                'verbose_name_plural': 'Архивные заказы магазинов',
+                'ordering': ('-dt', '-order'),
+                'indexes': [models.Index(fields=['shop_id', '-dt', '-order'], name='archived_shop_order_dt_idx')],
+            },
+        ),
+        migrations.RunPython(fill_archived_shop_orders,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0017_archived_shop_orders'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailoutbox',
+            name='claim',
+            field=models.CharField(blank=True, max_length=32, verbose_name='Метка отправки'),
+        ),
+    ]
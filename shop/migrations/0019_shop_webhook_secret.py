@@ -0,0 +1,25 @@
+import secrets
+
+from django.db import migrations
+
+
+def fill_webhook_secrets(apps, schema_editor):
+    # Адреса, заданные без ключа (например из админки), получают ключ
+    Shop = apps.get_model('shop', 'Shop')
+    shops = Shop.objects.filter(webhook_url__isnull=False, webhook_secret='') \
+        .exclude(webhook_url='')
+    for shop in shops:
+        shop.webhook_secret = secrets.token_hex(32)
+        shop.save(update_fields=['webhook_secret'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0018_email_outbox_claim'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_webhook_secrets,
+                             migrations.RunPython.noop),
+    ]
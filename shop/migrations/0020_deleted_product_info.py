@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0019_shop_webhook_secret'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeletedProductInfo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_info_id', models.BigIntegerField(verbose_name='ИД товара')),
+                ('deleted_at', models.DateTimeField(auto_now_add=True, verbose_name='Удален')),
+            ],
+            options={
+                'verbose_name': 'Удаленный товар',
+                'verbose_name_plural': 'Удаленные товары',
+                'indexes': [models.Index(fields=['deleted_at'], name='deleted_product_info_dt_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0020_deleted_product_info'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookevent',
+            name='claim',
+            field=models.CharField(blank=True, max_length=32, verbose_name='Метка доставки'),
+        ),
+    ]
@@ -1,12 +1,38 @@
 # models.py
+import json
+import secrets
+
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models.functions import Collate
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django_rest_passwordreset.tokens import get_token_generator
 
 
-class UserManager(BaseUserManager):
+class UserQuerySet(models.QuerySet):
+    """Запросы пользователей со сбросом кэша токенов при массовых изменениях"""
+
+    def update(self, **kwargs):
+        # UPDATE не вызывает post_save, поэтому токены сбрасываются здесь:
+        # иначе деактивированный пользователь оставался бы в кэше
+        # аутентификации, а после смены пароля работал бы старый токен
+        if not {'is_active', 'password'}.intersection(kwargs):
+            return super().update(**kwargs)
+        from .authentication import invalidate_user_tokens, \
+            revoke_user_tokens
+
+        user_ids = list(self.values_list('pk', flat=True))
+        updated = super().update(**kwargs)
+        if 'password' in kwargs:
+            revoke_user_tokens(*user_ids)
+        else:
+            invalidate_user_tokens(*user_ids)
+        return updated
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
     """Кастомный менеджер для модели User"""
 
     def create_user(self, email, password=None, **extra_fields):
@@ -26,9 +52,9 @@ class UserManager(BaseUserManager):
         extra_fields.setdefault('is_superuser', True)
         extra_fields.setdefault('is_active', True)
 
-        if extra_fields.get('is_staff'):
+        if extra_fields.get('is_staff') is not True:
             raise ValueError('Суперпользователь должен иметь is_staff=True')
-        if extra_fields.get('is_superuser'):
+        if extra_fields.get('is_superuser') is not True:
             raise ValueError(
                 'Суперпользователь должен иметь is_superuser=True')
 
@@ -63,10 +89,21 @@ class User(AbstractUser):
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
         ordering = ('email',)
+        indexes = [
+            # LIKE в SQLite не учитывает регистр и использует индекс только
+            # с NOCASE: префиксный поиск в админке
+            models.Index(Collate('email', 'NOCASE'),
+                         name='user_email_nocase_idx'),
+        ]
 
     def __str__(self):
         return f'{self.email} ({self.get_full_name()})'
 
+    def set_password(self, raw_password):
+        super().set_password(raw_password)
+        # После сохранения токены пользователя удаляются (shop.signals)
+        self.password_changed = True
+
 
 class Shop(models.Model):
     # Модель магазина
@@ -77,6 +114,10 @@ class Shop(models.Model):
                                 on_delete=models.CASCADE, null=True,
                                 blank=True)
     state = models.BooleanField('Статус заказов', default=True)
+    webhook_url = models.URLField('Адрес для уведомлений', null=True,
+                                  blank=True)
+    webhook_secret = models.CharField('Ключ подписи уведомлений',
+                                      max_length=64, blank=True)
 
     class Meta:
         verbose_name = 'Магазин'
@@ -86,6 +127,16 @@ class Shop(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # Уведомления всегда подписываются: ключ создается при установке
+        # адреса, в том числе из админки
+        if self.webhook_url and not self.webhook_secret:
+            self.webhook_secret = secrets.token_hex(32)
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'webhook_secret'}
+        super().save(*args, **kwargs)
+
 
 class Category(models.Model):
     # Модель категории товаров
@@ -115,11 +166,47 @@ class Product(models.Model):
         verbose_name = 'Продукт'
         verbose_name_plural = 'Продукты'
         ordering = ('name',)
+        indexes = [
+            models.Index(Collate('name', 'NOCASE'),
+                         name='product_name_nocase_idx'),
+        ]
 
     def __str__(self):
         return f'{self.name} ({self.category})'
 
 
+class ParameterValue(models.Func):
+    """
+    Значение параметра из JSON поля ProductInfo.parameters
+
+    В отличие от KeyTextTransform путь JSON подставляется в SQL литералом:
+    SQLite берет индекс по выражению, только если выражение запроса
+    совпадает с выражением индекса, а путь параметром запроса не совпадает.
+    """
+
+    output_field = models.CharField()
+
+    def __init__(self, name, field='parameters'):
+        self.name = name
+        super().__init__(models.F(field))
+
+    def as_sql(self, compiler, connection, **extra_context):
+        sql, params = compiler.compile(self.get_source_expressions()[0])
+        # Ключи хранятся с экранированием \uXXXX, как пишет json.dumps
+        path = f'$.{json.dumps(self.name)}'
+        literal = path.replace("'", "''").replace('%', '%%')
+        return f"JSON_EXTRACT({sql}, '{literal}')", params
+
+
+# Параметры, по которым чаще всего фильтруют каталог: для каждого есть
+# индекс по выражению ParameterValue
+INDEXED_PARAMETERS = {
+    'Цвет': 'color',
+    'Встроенная память (Гб)': 'memory',
+    'Диагональ (дюйм)': 'diagonal',
+}
+
+
 # backend/models.py
 class ProductInfo(models.Model):
     objects = models.manager.Manager()
@@ -135,6 +222,12 @@ class ProductInfo(models.Model):
     price = models.PositiveIntegerField(verbose_name='Цена')
     price_rrc = models.PositiveIntegerField(
         verbose_name='Рекомендуемая розничная цена')
+    # Основной источник параметров для чтения: {название: значение},
+    # строки ProductParameter остаются для админки и отчетов
+    parameters = models.JSONField('Параметры', default=dict, blank=True)
+    # По времени изменения движок каталога в памяти дочитывает изменения;
+    # массовые UPDATE выставляют его явно
+    updated_at = models.DateTimeField('Изменен', auto_now=True)
 
     class Meta:
         verbose_name = 'Информация о продукте'
@@ -143,6 +236,102 @@ class ProductInfo(models.Model):
             models.UniqueConstraint(fields=['product', 'shop', 'external_id'],
                                     name='unique_product_info'),
         ]
+        indexes = [
+            models.Index(ParameterValue(name),
+                         name=f'product_info_{suffix}_idx')
+            for name, suffix in INDEXED_PARAMETERS.items()
+        ] + [
+            # Сортировка каталога по цене, в том числе внутри магазина
+            models.Index(fields=['price'], name='product_info_price_idx'),
+            models.Index(fields=['shop', 'price'],
+                         name='product_info_shop_price_idx'),
+            # Обновление остатков по внешнему ИД внутри магазина
+            models.Index(fields=['shop', 'external_id'],
+                         name='product_info_shop_external_idx'),
+            models.Index(fields=['updated_at'],
+                         name='product_info_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product} - {self.shop}'
+
+
+class DeletedProductInfo(models.Model):
+    # Журнал удаленных товаров: движок каталога убирает их из колонок при
+    # дочитывании изменений. Пишется сигналом post_delete, поэтому
+    # учитывает удаления запросом, каскадом и из админки
+
+    product_info_id = models.BigIntegerField('ИД товара')
+    deleted_at = models.DateTimeField('Удален', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Удаленный товар'
+        verbose_name_plural = 'Удаленные товары'
+        indexes = [
+            models.Index(fields=['deleted_at'],
+                         name='deleted_product_info_dt_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_info_id}: {self.deleted_at}'
+
+
+class ProductOffers(models.Model):
+    # Сводка предложений продукта в наличии у активных магазинов,
+    # обновляется импортом, изменением остатков и статуса магазинов
+
+    product = models.OneToOneField(Product, verbose_name='Продукт',
+                                   related_name='offers_summary',
+                                   primary_key=True,
+                                   on_delete=models.CASCADE)
+    min_price = models.PositiveIntegerField('Минимальная цена')
+    max_price = models.PositiveIntegerField('Максимальная цена')
+    cheapest_offer = models.ForeignKey(
+        ProductInfo, verbose_name='Самое дешевое предложение',
+        related_name='+', null=True, on_delete=models.SET_NULL)
+    cheapest_shop = models.ForeignKey(
+        Shop, verbose_name='Самый дешевый магазин', related_name='+',
+        null=True, on_delete=models.SET_NULL)
+    total_quantity = models.PositiveIntegerField('Общий остаток')
+    offers_count = models.PositiveIntegerField('Предложений')
+
+    class Meta:
+        verbose_name = 'Предложения продукта'
+        verbose_name_plural = 'Предложения продуктов'
+        indexes = [
+            models.Index(fields=['min_price'],
+                         name='product_offers_min_price_idx'),
+            models.Index(fields=['offers_count'],
+                         name='product_offers_count_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product}: от {self.min_price}'
+
+
+class CategoryShopStats(models.Model):
+    # Число предложений категории у активного магазина, строка без магазина
+    # содержит число продуктов категории по всем активным магазинам
+
+    category = models.ForeignKey(Category, verbose_name='Категория',
+                                 related_name='shop_stats',
+                                 on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop, verbose_name='Магазин',
+                             related_name='category_stats', null=True,
+                             blank=True, on_delete=models.CASCADE)
+    products_count = models.PositiveIntegerField('Товаров')
+    in_stock_count = models.PositiveIntegerField('В наличии')
+
+    class Meta:
+        verbose_name = 'Статистика категории'
+        verbose_name_plural = 'Статистика категорий'
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'shop'],
+                                    name='unique_category_shop_stats'),
+        ]
+
+    def __str__(self):
+        return f'{self.category} ({self.shop or "все магазины"})'
 
 
 class Parameter(models.Model):
@@ -154,6 +343,9 @@ class Parameter(models.Model):
         verbose_name = 'Параметр'
         verbose_name_plural = 'Параметры'
         ordering = ('name',)
+        indexes = [
+            models.Index(fields=['name'], name='parameter_name_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -170,6 +362,9 @@ class ProductParameter(models.Model):
                                   related_name='product_parameters',
                                   on_delete=models.CASCADE)
     value = models.CharField('Значение', max_length=100)
+    # Число из value для фильтров по диапазону, None для нечисловых значений
+    value_numeric = models.FloatField('Числовое значение', null=True,
+                                      blank=True)
 
     class Meta:
         verbose_name = 'Параметр продукта'
@@ -180,6 +375,10 @@ class ProductParameter(models.Model):
                 name='unique_product_parameter'
             ),
         ]
+        indexes = [
+            models.Index(fields=['parameter', 'value_numeric'],
+                         name='product_parameter_numeric_idx'),
+        ]
 
     def __str__(self):
         return f'{self.parameter}: {self.value}'
@@ -222,6 +421,15 @@ class Order(models.Model):
         ('canceled', 'Отменен'),
     )
 
+    # Допустимые переходы статусов для магазина: целевой статус -> исходные
+    STATE_TRANSITIONS = {
+        'confirmed': ('new',),
+        'assembled': ('confirmed',),
+        'sent': ('assembled',),
+        'delivered': ('sent',),
+        'canceled': ('new', 'confirmed', 'assembled'),
+    }
+
     user = models.ForeignKey(User, verbose_name='Пользователь',
                              related_name='orders', on_delete=models.CASCADE)
     dt = models.DateTimeField('Дата создания', auto_now_add=True)
@@ -241,8 +449,7 @@ class Order(models.Model):
 
     @property
     def total_amount(self):
-        return sum(item.quantity * item.product_info.price for item in
-                   self.ordered_items.all())
+        return sum(item.total_price for item in self.ordered_items.all())
 
 
 class OrderItem(models.Model):
@@ -257,6 +464,9 @@ class OrderItem(models.Model):
                                      on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField('Количество',
                                            default=1)
+    # Цена фиксируется при оформлении, у позиций корзины она пустая
+    price = models.PositiveIntegerField('Цена при оформлении', null=True,
+                                        blank=True)
 
     class Meta:
         verbose_name = 'Позиция заказа'
@@ -271,10 +481,192 @@ class OrderItem(models.Model):
     def __str__(self):
         return f'{self.product_info} x {self.quantity}'
 
+    @property
+    def unit_price(self):
+        # Цена оформленной позиции или текущая цена товара в корзине
+        if self.price is not None:
+            return self.price
+        return self.product_info.price
+
     @property
     def total_price(self):
         # Общая стоимость позиции
-        return self.quantity * self.product_info.price
+        return self.quantity * self.unit_price
+
+
+class ShopOrder(models.Model):
+    # Часть заказа, относящаяся к одному магазину
+
+    order = models.ForeignKey(Order, verbose_name='Заказ',
+                              related_name='shop_orders',
+                              on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop, verbose_name='Магазин',
+                             related_name='shop_orders',
+                             on_delete=models.CASCADE)
+    dt = models.DateTimeField('Дата оформления')
+    total_sum = models.PositiveIntegerField('Сумма', default=0)
+    items_count = models.PositiveIntegerField('Количество позиций',
+                                              default=0)
+
+    class Meta:
+        verbose_name = 'Заказ магазина'
+        verbose_name_plural = 'Заказы магазинов'
+        ordering = ('-dt', '-order')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['order', 'shop'],
+                name='unique_shop_order'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['shop', '-dt', '-order'],
+                         name='shop_order_shop_dt_id_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.order} ({self.shop})'
+
+
+class ArchivedOrder(models.Model):
+    # Архивная копия завершенного заказа, id совпадает с исходным заказом
+
+    TERMINAL_STATES = ('delivered', 'canceled')
+
+    id = models.BigIntegerField('ID', primary_key=True)
+    user = models.ForeignKey(User, verbose_name='Пользователь',
+                             related_name='archived_orders',
+                             on_delete=models.CASCADE)
+    dt = models.DateTimeField('Дата создания')
+    state = models.CharField('Статус', choices=Order.STATE_CHOICES,
+                             max_length=15)
+    total_sum = models.PositiveIntegerField('Сумма', default=0)
+    contact = models.JSONField('Контакт', null=True, blank=True)
+    archived_at = models.DateTimeField('Дата архивации', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Архивный заказ'
+        verbose_name_plural = 'Архивные заказы'
+        ordering = ('-dt',)
+        indexes = [
+            models.Index(fields=['user', '-dt'],
+                         name='archived_order_user_dt_idx'),
+            models.Index(fields=['-dt'], name='archived_order_dt_idx'),
+        ]
+
+    def __str__(self):
+        return f'Архивный заказ #{self.id} от {self.dt.strftime("%d.%m.%Y")}'
+
+
+class ArchivedOrderItem(models.Model):
+    # Позиция архивного заказа со снимком данных о товаре
+
+    order = models.ForeignKey(ArchivedOrder, verbose_name='Заказ',
+                              related_name='ordered_items',
+                              on_delete=models.CASCADE)
+    product_info_id = models.PositiveBigIntegerField(
+        'ID информации о продукте')
+    shop_id = models.PositiveBigIntegerField('ID магазина')
+    product_name = models.CharField('Продукт', max_length=80)
+    category_name = models.CharField('Категория', max_length=40)
+    model = models.CharField('Модель', max_length=80, blank=True)
+    price = models.PositiveIntegerField('Цена')
+    quantity = models.PositiveIntegerField('Количество')
+
+    class Meta:
+        verbose_name = 'Позиция архивного заказа'
+        verbose_name_plural = 'Позиции архивных заказов'
+
+    def __str__(self):
+        return f'{self.product_name} x {self.quantity}'
+
+
+class ArchivedShopOrder(models.Model):
+    # Архивная копия подзаказа магазина для истории заказов партнера
+
+    order = models.ForeignKey(ArchivedOrder, verbose_name='Заказ',
+                              related_name='shop_orders',
+                              on_delete=models.CASCADE)
+    shop_id = models.PositiveBigIntegerField('ID магазина')
+    dt = models.DateTimeField('Дата оформления')
+    total_sum = models.PositiveIntegerField('Сумма', default=0)
+    items_count = models.PositiveIntegerField('Количество позиций',
+                                              default=0)
+
+    class Meta:
+        verbose_name = 'Архивный заказ магазина'
+        verbose_name_plural = 'Архивные заказы магазинов'
+        ordering = ('-dt', '-order')
+        indexes = [
+            models.Index(fields=['shop_id', '-dt', '-order'],
+                         name='archived_shop_order_dt_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.order} (магазин {self.shop_id})'
+
+
+class SalesDailyRollup(models.Model):
+    # Продажи товара магазина за день, обновляются при оформлении заказов
+
+    shop = models.ForeignKey(Shop, verbose_name='Магазин',
+                             related_name='sales_rollups',
+                             on_delete=models.CASCADE)
+    day = models.DateField('День')
+    product_info = models.ForeignKey(ProductInfo,
+                                     verbose_name='Информация о продукте',
+                                     related_name='sales_rollups',
+                                     null=True, blank=True,
+                                     on_delete=models.SET_NULL)
+    external_id = models.PositiveIntegerField('Внешний ИД', null=True,
+                                              blank=True)
+    revenue = models.PositiveBigIntegerField('Выручка', default=0)
+    units = models.PositiveIntegerField('Продано единиц', default=0)
+    orders_count = models.PositiveIntegerField('Заказов', default=0)
+
+    class Meta:
+        verbose_name = 'Продажи за день'
+        verbose_name_plural = 'Продажи по дням'
+        ordering = ('-day',)
+        constraints = [
+            models.UniqueConstraint(
+                fields=['shop', 'day', 'product_info'],
+                name='unique_sales_daily_rollup'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.shop} {self.day}: {self.revenue}'
+
+
+class PriceListRefresh(models.Model):
+    # Состояние планового обновления прайс-листа магазина по Shop.url
+
+    OUTCOME_CHOICES = (
+        ('ok', 'Обновлен'),
+        ('not_modified', 'Без изменений'),
+        ('error', 'Ошибка'),
+    )
+
+    shop = models.OneToOneField(Shop, verbose_name='Магазин',
+                                related_name='price_list_refresh',
+                                primary_key=True, on_delete=models.CASCADE)
+    next_run_at = models.DateTimeField('Следующий запуск', db_index=True)
+    last_run_at = models.DateTimeField('Последний запуск', null=True,
+                                       blank=True)
+    duration = models.FloatField('Длительность, с', null=True, blank=True)
+    outcome = models.CharField('Результат', choices=OUTCOME_CHOICES,
+                               max_length=15, blank=True)
+    error = models.TextField('Ошибка', blank=True)
+    etag = models.CharField('ETag', max_length=255, blank=True)
+    last_modified = models.CharField('Last-Modified', max_length=64,
+                                     blank=True)
+
+    class Meta:
+        verbose_name = 'Обновление прайс-листа'
+        verbose_name_plural = 'Обновления прайс-листов'
+
+    def __str__(self):
+        return f'{self.shop}: {self.outcome or "не запускалось"}'
 
 
 class ConfirmEmailToken(models.Model):
@@ -304,3 +696,100 @@ class ConfirmEmailToken(models.Model):
 
     def __str__(self):
         return f'Токен для {self.user.email}'
+
+
+class EmailOutboxManager(models.Manager):
+    """Менеджер очереди писем"""
+
+    def enqueue(self, subject, body, to, from_email=None):
+        # Постановка одного письма в очередь
+        return self.create(subject=subject, body=body, to=list(to),
+                           from_email=from_email or '')
+
+    def enqueue_many(self, messages):
+        # Постановка пачки писем одним INSERT
+        return self.bulk_create([
+            self.model(subject=message['subject'], body=message['body'],
+                       to=list(message['to']),
+                       from_email=message.get('from_email') or '')
+            for message in messages
+        ])
+
+
+class EmailOutbox(models.Model):
+    # Письмо в очереди на отправку фоновым обработчиком
+
+    STATUS_CHOICES = (
+        ('pending', 'Ожидает отправки'),
+        ('sent', 'Отправлено'),
+        ('failed', 'Ошибка'),
+    )
+
+    subject = models.CharField('Тема', max_length=255)
+    body = models.TextField('Текст')
+    from_email = models.CharField('Отправитель', max_length=254,
+                                  blank=True)
+    to = models.JSONField('Получатели', default=list)
+    status = models.CharField('Статус', choices=STATUS_CHOICES,
+                              max_length=10, default='pending')
+    attempts = models.PositiveSmallIntegerField('Попыток', default=0)
+    next_attempt_at = models.DateTimeField('Следующая попытка',
+                                           default=timezone.now)
+    last_error = models.TextField('Последняя ошибка', blank=True)
+    # Метка обработчика, забравшего письмо на отправку
+    claim = models.CharField('Метка отправки', max_length=32, blank=True)
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+    sent_at = models.DateTimeField('Дата отправки', null=True, blank=True)
+
+    objects = EmailOutboxManager()
+
+    class Meta:
+        verbose_name = 'Письмо в очереди'
+        verbose_name_plural = 'Очередь писем'
+        ordering = ('id',)
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'],
+                         name='email_outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} -> {", ".join(self.to)}'
+
+
+class WebhookEvent(models.Model):
+    # Событие для магазина, доставляемое пачками на его webhook_url
+
+    STATUS_CHOICES = (
+        ('pending', 'Ожидает доставки'),
+        ('delivered', 'Доставлено'),
+        ('failed', 'Ошибка'),
+    )
+
+    shop = models.ForeignKey(Shop, verbose_name='Магазин',
+                             related_name='webhook_events',
+                             on_delete=models.CASCADE)
+    event = models.CharField('Событие', max_length=40)
+    payload = models.JSONField('Данные', default=dict)
+    status = models.CharField('Статус', choices=STATUS_CHOICES,
+                              max_length=10, default='pending')
+    attempts = models.PositiveSmallIntegerField('Попыток', default=0)
+    next_attempt_at = models.DateTimeField('Следующая попытка',
+                                           default=timezone.now)
+    last_error = models.TextField('Последняя ошибка', blank=True)
+    # Метка обработчика, забравшего событие на доставку
+    claim = models.CharField('Метка доставки', max_length=32, blank=True)
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+    delivered_at = models.DateTimeField('Дата доставки', null=True,
+                                        blank=True)
+
+    class Meta:
+        verbose_name = 'Событие для магазина'
+        verbose_name_plural = 'События для магазинов'
+        ordering = ('id',)
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'],
+                         name='webhook_event_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.event} для {self.shop}'
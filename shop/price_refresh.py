@@ -0,0 +1,101 @@
+# price_refresh.py
+import asyncio
+import random
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.utils import timezone
+
+from .models import Shop, PriceListRefresh
+from .services import load_price_list, import_price_list
+
+
+def _jittered(seconds, jitter):
+    # Случайный сдвиг, чтобы магазины не обновлялись в одну секунду
+    return timedelta(seconds=max(seconds + random.uniform(-jitter, jitter),
+                                 0))
+
+
+def _due_refreshes(jitter):
+    # Магазины, у которых подошло время обновления прайс-листа
+    now = timezone.now()
+    new_shops = Shop.objects.filter(
+        state=True, url__isnull=False, price_list_refresh__isnull=True
+    ).exclude(url='').only('id')
+    PriceListRefresh.objects.bulk_create([
+        PriceListRefresh(shop=shop,
+                         next_run_at=now + _jittered(jitter / 2, jitter / 2))
+        for shop in new_shops
+    ])
+
+    return list(PriceListRefresh.objects.filter(
+        next_run_at__lte=now, shop__state=True, shop__url__isnull=False
+    ).exclude(shop__url='').select_related('shop').order_by('next_run_at'))
+
+
+def _fetch(url, etag, last_modified, timeout):
+    # Условный запрос: сервер магазина может ответить 304 Not Modified
+    import requests
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    response = requests.get(url, headers=headers, timeout=timeout)
+    if response.status_code != 304:
+        response.raise_for_status()
+    return response
+
+
+def _import(shop, content):
+    return import_price_list(shop, load_price_list(content))
+
+
+def _save_result(refresh, interval, jitter):
+    refresh.next_run_at = timezone.now() + _jittered(interval, jitter)
+    refresh.save()
+
+
+async def refresh_shop(semaphore, refresh, interval, jitter, timeout):
+    """
+    Обновление прайс-листа одного магазина с записью результата
+    """
+    shop = refresh.shop
+    async with semaphore:
+        refresh.last_run_at = timezone.now()
+        started = time.monotonic()
+        try:
+            response = await asyncio.to_thread(
+                _fetch, shop.url, refresh.etag, refresh.last_modified,
+                timeout)
+            if response.status_code == 304:
+                refresh.outcome = 'not_modified'
+            else:
+                # Импорт выполняется в общем потоке для работы с базой
+                await sync_to_async(_import)(shop, response.content)
+                refresh.outcome = 'ok'
+                refresh.etag = response.headers.get('ETag', '')
+                refresh.last_modified = response.headers.get(
+                    'Last-Modified', '')
+            refresh.error = ''
+        except Exception as error:
+            refresh.outcome = 'error'
+            refresh.error = str(error)
+        refresh.duration = time.monotonic() - started
+
+    await sync_to_async(_save_result)(refresh, interval, jitter)
+    return refresh
+
+
+async def refresh_due_shops(interval, jitter, concurrency, timeout):
+    """
+    Обновление всех магазинов, у которых подошло время, не более
+    concurrency загрузок одновременно
+    """
+    refreshes = await sync_to_async(_due_refreshes)(jitter)
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*(
+        refresh_shop(semaphore, refresh, interval, jitter, timeout)
+        for refresh in refreshes
+    ))
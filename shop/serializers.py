@@ -1,10 +1,18 @@
 # serializers.py
 from rest_framework import serializers
 from .models import User, Category, Shop, ProductInfo, Product, \
-    ProductParameter, OrderItem, Order, Contact
+    OrderItem, Order, Contact, ShopOrder, ArchivedOrder, ArchivedOrderItem, \
+    ArchivedShopOrder, ProductOffers
+from .metrics import TimedSerializerMixin
 
 
-class ContactSerializer(serializers.ModelSerializer):
+class TimedModelSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """
+    Базовый сериализатор моделей с учетом времени сериализации в метриках
+    """
+
+
+class ContactSerializer(TimedModelSerializer):
     """
     Сериализатор для контактной информации
     """
@@ -19,7 +27,7 @@ class ContactSerializer(serializers.ModelSerializer):
         }
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedModelSerializer):
     """
     Сериализатор для пользователей с вложенными контактами
     """
@@ -32,7 +40,7 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(TimedModelSerializer):
     """
     Сериализатор для категорий товаров
     """
@@ -43,7 +51,7 @@ class CategorySerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
-class ShopSerializer(serializers.ModelSerializer):
+class ShopSerializer(TimedModelSerializer):
     """
     Сериализатор для магазинов
     """
@@ -54,7 +62,7 @@ class ShopSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(TimedModelSerializer):
     """
     Сериализатор для продуктов с отображением категории в виде строки
     """
@@ -65,23 +73,12 @@ class ProductSerializer(serializers.ModelSerializer):
         fields = ('name', 'category',)
 
 
-class ProductParameterSerializer(serializers.ModelSerializer):
-    """
-    Сериализатор для параметров продуктов
-    """
-    parameter = serializers.StringRelatedField()
-
-    class Meta:
-        model = ProductParameter
-        fields = ('parameter', 'value',)
-
-
-class ProductInfoSerializer(serializers.ModelSerializer):
+class ProductInfoSerializer(TimedModelSerializer):
     """
     Сериализатор для информации о продуктах с вложенными данными
     """
     product = ProductSerializer(read_only=True)  # Вложенный продукт
-    product_parameters = ProductParameterSerializer(read_only=True, many=True)
+    product_parameters = serializers.SerializerMethodField()
 
     class Meta:
         model = ProductInfo
@@ -89,16 +86,37 @@ class ProductInfoSerializer(serializers.ModelSerializer):
                   'price_rrc', 'product_parameters',)
         read_only_fields = ('id',)
 
+    @staticmethod
+    def get_product_parameters(obj):
+        # Параметры читаются из JSON поля товара, без ProductParameter
+        return [{'parameter': name, 'value': value}
+                for name, value in obj.parameters.items()]
 
-class OrderItemSerializer(serializers.ModelSerializer):
+
+class ProductOffersSerializer(TimedModelSerializer):
+    """
+    Сериализатор для сводки предложений продукта по магазинам
+    """
+    product = ProductSerializer(read_only=True)
+    cheapest_shop = ShopSerializer(read_only=True)
+
+    class Meta:
+        model = ProductOffers
+        fields = ('product_id', 'product', 'min_price', 'max_price',
+                  'cheapest_offer', 'cheapest_shop', 'total_quantity',
+                  'offers_count',)
+        read_only_fields = fields
+
+
+class OrderItemSerializer(TimedModelSerializer):
     """
     Базовый сериализатор для элементов заказа
     """
 
     class Meta:
         model = OrderItem
-        fields = ('id', 'product_info', 'quantity', 'order',)
-        read_only_fields = ('id',)
+        fields = ('id', 'product_info', 'quantity', 'price', 'order',)
+        read_only_fields = ('id', 'price')
         extra_kwargs = {
             'order': {'write_only': True}
         }
@@ -111,7 +129,7 @@ class OrderItemCreateSerializer(OrderItemSerializer):
     product_info = ProductInfoSerializer(read_only=True)
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(TimedModelSerializer):
     """
     Сериализатор для заказов с вычисляемыми полями
     """
@@ -124,3 +142,72 @@ class OrderSerializer(serializers.ModelSerializer):
         fields = ('id', 'ordered_items', 'state', 'dt', 'total_sum',
                   'contact',)
         read_only_fields = ('id',)
+
+
+class ShopOrderSerializer(TimedModelSerializer):
+    """
+    Сериализатор для заказов магазина с позициями только этого магазина
+    """
+    id = serializers.IntegerField(source='order_id', read_only=True)
+    ordered_items = OrderItemCreateSerializer(source='order.shop_items',
+                                              read_only=True, many=True)
+    state = serializers.CharField(source='order.state', read_only=True)
+    contact = ContactSerializer(source='order.contact', read_only=True)
+
+    class Meta:
+        model = ShopOrder
+        fields = ('id', 'ordered_items', 'state', 'dt', 'total_sum',
+                  'contact',)
+        read_only_fields = fields
+
+
+class ArchivedOrderItemSerializer(TimedModelSerializer):
+    """
+    Сериализатор для позиций архивного заказа из снимка данных о товаре
+    """
+    product_info = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ArchivedOrderItem
+        fields = ('id', 'product_info', 'quantity',)
+        read_only_fields = fields
+
+    def get_product_info(self, obj):
+        return {
+            'id': obj.product_info_id,
+            'model': obj.model,
+            'product': {'name': obj.product_name,
+                        'category': obj.category_name},
+            'shop': obj.shop_id,
+            'price': obj.price,
+        }
+
+
+class ArchivedOrderSerializer(TimedModelSerializer):
+    """
+    Сериализатор для архивных заказов в формате истории заказов
+    """
+    ordered_items = ArchivedOrderItemSerializer(read_only=True, many=True)
+
+    class Meta:
+        model = ArchivedOrder
+        fields = ('id', 'ordered_items', 'state', 'dt', 'total_sum',
+                  'contact',)
+        read_only_fields = fields
+
+
+class ArchivedShopOrderSerializer(TimedModelSerializer):
+    """
+    Сериализатор для архивных заказов магазина в формате заказов партнера
+    """
+    id = serializers.IntegerField(source='order_id', read_only=True)
+    ordered_items = ArchivedOrderItemSerializer(source='order.shop_items',
+                                                read_only=True, many=True)
+    state = serializers.CharField(source='order.state', read_only=True)
+    contact = serializers.JSONField(source='order.contact', read_only=True)
+
+    class Meta:
+        model = ArchivedShopOrder
+        fields = ('id', 'ordered_items', 'state', 'dt', 'total_sum',
+                  'contact',)
+        read_only_fields = fields
@@ -1,8 +1,37 @@
-import csv, json, io
+import csv, json, io, math, secrets
+from datetime import date, datetime, timedelta
 from typing import Iterable, Dict, Any
+from django.core.cache import cache
+from django.core.mail import EmailMessage
 from django.db import transaction
+from django.db.models import Case, Count, Exists, F, Max, Min, \
+    OuterRef, Prefetch, Q, QuerySet, Subquery, Sum, Value, When
+from django.db.models.functions import Greatest, TruncDate
+from django.utils import timezone
 from .models import Shop, Category, Product, ProductInfo, Parameter, \
-    ProductParameter
+    ProductParameter, Order, OrderItem, ShopOrder, ArchivedOrder, \
+    ArchivedOrderItem, ArchivedShopOrder, SalesDailyRollup, EmailOutbox, \
+    ProductOffers, CategoryShopStats
+from .catalog import invalidate_catalog
+from .catalog_engine import log_deleted_product_infos
+from .events import publish_stock_removed, stock_values
+from .signals import stock_changed
+
+
+def numeric_value(value: Any) -> float | None:
+    """
+    Число из значения параметра: 512, 6.5, "6,5" -> float, иначе None.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        number = float(value)
+    else:
+        try:
+            number = float(str(value).strip().replace(",", "."))
+        except ValueError:
+            return None
+    return number if math.isfinite(number) else None
 
 
 class ProductImporter:
@@ -27,6 +56,7 @@ class ProductImporter:
 
     def _import_rows(self, rows: Iterable[Dict[str, Any]]) -> int:
         created_count = 0
+        product_ids = set()
         for row in rows:
             shop_name = self.shop_name or row.get("shop")
             category_name = row.get("category")
@@ -38,6 +68,16 @@ class ProductImporter:
             product, _ = Product.objects.get_or_create(name=product_name,
                                                        category=category)
 
+            params = row.get("params") or row.get("parameters") or {}
+            if isinstance(params, str):
+                try:
+                    params = json.loads(params)
+                except Exception:
+                    params = {}
+            # Параметры пишутся в JSON поле тем же запросом, что и товар
+            parameters = {pname: str(pvalue)
+                          for pname, pvalue in params.items()}
+
             info, created = ProductInfo.objects.get_or_create(
                 shop=shop, sku=row.get("sku"),
                 defaults={
@@ -46,27 +86,688 @@ class ProductImporter:
                     "price_rrc": int(
                         row.get("price_rrc", row.get("price", 0))),
                     "quantity": int(row.get("quantity", 0)),
+                    "parameters": parameters,
                 }
             )
+            product_ids.add(info.product_id)
             if not created:
                 info.product = product
                 info.price = int(row.get("price", info.price))
                 info.price_rrc = int(row.get("price_rrc", info.price_rrc))
                 info.quantity = int(row.get("quantity", info.quantity))
+                info.parameters = parameters
                 info.save()
 
-            params = row.get("params") or row.get("parameters") or {{}}
-            if isinstance(params, str):
-                try:
-                    params = json.loads(params)
-                except Exception:
-                    params = {{}}
             for pname, pvalue in params.items():
                 param, _ = Parameter.objects.get_or_create(name=pname)
                 ProductParameter.objects.update_or_create(
                     product_info=info, parameter=param,
-                    defaults={{"value": str(pvalue)}}
+                    defaults={"value": str(pvalue),
+                              "value_numeric": numeric_value(pvalue)}
                 )
 
+            product_ids.add(product.id)
             created_count += 1
+        refresh_product_offers(product_ids)
+        rebuild_category_stats(Product.objects.filter(
+            id__in=product_ids).values("category_id"))
         return created_count
+
+
+def fix_order_prices(order: Order) -> int:
+    """
+    Фиксирует текущие цены товаров в позициях оформляемого заказа.
+
+    Суммы подзаказов, сводка продаж и архив считаются по этим ценам,
+    поэтому последующая смена цены магазином их не меняет.
+    """
+    return OrderItem.objects.filter(order_id=order.id).update(
+        price=Subquery(ProductInfo.objects.filter(
+            id=OuterRef("product_info_id")).values("price")[:1]))
+
+
+def split_order_by_shop(order: Order) -> list[ShopOrder]:
+    """
+    Разбивает оформленный заказ на подзаказы по магазинам.
+
+    Итоги считаются одним агрегирующим запросом по позициям заказа,
+    поэтому у каждого магазина своя сумма без позиций других магазинов.
+    """
+    totals = OrderItem.objects.filter(order_id=order.id).values(
+        "product_info__shop_id"
+    ).annotate(
+        total_sum=Sum(F("quantity") * F("price")),
+        items_count=Count("id"),
+    ).order_by()
+
+    ShopOrder.objects.filter(order_id=order.id).delete()
+    return ShopOrder.objects.bulk_create([
+        ShopOrder(
+            order_id=order.id,
+            shop_id=row["product_info__shop_id"],
+            dt=order.dt,
+            total_sum=row["total_sum"] or 0,
+            items_count=row["items_count"],
+        )
+        for row in totals
+    ])
+
+
+ARCHIVE_HORIZON_CACHE_KEY = "orders:archive_horizon"
+ARCHIVE_HORIZON_TIMEOUT = 300
+_MISSING = object()
+
+
+def get_archive_horizon() -> datetime | None:
+    """
+    Дата самого нового заказа в архиве (None, если архив пуст).
+
+    Заказы новее этой даты гарантированно лежат в оперативных таблицах,
+    поэтому история заказов обращается к архиву только за ней.
+    """
+    horizon = cache.get(ARCHIVE_HORIZON_CACHE_KEY, _MISSING)
+    if horizon is _MISSING:
+        horizon = ArchivedOrder.objects.values_list("dt", flat=True).first()
+        cache.set(ARCHIVE_HORIZON_CACHE_KEY, horizon, ARCHIVE_HORIZON_TIMEOUT)
+    return horizon
+
+
+@transaction.atomic
+def archive_orders_batch(older_than: datetime, batch_size: int) -> int:
+    """
+    Переносит пачку старых завершенных заказов в архивные таблицы.
+
+    Вместе с заказом архивируются его подзаказы магазинов, чтобы
+    партнер видел старые заказы в своей истории. Каждая пачка переносится
+    в своей транзакции, поэтому прерванную архивацию можно просто
+    запустить заново. Возвращает число перенесенных заказов.
+    """
+    orders = list(Order.objects.filter(
+        state__in=ArchivedOrder.TERMINAL_STATES, dt__lt=older_than
+    ).select_related("contact").prefetch_related(
+        Prefetch("ordered_items", queryset=OrderItem.objects.select_related(
+            "product_info__product__category")),
+        "shop_orders",
+    ).order_by("id")[:batch_size])
+    if not orders:
+        return 0
+
+    archived_orders = []
+    archived_items = []
+    archived_shop_orders = []
+    for order in orders:
+        total_sum = 0
+        for item in order.ordered_items.all():
+            product_info = item.product_info
+            total_sum += item.quantity * item.price
+            archived_items.append(ArchivedOrderItem(
+                order_id=order.id,
+                product_info_id=product_info.id,
+                shop_id=product_info.shop_id,
+                product_name=product_info.product.name,
+                category_name=product_info.product.category.name,
+                model=product_info.model,
+                price=item.price,
+                quantity=item.quantity,
+            ))
+        archived_shop_orders.extend(
+            ArchivedShopOrder(order_id=order.id, shop_id=shop_order.shop_id,
+                              dt=shop_order.dt,
+                              total_sum=shop_order.total_sum,
+                              items_count=shop_order.items_count)
+            for shop_order in order.shop_orders.all())
+
+        contact = order.contact
+        archived_orders.append(ArchivedOrder(
+            id=order.id,
+            user_id=order.user_id,
+            dt=order.dt,
+            state=order.state,
+            total_sum=total_sum,
+            contact={
+                "id": contact.id,
+                "city": contact.city,
+                "street": contact.street,
+                "house": contact.house,
+                "structure": contact.structure,
+                "building": contact.building,
+                "apartment": contact.apartment,
+                "phone": contact.phone,
+            } if contact else None,
+        ))
+
+    ArchivedOrder.objects.bulk_create(archived_orders)
+    ArchivedOrderItem.objects.bulk_create(archived_items, batch_size=500)
+    ArchivedShopOrder.objects.bulk_create(archived_shop_orders,
+                                          batch_size=500)
+    Order.objects.filter(id__in=[order.id for order in orders]).delete()
+    transaction.on_commit(lambda: cache.delete(ARCHIVE_HORIZON_CACHE_KEY))
+    return len(orders)
+
+
+def _apply_orders_sales(order_ids: Iterable[int], sign: int) -> None:
+    # Прибавляет (sign=1) или вычитает (sign=-1) позиции заказов из сводки.
+    # Запросов постоянное число: чтение позиций и существующих строк
+    # сводки, одно UPDATE с выражениями F() и одна вставка новых строк.
+    items = OrderItem.objects.filter(order_id__in=order_ids).values(
+        "order__dt", "product_info_id", "product_info__shop_id",
+        "product_info__external_id", "quantity",
+    ).annotate(
+        revenue=F("quantity") * F("price")
+    ).order_by()
+
+    deltas = {}
+    for item in items:
+        key = (item["product_info__shop_id"],
+               timezone.localdate(item["order__dt"]),
+               item["product_info_id"])
+        delta = deltas.setdefault(key, {
+            "external_id": item["product_info__external_id"],
+            "revenue": 0, "units": 0, "orders_count": 0,
+        })
+        delta["revenue"] += item["revenue"]
+        delta["units"] += item["quantity"]
+        delta["orders_count"] += 1
+    if not deltas:
+        return
+
+    existing = SalesDailyRollup.objects.filter(
+        product_info_id__in={key[2] for key in deltas},
+        day__in={key[1] for key in deltas},
+    ).only("id", "shop_id", "day", "product_info_id")
+    rollups = [rollup for rollup in existing
+               if (rollup.shop_id, rollup.day, rollup.product_info_id)
+               in deltas]
+
+    fields = ("revenue", "units", "orders_count")
+    for rollup in rollups:
+        delta = deltas.pop(
+            (rollup.shop_id, rollup.day, rollup.product_info_id))
+        for field in fields:
+            if sign > 0:
+                value = F(field) + delta[field]
+            else:
+                value = Greatest(F(field) - delta[field], Value(0))
+            setattr(rollup, field, value)
+    SalesDailyRollup.objects.bulk_update(rollups, fields)
+
+    if sign > 0:
+        SalesDailyRollup.objects.bulk_create([
+            SalesDailyRollup(shop_id=shop_id, day=day,
+                             product_info_id=product_info_id, **delta)
+            for (shop_id, day, product_info_id), delta in deltas.items()
+        ])
+
+
+def record_order_sales(order: Order) -> None:
+    """Учитывает оформленный заказ в дневной сводке продаж"""
+    _apply_orders_sales([order.id], 1)
+
+
+def revert_orders_sales(order_ids: Iterable[int]) -> None:
+    """Исключает отмененные заказы из дневной сводки продаж"""
+    _apply_orders_sales(order_ids, -1)
+
+
+@transaction.atomic
+def rebuild_sales_rollups(date_from: date, date_to: date) -> int:
+    """
+    Пересчитывает дневную сводку продаж за период по заказам и архиву.
+
+    Отмененные заказы и корзины не учитываются. Возвращает число
+    записанных строк сводки.
+    """
+    SalesDailyRollup.objects.filter(day__gte=date_from,
+                                    day__lte=date_to).delete()
+    rollups = {}
+
+    live_items = OrderItem.objects.exclude(
+        order__state__in=("basket", "canceled")
+    ).annotate(day=TruncDate("order__dt")).filter(
+        day__gte=date_from, day__lte=date_to
+    ).values(
+        "day", "product_info_id", "product_info__shop_id",
+        "product_info__external_id",
+    ).annotate(
+        revenue=Sum(F("quantity") * F("price")),
+        units=Sum("quantity"),
+        orders_count=Count("order_id", distinct=True),
+    ).order_by()
+    for row in live_items:
+        rollups[(row["product_info__shop_id"], row["day"],
+                 row["product_info_id"])] = SalesDailyRollup(
+            shop_id=row["product_info__shop_id"],
+            day=row["day"],
+            product_info_id=row["product_info_id"],
+            external_id=row["product_info__external_id"],
+            revenue=row["revenue"],
+            units=row["units"],
+            orders_count=row["orders_count"],
+        )
+
+    archived_items = list(ArchivedOrderItem.objects.exclude(
+        order__state="canceled"
+    ).filter(
+        shop_id__in=Shop.objects.values("id")
+    ).annotate(day=TruncDate("order__dt")).filter(
+        day__gte=date_from, day__lte=date_to
+    ).values("day", "shop_id", "product_info_id").annotate(
+        revenue=Sum(F("quantity") * F("price")),
+        units=Sum("quantity"),
+        orders_count=Count("order_id", distinct=True),
+    ).order_by())
+    # Товар из архивного заказа мог быть уже удален из каталога
+    external_ids = dict(ProductInfo.objects.filter(
+        id__in={row["product_info_id"] for row in archived_items}
+    ).values_list("id", "external_id"))
+    for row in archived_items:
+        product_info_id = row["product_info_id"]
+        if product_info_id not in external_ids:
+            product_info_id = None
+        key = (row["shop_id"], row["day"], product_info_id)
+        rollup = rollups.setdefault(key, SalesDailyRollup(
+            shop_id=row["shop_id"],
+            day=row["day"],
+            product_info_id=product_info_id,
+            external_id=external_ids.get(product_info_id),
+        ))
+        rollup.revenue += row["revenue"]
+        rollup.units += row["units"]
+        rollup.orders_count += row["orders_count"]
+
+    SalesDailyRollup.objects.bulk_create(rollups.values(), batch_size=1000)
+    return len(rollups)
+
+
+def claim_outbox_batch(batch_size: int, lease: int) -> list[EmailOutbox]:
+    """
+    Забирает пачку готовых к отправке писем условным UPDATE.
+
+    Письма получают метку обработчика, а следующая попытка откладывается
+    на lease секунд: параллельный обработчик их уже не выберет, а письма
+    упавшего обработчика вернутся в очередь после окончания аренды.
+    """
+    now = timezone.now()
+    due = EmailOutbox.objects.filter(status="pending",
+                                     next_attempt_at__lte=now)
+    ids = list(due.order_by("next_attempt_at", "id").values_list(
+        "id", flat=True)[:batch_size])
+    if not ids:
+        return []
+    claim = secrets.token_hex(16)
+    due.filter(id__in=ids).update(
+        claim=claim, next_attempt_at=now + timedelta(seconds=lease))
+    return list(EmailOutbox.objects.filter(id__in=ids, claim=claim)
+                .order_by("id"))
+
+
+def send_outbox_batch(connection, batch_size: int, max_attempts: int,
+                      backoff: int, lease: int = 300) -> tuple[int, int]:
+    """
+    Отправляет пачку писем из очереди через одно открытое SMTP соединение.
+
+    Письма сначала забираются claim_outbox_batch, поэтому несколько
+    обработчиков не отправят одно письмо дважды. Неудачные письма получают
+    следующую попытку с экспоненциальной задержкой, после max_attempts
+    попыток помечаются как ошибочные. Возвращает пару (отправлено, ошибок).
+    """
+    batch = claim_outbox_batch(batch_size, lease)
+    now = timezone.now()
+
+    sent_ids = []
+    failed = 0
+    for outbox in batch:
+        message = EmailMessage(subject=outbox.subject, body=outbox.body,
+                               from_email=outbox.from_email or None,
+                               to=outbox.to, connection=connection)
+        try:
+            # Уже открытое соединение переиспользуется, а не пересоздается
+            connection.open()
+            message.send()
+        except Exception as error:
+            # Соединение могло оборваться, следующее письмо откроет новое
+            connection.close()
+            failed += 1
+            outbox.attempts += 1
+            outbox.last_error = str(error)
+            if outbox.attempts >= max_attempts:
+                outbox.status = "failed"
+            else:
+                outbox.next_attempt_at = now + timedelta(
+                    seconds=backoff * 2 ** (outbox.attempts - 1))
+            outbox.save(update_fields=["attempts", "last_error", "status",
+                                       "next_attempt_at"])
+        else:
+            sent_ids.append(outbox.id)
+
+    if sent_ids:
+        EmailOutbox.objects.filter(id__in=sent_ids).update(
+            status="sent", sent_at=timezone.now(), last_error="")
+    return len(sent_ids), failed
+
+
+def load_price_list(content: bytes | str) -> Dict[str, Any]:
+    """
+    Разбор YAML прайс-листа.
+
+    yaml загружается при первом вызове; если PyYAML собран с libyaml,
+    используется быстрый CSafeLoader.
+    """
+    import yaml
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    data = yaml.load(content, Loader=loader)
+    if not isinstance(data, dict) or not {"shop", "categories",
+                                          "goods"}.issubset(data):
+        raise ValueError("Неверный формат прайс-листа")
+    return data
+
+
+@transaction.atomic
+def import_price_list(shop: Shop, data: Dict[str, Any]) -> Dict[str, int]:
+    """
+    Импорт прайс-листа магазина пакетными запросами.
+
+    Товары сопоставляются по внешнему ИД внутри магазина: существующие
+    обновляются на месте (заказы на них сохраняются), новые добавляются,
+    отсутствующие в прайс-листе удаляются.
+    """
+    for category_data in data["categories"]:
+        Category.objects.get_or_create(
+            id=category_data["id"],
+            defaults={"name": category_data["name"]}
+        )
+    shop.categories.add(*[category_data["id"]
+                          for category_data in data["categories"]])
+
+    goods = data["goods"]
+
+    # Продукты: один запрос на поиск и один на создание недостающих
+    product_keys = {(good["name"], good["category"]) for good in goods}
+    products = {
+        (product.name, product.category_id): product
+        for product in Product.objects.filter(
+            name__in={name for name, _ in product_keys})
+    }
+    products.update({
+        (product.name, product.category_id): product
+        for product in Product.objects.bulk_create([
+            Product(name=name, category_id=category_id)
+            for name, category_id in product_keys
+            if (name, category_id) not in products
+        ])
+    })
+
+    existing = {info.external_id: info
+                for info in ProductInfo.objects.filter(shop_id=shop.id)}
+    fields = ("product_id", "model", "price", "price_rrc", "quantity",
+              "parameters")
+    to_create, to_update = [], []
+    product_ids = set()
+    now = timezone.now()
+    for good in goods:
+        values = {
+            "product_id": products[(good["name"], good["category"])].id,
+            "model": good.get("model", ""),
+            "price": good["price"],
+            "price_rrc": good["price_rrc"],
+            "quantity": good["quantity"],
+            # Параметры для чтения пишутся тем же INSERT/UPDATE, что и товар
+            "parameters": {name: str(value) for name, value
+                           in good.get("parameters", {}).items()},
+        }
+        info = existing.pop(good["id"], None)
+        if info is None:
+            to_create.append(ProductInfo(shop_id=shop.id,
+                                         external_id=good["id"], **values))
+            product_ids.add(values["product_id"])
+        elif any(getattr(info, field) != values[field] for field in fields):
+            product_ids.update((info.product_id, values["product_id"]))
+            for field, value in values.items():
+                setattr(info, field, value)
+            info.updated_at = now
+            to_update.append(info)
+
+    if existing:
+        product_ids.update(info.product_id for info in existing.values())
+        removed_ids = [info.id for info in existing.values()]
+        removed = ProductInfo.objects.filter(id__in=removed_ids)
+        # Подписчики потока остатков получают удаленные товары с нулевым
+        # остатком, как при удалении из админки
+        removed_offers = list(stock_values(removed))
+        removed.delete()
+        log_deleted_product_infos(removed_ids)
+        transaction.on_commit(lambda: publish_stock_removed(removed_offers))
+    ProductInfo.objects.bulk_create(to_create, batch_size=500)
+    ProductInfo.objects.bulk_update(to_update, fields + ("updated_at",),
+                                    batch_size=500)
+    changed_ids = [info.id for info in to_create + to_update]
+    transaction.on_commit(lambda: stock_changed.send(
+        sender=import_price_list, product_info_ids=changed_ids))
+    refresh_product_offers(product_ids)
+    if product_ids:
+        # Категории магазина включают прежние категории его товаров
+        rebuild_category_stats(shop.categories.values("id"))
+
+    # Параметры: недостающие названия создаются пачкой, значения
+    # товаров прайс-листа перезаписываются целиком
+    param_names = {name for good in goods
+                   for name in good.get("parameters", {})}
+    parameters = dict(Parameter.objects.filter(
+        name__in=param_names).values_list("name", "id"))
+    parameters.update(
+        (parameter.name, parameter.id)
+        for parameter in Parameter.objects.bulk_create([
+            Parameter(name=name) for name in param_names
+            if name not in parameters
+        ])
+    )
+
+    infos = dict(ProductInfo.objects.filter(shop_id=shop.id).values_list(
+        "external_id", "id"))
+    ProductParameter.objects.filter(product_info__shop_id=shop.id).delete()
+    ProductParameter.objects.bulk_create([
+        ProductParameter(product_info_id=infos[good["id"]],
+                         parameter_id=parameters[name],
+                         value=str(value), value_numeric=numeric_value(value))
+        for good in goods
+        for name, value in good.get("parameters", {}).items()
+    ], batch_size=1000)
+
+    return {"created": len(to_create), "updated": len(to_update),
+            "deleted": len(existing), "total": len(goods)}
+
+
+STOCK_FIELDS = ("price", "price_rrc", "quantity")
+# Предел PositiveIntegerField на всех поддерживаемых базах: большие
+# значения SQLite отвергает OverflowError, а не ошибкой проверки
+MAX_STOCK_VALUE = 2 ** 31 - 1
+
+
+@transaction.atomic
+def update_stock(shop_id: int, items: Iterable[Dict[str, Any]],
+                 batch_size: int = 1000) -> Dict[str, Any]:
+    """
+    Обновление цен и остатков товаров магазина по внешнему ИД.
+
+    Каждый элемент: {"external_id", "price"?, "price_rrc"?, "quantity"?},
+    при повторе ИД действует последний элемент. Пачка обновляется одним
+    UPDATE с CASE по external_id, поля без новых значений не меняются.
+    Неверный элемент отменяет все обновление (ValueError).
+    """
+    changes = {}
+    for number, item in enumerate(items, 1):
+        if not isinstance(item, dict) or "external_id" not in item:
+            raise ValueError(f"Элемент {number}: не указан external_id")
+        values = {field: item[field] for field in STOCK_FIELDS
+                  if field in item}
+        if not values or any(
+                type(value) is not int or not 0 <= value <= MAX_STOCK_VALUE
+                for value in (item["external_id"], *values.values())):
+            raise ValueError(
+                f"Элемент {number}: нужны целые external_id и хотя бы одно "
+                f"из {', '.join(STOCK_FIELDS)} от 0 до {MAX_STOCK_VALUE}")
+        changes.setdefault(item["external_id"], {}).update(values)
+
+    external_ids = list(changes)
+    infos = ProductInfo.objects.filter(shop_id=shop_id)
+    found, product_ids, category_ids = {}, set(), set()
+    for external_id, info_id, product_id, category_id in infos.filter(
+            external_id__in=external_ids).values_list(
+            "external_id", "id", "product_id", "product__category_id"):
+        found[external_id] = info_id
+        product_ids.add(product_id)
+        category_ids.add(category_id)
+    updated, now = 0, timezone.now()
+    for start in range(0, len(external_ids), batch_size):
+        batch = [external_id for external_id
+                 in external_ids[start:start + batch_size]
+                 if external_id in found]
+        if not batch:
+            continue
+        updates = {
+            field: Case(*[When(external_id=external_id,
+                               then=Value(changes[external_id][field]))
+                          for external_id in batch
+                          if field in changes[external_id]],
+                        default=F(field),
+                        output_field=ProductInfo._meta.get_field(field))
+            for field in STOCK_FIELDS
+            if any(field in changes[external_id] for external_id in batch)
+        }
+        updated += infos.filter(external_id__in=batch).update(
+            updated_at=now, **updates)
+    changed_ids = list(found.values())
+    transaction.on_commit(lambda: stock_changed.send(
+        sender=update_stock, product_info_ids=changed_ids))
+    refresh_product_offers(product_ids)
+    if category_ids:
+        rebuild_category_stats(category_ids)
+    return {"updated": updated,
+            "missing": sorted(set(external_ids).difference(found))}
+
+
+@transaction.atomic
+def refresh_product_offers(product_ids: Iterable[int] | QuerySet,
+                           batch_size: int = 1000) -> int:
+    """
+    Пересчитывает сводку ProductOffers для продуктов.
+
+    product_ids: ИД продуктов или запрос values("product_id"), запрос
+    подставляется подзапросом. Учитываются предложения в наличии у
+    активных магазинов. Сводки пачки считаются одним запросом с
+    группировкой и записываются одним INSERT ... ON CONFLICT, сводки
+    продуктов без предложений удаляются. Возвращает число сводок.
+    """
+    if isinstance(product_ids, QuerySet):
+        batches = [product_ids]
+    else:
+        product_ids = sorted(set(product_ids))
+        batches = [product_ids[start:start + batch_size]
+                   for start in range(0, len(product_ids), batch_size)]
+
+    offers = ProductInfo.objects.filter(shop__state=True, quantity__gt=0)
+    cheapest = offers.filter(product_id=OuterRef("product_id")).order_by(
+        "price", "id")
+    refreshed = 0
+    for batch in batches:
+        summaries = [
+            ProductOffers(**row)
+            for row in offers.filter(product_id__in=batch).values(
+                "product_id"
+            ).annotate(
+                min_price=Min("price"),
+                max_price=Max("price"),
+                total_quantity=Sum("quantity"),
+                offers_count=Count("id"),
+                cheapest_offer_id=Subquery(cheapest.values("id")[:1]),
+                cheapest_shop_id=Subquery(cheapest.values("shop_id")[:1]),
+            ).order_by()
+        ]
+        ProductOffers.objects.filter(product_id__in=batch).exclude(
+            Exists(offers.filter(product_id=OuterRef("product_id")))
+        ).delete()
+        ProductOffers.objects.bulk_create(
+            summaries, update_conflicts=True, unique_fields=["product"],
+            update_fields=["min_price", "max_price", "cheapest_offer",
+                           "cheapest_shop", "total_quantity",
+                           "offers_count"])
+        refreshed += len(summaries)
+    return refreshed
+
+
+@transaction.atomic
+def rebuild_category_stats(category_ids: Iterable[int] | QuerySet | None
+                           = None) -> int:
+    """
+    Пересчитывает сводку CategoryShopStats для категорий (None - для всех).
+
+    Учитываются предложения активных магазинов: по строке на магазин с
+    числом предложений и строка без магазина с числом разных продуктов.
+    После фиксации транзакции кэш списка категорий устаревает.
+    Возвращает число записанных строк.
+    """
+    stats = CategoryShopStats.objects.all()
+    offers = ProductInfo.objects.filter(shop__state=True)
+    if category_ids is not None:
+        if not isinstance(category_ids, QuerySet):
+            category_ids = sorted(set(category_ids))
+        stats = stats.filter(category_id__in=category_ids)
+        offers = offers.filter(product__category_id__in=category_ids)
+    in_stock = Q(quantity__gt=0)
+
+    rows = [
+        CategoryShopStats(category_id=row["product__category_id"],
+                          shop_id=row["shop_id"],
+                          products_count=row["products_count"],
+                          in_stock_count=row["in_stock_count"])
+        for row in offers.values("product__category_id", "shop_id").annotate(
+            products_count=Count("id"),
+            in_stock_count=Count("id", filter=in_stock),
+        ).order_by()
+    ] + [
+        CategoryShopStats(category_id=row["product__category_id"],
+                          products_count=row["products_count"],
+                          in_stock_count=row["in_stock_count"])
+        for row in offers.values("product__category_id").annotate(
+            products_count=Count("product_id", distinct=True),
+            in_stock_count=Count("product_id", distinct=True,
+                                 filter=in_stock),
+        ).order_by()
+    ]
+    stats.delete()
+    CategoryShopStats.objects.bulk_create(rows, batch_size=500)
+    invalidate_catalog()
+    return len(rows)
+
+
+def sync_product_parameters(product_info_ids: Iterable[int] | None = None,
+                            batch_size: int = 1000) -> int:
+    """
+    Переносит значения ProductParameter в JSON поле ProductInfo.parameters.
+
+    Товары обходятся пачками по возрастанию ID, значения пачки читаются
+    одним запросом по диапазону ID и записываются одним bulk_update.
+    Возвращает число обработанных товаров.
+    """
+    infos = ProductInfo.objects.order_by("id")
+    if product_info_ids is not None:
+        infos = infos.filter(id__in=product_info_ids)
+    ids = infos.values_list("id", flat=True)
+
+    synced, last_id = 0, 0
+    while batch := list(ids.filter(id__gt=last_id)[:batch_size]):
+        last_id = batch[-1]
+        parameters = {info_id: {} for info_id in batch}
+        for info_id, name, value in ProductParameter.objects.filter(
+            product_info_id__gte=batch[0], product_info_id__lte=last_id
+        ).order_by("product_info_id", "id").values_list(
+            "product_info_id", "parameter__name", "value"
+        ):
+            if info_id in parameters:
+                parameters[info_id][name] = value
+        ProductInfo.objects.bulk_update([
+            ProductInfo(id=info_id, parameters=values)
+            for info_id, values in parameters.items()
+        ], ["parameters"])
+        synced += len(batch)
+    return synced
@@ -1,69 +1,180 @@
 # signals.py
 from typing import Type
 from django.conf import settings
-from django.core.mail import EmailMultiAlternatives
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver, Signal
+from django.utils import timezone
 from django_rest_passwordreset.signals import reset_password_token_created
+from rest_framework.authtoken.models import Token
 
-from .models import ConfirmEmailToken, User
+from .authentication import invalidate_token, invalidate_user_tokens, \
+    revoke_user_tokens
+from .events import publish_stock_changes, publish_shop_state
+from .catalog import invalidate_catalog
+from .catalog_engine import log_deleted_product_infos
+from .models import ConfirmEmailToken, User, Order, EmailOutbox, Category, \
+    Shop, Product, ProductInfo
+from .webhooks import queue_new_order_events
 
 
 user_registered = Signal()  # Сигнал о регистрации нового пользователя
 order_created = Signal()  # Сигнал о создании нового заказа
+order_state_changed = Signal()  # Сигнал о смене статуса группы заказов
+stock_changed = Signal()  # Сигнал об изменении цен и остатков товаров
+shop_state_changed = Signal()  # Сигнал о включении и отключении магазинов
 
 
 @receiver(reset_password_token_created)
 def handle_password_reset_token(sender, instance, reset_password_token, **kwargs):
     """
-    Обработчик для отправки email с токеном сброса пароля
+    Обработчик для постановки в очередь email с токеном сброса пароля
     """
-    email_subject = f"Запрос на сброс пароля для {reset_password_token.user}"
-    email_body = f"Ваш токен для сброса пароля: {reset_password_token.key}"
-
-    email_message = EmailMultiAlternatives(
-        subject=email_subject,
-        body=email_body,
+    EmailOutbox.objects.enqueue(
+        subject=f"Запрос на сброс пароля для {reset_password_token.user}",
+        body=f"Ваш токен для сброса пароля: {reset_password_token.key}",
         from_email=settings.EMAIL_HOST_USER,
         to=[reset_password_token.user.email]
     )
-    email_message.send()
 
 
 @receiver(post_save, sender=User)
 def handle_new_user_registration(sender: Type[User], instance: User, created: bool, **kwargs):
     """
-    Обработчик для отправки email подтверждения при регистрации нового пользователя
+    Обработчик для постановки в очередь email подтверждения при регистрации
     """
     if created and not instance.is_active:
         token, _ = ConfirmEmailToken.objects.get_or_create(user_id=instance.pk)
 
-        email_subject = f"Подтверждение email для {instance.email}"
-        email_body = f"Ваш токен подтверждения: {token.key}"
-
-        email_message = EmailMultiAlternatives(
-            subject=email_subject,
-            body=email_body,
+        EmailOutbox.objects.enqueue(
+            subject=f"Подтверждение email для {instance.email}",
+            body=f"Ваш токен подтверждения: {token.key}",
             from_email=settings.EMAIL_HOST_USER,
             to=[instance.email]
         )
-        email_message.send()
+
+
+@receiver(post_save, sender=User)
+def handle_user_changed(sender: Type[User], instance: User, created: bool, **kwargs):
+    """
+    Обработчик для сброса кэша токенов при изменении пользователя
+
+    Срабатывает при деактивации и любом другом сохранении, чтобы
+    аутентификация не возвращала устаревшего пользователя. После смены
+    пароля токены пользователя удаляются.
+    """
+    password_changed = getattr(instance, 'password_changed', False)
+    instance.password_changed = False
+    if created:
+        return
+    if password_changed:
+        revoke_user_tokens(instance.pk)
+    else:
+        invalidate_user_tokens(instance.pk)
+
+
+@receiver(post_delete, sender=Token)
+def handle_token_deleted(sender, instance, **kwargs):
+    """
+    Обработчик для сброса кэша при удалении токена (выход из системы)
+    """
+    invalidate_token(instance.key)
 
 
 @receiver(order_created)
 def handle_new_order(user_id, **kwargs):
     """
-    Обработчик для отправки уведомления о новом заказе
+    Обработчик для постановки в очередь уведомления о новом заказе
     """
     user = User.objects.get(id=user_id)
 
-    email_subject = "Ваш заказ успешно оформлен"
-    email_body = "Благодарим за заказ! Мы начали его обработку."
-
-    email_message = EmailMultiAlternatives(
-        subject=email_subject,
-        body=email_body,
+    EmailOutbox.objects.enqueue(
+        subject="Ваш заказ успешно оформлен",
+        body="Благодарим за заказ! Мы начали его обработку.",
         from_email=settings.EMAIL_HOST_USER,
         to=[user.email]
     )
-    email_message.send()
\ No newline at end of file
+
+
+@receiver(order_created)
+def handle_new_order_webhooks(order_id=None, **kwargs):
+    """
+    Обработчик для постановки событий о новом заказе магазинам заказа
+    """
+    if order_id is not None:
+        queue_new_order_events(order_id)
+
+
+@receiver(order_state_changed)
+def handle_order_state_changed(order_ids, state, **kwargs):
+    """
+    Обработчик для уведомления покупателей о смене статуса заказов
+
+    Адреса выбираются одним запросом, а письма ставятся в очередь одним
+    INSERT.
+    """
+    state_name = dict(Order.STATE_CHOICES).get(state, state)
+    recipients = Order.objects.filter(id__in=order_ids).values_list(
+        'id', 'user__email')
+
+    EmailOutbox.objects.enqueue_many(
+        {
+            'subject': f"Статус заказа #{order_id} изменен",
+            'body': f"Новый статус вашего заказа #{order_id}: {state_name}.",
+            'from_email': settings.EMAIL_HOST_USER,
+            'to': [email],
+        }
+        for order_id, email in recipients
+    )
+
+
+@receiver(stock_changed)
+def handle_stock_changed(product_info_ids, **kwargs):
+    """
+    Обработчик для рассылки новых цен и остатков подписчикам потока событий
+    """
+    publish_stock_changes(product_info_ids)
+
+
+@receiver(shop_state_changed)
+def handle_shop_state_changed(shop_ids, state, **kwargs):
+    """
+    Обработчик для рассылки статуса магазинов подписчикам потока событий
+    """
+    publish_shop_state(shop_ids, state)
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Shop)
+@receiver([post_save, post_delete], sender=Product)
+def handle_catalog_changed(**kwargs):
+    """
+    Обработчик для сброса кэшей каталога (список категорий, индекс
+    подсказок, движок каталога) при изменении категорий, магазинов и
+    продуктов. Предложения магазинов меняются пачками, и каталог
+    сбрасывается один раз на пачку в rebuild_category_stats
+    """
+    invalidate_catalog()
+
+
+@receiver(pre_delete, sender=Shop)
+@receiver(pre_delete, sender=Product)
+def handle_offers_owner_deleted(sender, instance, **kwargs):
+    """
+    Обработчик для записи в журнал движка каталога предложений, которые
+    удаляются каскадом вместе с магазином или продуктом. Предложения,
+    удаляемые напрямую, записывают импорт и админка
+    """
+    field = 'shop_id' if sender is Shop else 'product_id'
+    log_deleted_product_infos(ProductInfo.objects.filter(
+        **{field: instance.id}).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Product)
+def handle_product_saved(instance, created, **kwargs):
+    """
+    Обработчик для отметки предложений продукта измененными: категория
+    продукта входит в колонки движка каталога
+    """
+    if not created:
+        ProductInfo.objects.filter(product_id=instance.id).update(
+            updated_at=timezone.now())
@@ -0,0 +1,209 @@
+# suggest.py
+import heapq
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+from django.db import connections
+
+from .catalog import catalog_version
+from .models import Product, ProductInfo
+
+# Для префиксов, которым соответствует больше ключей, лучшие подсказки
+# считаются при построении: иначе короткий запрос ранжировал бы большую
+# часть каталога
+TOP_RANGE = 512
+MAX_LIMIT = 20
+# Конец диапазона префикса в отсортированном массиве ключей
+PREFIX_END = '\U0010ffff'
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(text):
+    return ' '.join(text.casefold().replace('ё', 'е').split())
+
+
+class SuggestIndex:
+    """
+    Префиксный индекс названий продуктов и моделей предложений
+
+    Ключи (название или модель с начала каждого слова) хранятся одним
+    отсортированным списком, номера продуктов и моделей - массивами
+    array, поэтому поиск префикса - два бинарных поиска. Продукты
+    ранжируются по наличию, числу предложений и остатку; для префиксов
+    с большим числом ключей результат посчитан заранее.
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.product_ids = array('q')
+        self.names = []
+        self.offers = array('I')
+        self.quantities = array('Q')
+        self.scores = array('Q')
+        self.models = []
+        self.keys = []
+        self.key_products = array('I')
+        self.key_models = array('i')
+        self.top = {}
+
+    @classmethod
+    def build(cls, version):
+        index = cls(version)
+        positions = {}
+        for product_id, name, offers_count, total_quantity in \
+                Product.objects.values_list(
+                    'id', 'name', 'offers_summary__offers_count',
+                    'offers_summary__total_quantity').order_by('id'):
+            positions[product_id] = len(index.product_ids)
+            index.product_ids.append(product_id)
+            index.names.append(name)
+            index.offers.append(offers_count or 0)
+            index.quantities.append(total_quantity or 0)
+            index.scores.append(
+                (bool(total_quantity) << 62) + (min(offers_count or 0,
+                                                    2 ** 20) << 40)
+                + min(total_quantity or 0, 2 ** 40 - 1))
+
+        entries = [(key, position, -1)
+                   for position, name in enumerate(index.names)
+                   for key in cls.word_keys(name)]
+        models = {}
+        for product_id, model in ProductInfo.objects.filter(
+                shop__state=True).exclude(model='').values_list(
+                'product_id', 'model').distinct().order_by():
+            model_position = models.setdefault(model, len(models))
+            entries.extend((key, positions[product_id], model_position)
+                           for key in cls.word_keys(model))
+        index.models = list(models)
+
+        entries.sort()
+        index.keys = [key for key, _, _ in entries]
+        index.key_products = array('I', (position
+                                         for _, position, _ in entries))
+        index.key_models = array('i', (model for _, _, model in entries))
+
+        index.build_top()
+        return index
+
+    def build_top(self):
+        # Спуск по префиксам от коротких к длинным только внутри больших
+        # диапазонов: на каждом уровне диапазоны не пересекаются
+        ranges = [('', 0, len(self.keys))]
+        while ranges:
+            prefix, start, end = ranges.pop()
+            # Ключи, равные префиксу, стоят в начале его диапазона
+            position = bisect_right(self.keys, prefix, start, end)
+            while position < end:
+                child = self.keys[position][:len(prefix) + 1]
+                child_end = bisect_left(self.keys, child + PREFIX_END,
+                                        position, end)
+                if child_end - position > TOP_RANGE:
+                    self.top[child] = self.rank(child, MAX_LIMIT)
+                    ranges.append((child, position, child_end))
+                position = child_end
+
+    @staticmethod
+    def word_keys(text):
+        words = normalize(text).split(' ')
+        return {' '.join(words[start:]) for start in range(len(words))
+                if words[start]}
+
+    def rank(self, prefix, limit):
+        start = bisect_left(self.keys, prefix)
+        end = bisect_left(self.keys, prefix + PREFIX_END, start)
+        # Лучшее совпадение каждого продукта: название важнее модели
+        matches = {}
+        for key in range(start, end):
+            position = self.key_products[key]
+            model = self.key_models[key]
+            if position not in matches or model < 0:
+                matches[position] = model
+        return heapq.nlargest(
+            limit, matches.items(),
+            key=lambda match: (self.scores[match[0]], -match[0]))
+
+    def suggest(self, query, limit=10):
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        limit = min(limit, MAX_LIMIT)
+        if prefix in self.top:
+            matches = self.top[prefix][:limit]
+        else:
+            matches = self.rank(prefix, limit)
+        return [{
+            'id': self.product_ids[position],
+            'name': self.names[position],
+            'model': self.models[model] if model >= 0 else None,
+            'offers_count': self.offers[position],
+            'total_quantity': self.quantities[position],
+        } for position, model in matches]
+
+
+_index = None
+_build_lock = threading.Lock()
+
+
+def rebuild_suggest_index():
+    """
+    Построение индекса при захваченной блокировке
+
+    Версия каталога читается в начале построения, поэтому все изменения,
+    зафиксированные до него, попадают в одно перестроение.
+    """
+    global _index
+    try:
+        _index = SuggestIndex.build(catalog_version())
+    except Exception:
+        # Запросы продолжат получать прежний индекс
+        logger.exception('Не удалось перестроить индекс подсказок')
+    finally:
+        _build_lock.release()
+
+
+def start_rebuild():
+    def run():
+        try:
+            rebuild_suggest_index()
+        finally:
+            # Соединения с базой принадлежат потоку и закрываются вместе с ним
+            connections.close_all()
+
+    threading.Thread(target=run, name='suggest-index', daemon=True).start()
+
+
+def get_suggest_index():
+    """
+    Индекс текущей версии каталога
+
+    Первый запрос процесса строит индекс. После смены версии каталога,
+    но не чаще SUGGEST_REBUILD_INTERVAL, и не реже SUGGEST_FULL_REBUILD
+    индекс перестраивается в фоновом потоке, запросы тем временем
+    получают прежний индекс.
+    """
+    global _index
+    index = _index
+    version = catalog_version()
+    if index is None:
+        with _build_lock:
+            if _index is None:
+                _index = SuggestIndex.build(version)
+            return _index
+    age = time.monotonic() - index.built_at
+    if age < settings.SUGGEST_FULL_REBUILD and (
+            index.version == version
+            or age < settings.SUGGEST_REBUILD_INTERVAL):
+        return index
+    if _build_lock.acquire(blocking=False):
+        try:
+            start_rebuild()
+        except Exception:
+            _build_lock.release()
+            raise
+    return index
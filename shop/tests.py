@@ -1,3 +1,2064 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import hmac
+import io
+import json
+import re
+import socketserver
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import requests
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from . import catalog_engine, db_router, suggest
+from .authentication import token_cache
+from .catalog import CATALOG_VERSION_KEY, bump_catalog_version, \
+    catalog_version
+from .events import broker, stock_events_app, publish_stock_removed
+from .metrics import registry, render_metrics, RequestStats
+from .models import User, Shop, Category, Product, ProductInfo, Parameter, \
+    ProductParameter, Contact, Order, OrderItem, ShopOrder, \
+    ConfirmEmailToken, SalesDailyRollup, EmailOutbox, ProductOffers, \
+    ArchivedOrder, WebhookEvent, PriceListRefresh, CategoryShopStats, \
+    DeletedProductInfo
+from .price_refresh import refresh_due_shops
+from .services import record_order_sales, numeric_value, \
+    rebuild_category_stats, update_stock, claim_outbox_batch, \
+    load_price_list, refresh_product_offers, import_price_list
+from .throttling import parse_rate
+from .webhooks import dispatch_pending, claim_pending_events, \
+    SIGNATURE_HEADER, TIMESTAMP_HEADER
+
+# Таблицы, которые растут вместе с каталогом и историей заказов:
+# запросы к ним не должны читать таблицу целиком
+LARGE_TABLES = {
+    'shop_product', 'shop_productinfo', 'shop_productparameter', 'shop_order',
+    'shop_orderitem', 'shop_shoporder', 'shop_archivedorder',
+    'shop_archivedorderitem', 'shop_archivedshoporder',
+    'shop_salesdailyrollup', 'shop_contact',
+}
+SMALL = 10
+LARGE = 1000
+COLORS = ('черный', 'белый', 'красный', 'синий')
+
+
+# Кэш в памяти процесса: проверки не зависят от кэша прошлых запусков
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class QueryBudgetTestCase(TestCase):
+    """
+    Базовый класс проверок числа запросов и планов выполнения
+
+    Каждая проверка выполняет запрос к API на маленьком и большом наборе
+    данных: число запросов к базе должно совпадать и не превышать
+    бюджет, а основные запросы не должны полностью сканировать большие
+    таблицы.
+    """
+
+    def setUp(self):
+        # Django делит вставки и IN-списки на пачки по 999 параметров,
+        # хотя SQLite принимает больше. Поднимаем предел, чтобы число
+        # запросов зависело только от кода представлений.
+        patcher = mock.patch.object(connection.features, 'max_query_params',
+                                    32766)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        token_cache.clear()
+        self.buyer = User.objects.create_user(
+            'buyer@example.com', 'password', is_active=True)
+        self.contact = Contact.objects.create(
+            user=self.buyer, city='Москва', street='Тверская', phone='+7900')
+        self.owner = User.objects.create_user(
+            'shop@example.com', 'password', type='shop', is_active=True)
+        self.shop = Shop.objects.create(name='Магазин', user=self.owner)
+        self.category = Category.objects.create(name='Категория')
+        self.category.shops.add(self.shop)
+        self.parameters = [Parameter.objects.create(name=f'Параметр {index}')
+                           for index in range(3)]
+        self.offers = []
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def add_offers(self, count):
+        # Товары магазина с параметрами, добавляются к уже созданным
+        start = len(self.offers)
+        products = Product.objects.bulk_create([
+            Product(name=f'Товар {index}', category=self.category)
+            for index in range(start, start + count)
+        ])
+        offers = ProductInfo.objects.bulk_create([
+            ProductInfo(product=product, shop=self.shop,
+                        external_id=start + index, model=f'M-{index}',
+                        quantity=100, price=100 + index,
+                        price_rrc=200 + index,
+                        parameters={
+                            parameter.name: str(start + index)
+                            for parameter in self.parameters
+                        } | {'Цвет': COLORS[(start + index) % len(COLORS)]})
+            for index, product in enumerate(products)
+        ])
+        ProductParameter.objects.bulk_create([
+            ProductParameter(product_info=offer, parameter=parameter,
+                             value=offer.parameters[parameter.name],
+                             value_numeric=numeric_value(
+                                 offer.parameters[parameter.name]))
+            for offer in offers for parameter in self.parameters
+        ])
+        self.offers += offers
+        return offers
+
+    def add_orders(self, count, state='new', items=2):
+        # Оформленные заказы покупателя с подзаказами магазина
+        if len(self.offers) < items:
+            self.add_offers(items)
+        orders = Order.objects.bulk_create([
+            Order(user=self.buyer, state=state, contact=self.contact)
+            for _ in range(count)
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_info=offer, quantity=1,
+                      price=offer.price)
+            for order in orders for offer in self.offers[:items]
+        ])
+        ShopOrder.objects.bulk_create([
+            ShopOrder(order=order, shop=self.shop, dt=order.dt,
+                      total_sum=sum(offer.price
+                                    for offer in self.offers[:items]),
+                      items_count=items)
+            for order in orders
+        ])
+        return orders
+
+    def archive(self, orders):
+        # Заказы становятся старше года (по порядку списка) и переносятся
+        # в архив командой
+        old = timezone.now() - timedelta(days=400)
+        for index, order in enumerate(orders):
+            dt = old + timedelta(seconds=index)
+            Order.objects.filter(id=order.id).update(dt=dt)
+            ShopOrder.objects.filter(order=order).update(dt=dt)
+        output = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('archive_orders', stdout=output)
+        return output.getvalue()
+
+    def fill_basket(self, offers):
+        basket, _ = Order.objects.get_or_create(user=self.buyer,
+                                                state='basket')
+        return OrderItem.objects.bulk_create([
+            OrderItem(order=basket, product_info=offer, quantity=1)
+            for offer in offers
+        ])
+
+    def capture(self, make_request):
+        # Кэш (лимиты частоты, горизонт архива) сбрасывается перед каждым
+        # замером, чтобы замеры были сравнимы
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = make_request()
+        content = b'' if response.streaming else response.content
+        self.assertLess(response.status_code, 400, content)
+        if content.startswith(b'{'):
+            self.assertNotEqual(json.loads(content).get('Status'), False,
+                                content)
+        return context.captured_queries
+
+    def assertQueryBudget(self, small, large, budget):
+        """
+        Одинаковое число запросов на маленьком и большом наборе данных
+        """
+        self.assertEqual(
+            len(small), len(large),
+            'Число запросов зависит от объема данных:\n'
+            + '\n'.join(query['sql'] for query in large))
+        self.assertLessEqual(
+            len(large), budget,
+            'Превышен бюджет запросов:\n'
+            + '\n'.join(query['sql'] for query in large))
+
+    def assertNoFullScans(self, queries, tables=LARGE_TABLES):
+        """
+        Ни один SELECT не сканирует большую таблицу целиком
+
+        Обход индекса или первичного ключа допустим только в запросах с
+        LIMIT и без сортировки во временном B-дереве: так читаются первые
+        строки страницы или максимум по индексу.
+        """
+        for query in queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT'):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                plan = [row[-1] for row in cursor.fetchall()]
+            for line in plan:
+                match = re.match(r'SCAN (\w+)', line)
+                if not match or match.group(1) not in tables:
+                    continue
+                if ' LIMIT ' not in sql or any(
+                        'TEMP B-TREE' in step for step in plan):
+                    self.fail(f'Полное сканирование {match.group(1)}:\n'
+                              f'{sql}\n' + '\n'.join(plan))
+
+
+class StandInServer(socketserver.ThreadingTCPServer):
+    """
+    Локальный сервер-заглушка для проверок доставки, работает в потоке
+    """
+    daemon_threads = True
+
+    def __init__(self, handler):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.port = self.server_address[1]
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    # Минимальный SMTP: письма копятся в server.messages, получатели из
+    # server.rejected отклоняются кодом 550
+
+    def handle(self):
+        self.server.sessions += 1
+        self.reply('220 localhost')
+        recipients = []
+        while line := self.rfile.readline():
+            command = line.decode().strip()
+            verb = command[:4].upper()
+            if verb == 'RCPT':
+                address = command.split(':', 1)[1].strip(' <>')
+                if address in self.server.rejected:
+                    self.reply('550 Mailbox unavailable')
+                    continue
+                recipients.append(address)
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while (line := self.rfile.readline()) not in (b'.\r\n', b''):
+                    data.append(line)
+                self.server.messages.append((recipients, b''.join(data)))
+                recipients = []
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                break
+            self.reply('250 OK')
+
+    def reply(self, text):
+        self.wfile.write(f'{text}\r\n'.encode())
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    # Принимает POST, копит (заголовки, тело) в server.requests и отвечает
+    # кодами из server.statuses (по умолчанию 200)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((self.headers, body))
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class CatalogQueryTests(QueryBudgetTestCase):
+
+    def test_categories(self):
+        client = APIClient()
+
+        def listed():
+            return {category['id']: category for category
+                    in client.get('/api/v1/categories').json()}
+
+        small = self.capture(lambda: client.get('/api/v1/categories'))
+        Category.objects.bulk_create([Category(name=f'Категория {index}')
+                                      for index in range(LARGE)])
+        self.add_offers(SMALL)
+        call_command('rebuild_category_stats', stdout=io.StringIO())
+        large = self.capture(lambda: client.get('/api/v1/categories'))
+        self.assertQueryBudget(small, large, 2)
+        self.assertNoFullScans(large)
+        self.assertEqual(listed()[self.category.id], {
+            'id': self.category.id, 'name': self.category.name,
+            'products_count': SMALL, 'in_stock_count': SMALL,
+            'shops': [{'id': self.shop.id, 'name': self.shop.name,
+                       'products_count': SMALL, 'in_stock_count': SMALL}],
+        })
+
+        # Список отдается из кэша до смены версии каталога
+        with CaptureQueriesContext(connection) as context:
+            client.get('/api/v1/categories')
+        self.assertEqual(len(context.captured_queries), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            Shop.objects.filter(id=self.shop.id).update(state=False)
+            rebuild_category_stats([self.category.id])
+        category = listed()[self.category.id]
+        self.assertEqual((category['products_count'], category['shops']),
+                         (0, []))
+
+    def test_categories_after_partner_changes(self):
+        # Версия каталога в общем кэше: кэш списка сбрасывают импорт и
+        # изменение остатков партнером
+        client = APIClient()
+        partner = self.client_for(self.owner)
+
+        def listed():
+            return {category['name']: category for category
+                    in client.get('/api/v1/categories').json()}
+
+        self.assertNotIn('Смартфоны', listed())
+        version = catalog_version()
+        price_list = json.dumps({
+            'shop': self.shop.name,
+            'categories': [{'id': 900, 'name': 'Смартфоны'}],
+            'goods': [{'id': index, 'category': 900, 'model': f'M-{index}',
+                       'name': f'Смартфон {index}', 'price': 100,
+                       'price_rrc': 120, 'quantity': 5, 'parameters': {}}
+                      for index in range(3)],
+        }).encode()
+        with mock.patch('requests.get',
+                        return_value=mock.Mock(content=price_list)), \
+                self.captureOnCommitCallbacks(execute=True):
+            partner.post('/api/v1/partner/update',
+                         {'url': 'https://partner.example/p.yaml'})
+        self.assertNotEqual(cache.get(CATALOG_VERSION_KEY), version)
+        category = listed()['Смартфоны']
+        self.assertEqual((category['products_count'],
+                          category['in_stock_count']), (3, 3))
+
+        # Повторный импорт удаляет товары пачкой, и версия каталога
+        # меняется один раз на транзакцию, а не на каждый товар
+        with mock.patch('requests.get', return_value=mock.Mock(
+                content=json.dumps({**json.loads(price_list), 'goods': []
+                                    }).encode())), \
+                self.captureOnCommitCallbacks() as callbacks:
+            partner.post('/api/v1/partner/update',
+                         {'url': 'https://partner.example/p.yaml'})
+        self.assertEqual(callbacks.count(bump_catalog_version), 1)
+        with mock.patch('requests.get',
+                        return_value=mock.Mock(content=price_list)), \
+                self.captureOnCommitCallbacks(execute=True):
+            partner.post('/api/v1/partner/update',
+                         {'url': 'https://partner.example/p.yaml'})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            partner.patch('/api/v1/partner/stock', json.dumps([
+                {'external_id': index, 'quantity': 0} for index in range(2)
+            ]), content_type='application/json')
+        category = listed()['Смартфоны']
+        self.assertEqual((category['products_count'],
+                          category['in_stock_count']), (3, 1))
+
+    def test_shops(self):
+        client = APIClient()
+        small = self.capture(lambda: client.get('/api/v1/shops'))
+        Shop.objects.bulk_create([Shop(name=f'Магазин {index}')
+                                  for index in range(LARGE)])
+        large = self.capture(lambda: client.get('/api/v1/shops'))
+        self.assertQueryBudget(small, large, 1)
+
+    def test_products(self):
+        client = APIClient()
+        url = f'/api/v1/products?category_id={self.category.id}'
+        self.add_offers(SMALL)
+        small = self.capture(lambda: client.get(url))
+        self.add_offers(LARGE - SMALL)
+        large = self.capture(lambda: client.get(url))
+        self.assertQueryBudget(small, large, 3)
+        self.assertEqual(len(client.get(url).json()), LARGE)
+
+    def test_products_by_shop(self):
+        client = APIClient()
+        url = (f'/api/v1/products?shop_id={self.shop.id}'
+               f'&category_id={self.category.id}')
+        self.add_offers(SMALL)
+        small = self.capture(lambda: client.get(url))
+        self.add_offers(LARGE - SMALL)
+        large = self.capture(lambda: client.get(url))
+        self.assertQueryBudget(small, large, 3)
+        self.assertNoFullScans(large[1:])
+
+    def test_product_detail(self):
+        client = self.client_for(self.buyer)
+        offer = self.add_offers(1)[0]
+        url = f'/api/v1/products/{offer.id}/'
+        small = self.capture(lambda: client.get(url))
+        self.add_offers(LARGE)
+        large = self.capture(lambda: client.get(url))
+        self.assertQueryBudget(small, large, 3)
+        self.assertNoFullScans(large)
+        self.assertEqual(client.get(url).json()['product_parameters'][0],
+                         {'parameter': 'Параметр 0', 'value': '0'})
+
+    def test_products_by_parameter(self):
+        client = APIClient()
+        url = '/api/v1/products?param[Цвет]=красный'
+        self.add_offers(SMALL)
+        small = self.capture(lambda: client.get(url))
+        self.add_offers(LARGE - SMALL)
+        large = self.capture(lambda: client.get(url))
+        self.assertQueryBudget(small, large, 1)
+        # Фильтр по индексу product_info_color_idx
+        self.assertNoFullScans(large)
+        products = client.get(url + '&param[Параметр 1]=2').json()
+        self.assertEqual([product['id'] for product in products],
+                         [self.offers[2].id])
+
+    def test_products_by_range_sorted(self):
+        client = APIClient()
+        url = (f'/api/v1/products?shop_id={self.shop.id}&sort=-price'
+               '&param_min[Параметр 0]=3&param_max[Параметр 0]=5')
+        self.add_offers(SMALL)
+        small = self.capture(lambda: client.get(url))
+        self.add_offers(LARGE - SMALL)
+        large = self.capture(lambda: client.get(url))
+        self.assertQueryBudget(small, large, 1)
+        # Диапазон по индексу product_parameter_numeric_idx, без сортировки
+        # во временном B-дереве
+        self.assertNoFullScans(large)
+        products = client.get(url).json()
+        self.assertEqual([product['id'] for product in products],
+                         [offer.id for offer in self.offers[5:2:-1]])
+
+        sorted_url = f'/api/v1/products?shop_id={self.shop.id}&sort=price'
+        self.assertNoFullScans(self.capture(lambda: client.get(sorted_url)))
+        for value in ('много', 'nan', 'inf', '-Infinity'):
+            response = client.get(
+                sorted_url + f'&param_min[Параметр 0]={value}')
+            self.assertEqual(response.status_code, 400, value)
+        response = client.get(sorted_url + '&param_max[Параметр 0]=NaN')
+        self.assertEqual(response.status_code, 400)
+
+    def test_product_offers(self):
+        client = APIClient()
+        offers = self.add_offers(SMALL)
+        other = Shop.objects.create(name='Другой магазин')
+        cheaper = ProductInfo.objects.create(
+            product=offers[1].product, shop=other, external_id=1,
+            quantity=7, price=50, price_rrc=60)
+        call_command('rebuild_product_offers', stdout=io.StringIO())
+        url = f'/api/v1/products/{offers[1].product_id}/offers'
+        small = self.capture(lambda: client.get(url))
+        self.add_offers(LARGE - SMALL)
+        call_command('rebuild_product_offers', stdout=io.StringIO())
+        large = self.capture(lambda: client.get(url))
+        self.assertQueryBudget(small, large, 1)
+        self.assertNoFullScans(large)
+        summary = client.get(url).json()
+        self.assertEqual(
+            (summary['min_price'], summary['max_price'],
+             summary['cheapest_offer'], summary['cheapest_shop']['id'],
+             summary['total_quantity'], summary['offers_count']),
+            (50, offers[1].price, cheaper.id, other.id, 107, 2))
+
+        # Сортировка каталога по лучшей цене продукта
+        products = client.get(f'/api/v1/products?shop_id={self.shop.id}'
+                              '&sort=min_price').json()
+        self.assertEqual(products[0]['id'], offers[1].id)
+        self.assertEqual(client.get('/api/v1/products/0/offers').status_code,
+                         404)
+
+    def inline_suggest_rebuild(self):
+        # Фоновый поток не видит данных транзакции теста: индекс
+        # перестраивается в потоке запроса, который получает прежний индекс
+        self.enterContext(mock.patch.object(suggest, '_index', None))
+        self.enterContext(mock.patch.object(
+            suggest, 'start_rebuild', suggest.rebuild_suggest_index))
+
+    @override_settings(SUGGEST_REBUILD_INTERVAL=0)
+    def test_suggest(self):
+        self.inline_suggest_rebuild()
+        client = APIClient()
+        url = '/api/v1/products/suggest?q=товар 5&limit=20'
+
+        def suggested(query):
+            return client.get('/api/v1/products/suggest',
+                              {'q': query}).json()
+
+        offers = self.add_offers(SMALL)
+        # Индекс строится заново после смены версии каталога
+        small = self.capture(lambda: client.get(url))
+        self.add_offers(LARGE - SMALL)
+        offers[5].quantity = 0
+        offers[5].save(update_fields=['quantity'])
+        other = Shop.objects.create(name='Другой магазин')
+        ProductInfo.objects.create(
+            product=offers[3].product, shop=other, external_id=1,
+            model='Galaxy S24', quantity=1, price=50, price_rrc=60)
+        call_command('rebuild_product_offers', stdout=io.StringIO())
+        large = self.capture(lambda: client.get(url))
+        self.assertQueryBudget(small, large, 2)
+
+        # Готовый индекс отвечает без запросов к базе
+        with CaptureQueriesContext(connection) as context:
+            products = client.get(url).json()
+        self.assertEqual(len(context.captured_queries), 0)
+        self.assertEqual(len(products), 20)
+        self.assertEqual(products[0]['name'], 'Товар 50')
+        self.assertNotIn(offers[5].product_id,
+                         [product['id'] for product in products])
+
+        # Больше предложений - выше в подсказках; префикс, которому
+        # соответствует весь каталог, отвечает из заранее посчитанных
+        products = suggested('товар')
+        self.assertEqual(
+            [(product['id'], product['offers_count']) for product
+             in products[:2]],
+            [(offers[3].product_id, 2), (offers[0].product_id, 1)])
+        self.assertEqual(suggested('Т'), products)
+        self.assertEqual(suggested('s24'), [{
+            'id': offers[3].product_id, 'name': 'Товар 3',
+            'model': 'Galaxy S24', 'offers_count': 2, 'total_quantity': 101,
+        }])
+
+        # Переименование видно после перестроения индекса
+        with override_settings(SUGGEST_REBUILD_INTERVAL=3600):
+            with self.captureOnCommitCallbacks(execute=True):
+                offers[3].product.name = 'Смартфон'
+                offers[3].product.save(update_fields=['name'])
+            self.assertEqual(suggested('смарт'), [])
+        self.assertEqual(suggested('смарт'), [])
+        self.assertEqual(suggested('смарт')[0]['id'], offers[3].product_id)
+        self.assertEqual(suggested(''), [])
+
+    def test_suggest_background_rebuild(self):
+        self.enterContext(mock.patch.object(suggest, '_index', None))
+        start = self.enterContext(mock.patch.object(suggest, 'start_rebuild'))
+        offers = self.add_offers(2)
+        index = suggest.get_suggest_index()
+        start.assert_not_called()
+
+        # После смены версии запросы получают прежний индекс, пока один
+        # фоновый поток строит новый. Серия правок, пришедшая до начала
+        # построения, дает одно перестроение с последней версией
+        with override_settings(SUGGEST_REBUILD_INTERVAL=0):
+            for offer, name in zip(offers, ['Смартфон', 'Смарт-часы']):
+                with self.captureOnCommitCallbacks(execute=True):
+                    offer.product.name = name
+                    offer.product.save(update_fields=['name'])
+                self.assertIs(suggest.get_suggest_index(), index)
+            start.assert_called_once_with()
+            suggest.rebuild_suggest_index()
+            index = suggest.get_suggest_index()
+            self.assertEqual(index.version, catalog_version())
+            self.assertEqual({row['id'] for row in index.suggest('смарт')},
+                             {offer.product_id for offer in offers})
+            self.assertIs(suggest.get_suggest_index(), index)
+            start.assert_called_once_with()
+
+        # Полное перестроение по времени без смены версии
+        start.reset_mock()
+        with override_settings(SUGGEST_FULL_REBUILD=0):
+            self.assertIs(suggest.get_suggest_index(), index)
+        start.assert_called_once_with()
+
+        # Ошибка построения не оставляет блокировку захваченной
+        with mock.patch.object(suggest.SuggestIndex, 'build',
+                               side_effect=RuntimeError), \
+                self.assertLogs('shop.suggest', 'ERROR'):
+            suggest.rebuild_suggest_index()
+        self.assertIs(suggest.get_suggest_index(), index)
+        self.assertFalse(suggest._build_lock.locked())
+
+    def test_products_page(self):
+        client = APIClient()
+        url = (f'/api/v1/products?category_id={self.category.id}&in_stock=1'
+               '&price_min=105&sort=-price&limit=5&offset=2')
+        self.add_offers(SMALL)
+        small = self.capture(lambda: client.get(url))
+        self.add_offers(LARGE - SMALL)
+        large = self.capture(lambda: client.get(url))
+        self.assertQueryBudget(small, large, 1)
+        # Страница читается по индексу product_info_price_idx
+        self.assertNoFullScans(large)
+        expected = sorted((offer for offer in self.offers
+                           if offer.price >= 105),
+                          key=lambda offer: (-offer.price, -offer.id))
+        self.assertEqual([product['id'] for product in
+                          client.get(url).json()],
+                         [offer.id for offer in expected[2:7]])
+        self.assertEqual(
+            [product['id'] for product in
+             client.get('/api/v1/products?limit=3&offset=1').json()],
+            [offer.id for offer in self.offers[1:4]])
+        for query in ('limit=много', 'limit=5&offset=x', 'price_max=дешево'):
+            self.assertEqual(
+                client.get(f'/api/v1/products?{query}').status_code, 400)
+
+    @skipUnless(catalog_engine.np, 'numpy не установлен')
+    @override_settings(CATALOG_ENGINE={'BACKEND': 'numpy', 'OVERLAP': 60,
+                                       'FULL_RELOAD': 3600})
+    def test_catalog_engine(self):
+        # Снимок движка прошлых тестов не относится к этой базе
+        self.enterContext(mock.patch.object(catalog_engine, '_engine', None))
+        client = APIClient()
+        offers = self.add_offers(SMALL)
+        other = Shop.objects.create(name='Другой магазин', state=False)
+        hidden = ProductInfo.objects.create(
+            product=offers[0].product, shop=other, external_id=1,
+            quantity=5, price=104, price_rrc=200)
+        urls = [
+            '/api/v1/products?limit=20',
+            f'/api/v1/products?shop_id={self.shop.id}&sort=price&limit=7'
+            '&offset=3',
+            f'/api/v1/products?category_id={self.category.id}&in_stock=1'
+            '&sort=-price&limit=10',
+            '/api/v1/products?price_min=103&price_max=140&sort=price'
+            '&limit=50&offset=5',
+            '/api/v1/products?param[Цвет]=красный&limit=5',
+        ]
+
+        def assertSamePages():
+            for url in urls:
+                with override_settings(CATALOG_ENGINE={'BACKEND': 'orm'}):
+                    expected = client.get(url).json()
+                self.assertEqual(client.get(url).json(), expected, url)
+
+        # Первый запрос загружает товары, страницу читает один запрос
+        client.get(urls[0])
+        small = self.capture(lambda: client.get(urls[1]))
+        self.add_offers(LARGE - SMALL)
+        large = self.capture(lambda: client.get(urls[1]))
+        self.assertQueryBudget(small, large, 4)
+        self.assertNoFullScans(large[-1:])
+        with CaptureQueriesContext(connection) as context:
+            client.get(urls[2])
+        self.assertEqual(len(context.captured_queries), 1)
+        assertSamePages()
+
+        # Изменения дочитываются после смены версии каталога
+        moved = Category.objects.create(name='Другая категория')
+        with self.captureOnCommitCallbacks(execute=True):
+            update_stock(self.shop.id, [
+                {'external_id': 3, 'price': 1},
+                {'external_id': 4, 'quantity': 0},
+                {'external_id': 20, 'price': 120},
+            ])
+            offers[5].product.delete()
+            other.state = True
+            other.save()
+            product = offers[6].product
+            product.category = moved
+            product.save()
+            self.add_offers(5)
+        assertSamePages()
+        self.assertEqual(
+            [product['id'] for product in client.get(
+                f'/api/v1/products?shop_id={other.id}&limit=5').json()],
+            [hidden.id])
+        self.assertNotIn(offers[5].id, [product['id'] for product
+                                        in client.get(urls[0]).json()])
+
+        # Удаления из админки и каскадом убираются по журналу, даже если
+        # число товаров не изменилось
+        offer_admin = admin.site._registry[ProductInfo]
+        with self.captureOnCommitCallbacks(execute=True):
+            offer_admin.delete_queryset(None, ProductInfo.objects.filter(
+                id=offers[7].id))
+            offers[8].product.delete()
+            self.add_offers(2)
+        deleted = set(DeletedProductInfo.objects.values_list(
+            'product_info_id', flat=True))
+        self.assertEqual(len(deleted), 3)
+        self.assertLess({offers[7].id, offers[8].id}, deleted)
+        with CaptureQueriesContext(connection) as context:
+            assertSamePages()
+        self.assertFalse([query for query in context.captured_queries
+                          if 'COUNT(' in query['sql']])
+        listed = [product['id'] for product in client.get(
+            '/api/v1/products?limit=200').json()]
+        self.assertNotIn(offers[7].id, listed)
+        self.assertNotIn(offers[8].id, listed)
+
+        # Записи журнала старше полной перезагрузки удаляются
+        DeletedProductInfo.objects.update(
+            deleted_at=timezone.now() - timedelta(hours=2))
+        offer_admin.delete_model(None, offers[9])
+        self.assertEqual(list(DeletedProductInfo.objects.values_list(
+            'product_info_id', flat=True)), [offers[9].id])
+
+    @skipUnless(catalog_engine.np, 'numpy не установлен')
+    @override_settings(CATALOG_ENGINE={'BACKEND': 'numpy', 'OVERLAP': 60,
+                                       'FULL_RELOAD': 3600})
+    def test_catalog_engine_import_removed(self):
+        # Товары, удаленные импортом, пишутся в журнал одним INSERT,
+        # а не запросом на каждый товар. Сами товары Django удаляет
+        # пачками по 100
+        price_list = {
+            'shop': self.shop.name,
+            'categories': [{'id': self.category.id,
+                            'name': self.category.name}],
+            'goods': [],
+        }
+        self.add_offers(LARGE)
+        with self.assertNumQueries(36):
+            import_price_list(self.shop, price_list)
+        self.assertEqual(DeletedProductInfo.objects.count(), LARGE)
+
+        # Без движка numpy журнал не пишется
+        self.add_offers(SMALL)
+        with override_settings(CATALOG_ENGINE={'BACKEND': 'orm'}):
+            import_price_list(self.shop, price_list)
+        self.assertFalse(ProductInfo.objects.exists())
+        self.assertEqual(DeletedProductInfo.objects.count(), LARGE)
+
+
+class BasketQueryTests(QueryBudgetTestCase):
+
+    def post_items(self, client, offers):
+        return client.post('/api/v1/basket', {'items': json.dumps([
+            {'product_info': offer.id, 'quantity': 2} for offer in offers
+        ])})
+
+    def test_get(self):
+        client = self.client_for(self.buyer)
+        self.fill_basket(self.add_offers(SMALL))
+        small = self.capture(lambda: client.get('/api/v1/basket'))
+        self.fill_basket(self.add_offers(LARGE - SMALL))
+        large = self.capture(lambda: client.get('/api/v1/basket'))
+        self.assertQueryBudget(small, large, 7)
+        self.assertNoFullScans(large)
+
+    def test_post(self):
+        client = self.client_for(self.buyer)
+        offers = self.add_offers(SMALL + LARGE)
+        self.fill_basket([])
+        small = self.capture(lambda: self.post_items(client, offers[:SMALL]))
+        large = self.capture(lambda: self.post_items(client, offers[SMALL:]))
+        self.assertQueryBudget(small, large, 5)
+        self.assertEqual(OrderItem.objects.filter(quantity=2).count(),
+                         SMALL + LARGE)
+
+    def test_post_rejects_unknown_product(self):
+        client = self.client_for(self.buyer)
+        offer = self.add_offers(1)[0]
+        response = self.post_items(client, [offer, ProductInfo(id=0)])
+        self.assertFalse(response.json()['Status'])
+        self.assertFalse(OrderItem.objects.exists())
+
+    def test_put(self):
+        client = self.client_for(self.buyer)
+
+        def update(items):
+            return client.put('/api/v1/basket', {'items': json.dumps([
+                {'id': item.id, 'quantity': 5} for item in items
+            ])})
+
+        items = self.fill_basket(self.add_offers(SMALL + LARGE))
+        small = self.capture(lambda: update(items[:SMALL]))
+        large = self.capture(lambda: update(items[SMALL:]))
+        self.assertQueryBudget(small, large, 3)
+        self.assertEqual(OrderItem.objects.filter(quantity=5).count(),
+                         SMALL + LARGE)
+
+    def test_delete(self):
+        client = self.client_for(self.buyer)
+
+        def delete(items):
+            return client.delete('/api/v1/basket', {
+                'items': ','.join(str(item.id) for item in items)})
+
+        items = self.fill_basket(self.add_offers(SMALL + LARGE))
+        small = self.capture(lambda: delete(items[:SMALL]))
+        large = self.capture(lambda: delete(items[SMALL:]))
+        self.assertQueryBudget(small, large, 3)
+        self.assertFalse(OrderItem.objects.exists())
+
+
+class OrderQueryTests(QueryBudgetTestCase):
+
+    def test_history(self):
+        client = self.client_for(self.buyer)
+        self.add_orders(SMALL)
+        small = self.capture(lambda: client.get('/api/v1/order?limit=20'))
+        self.add_orders(LARGE - SMALL)
+        large = self.capture(lambda: client.get('/api/v1/order?limit=20'))
+        self.assertQueryBudget(small, large, 7)
+        self.assertNoFullScans(large)
+
+    def test_history_archive(self):
+        # Страницы истории продолжаются архивом, суммы и цены архива
+        # берутся из позиций на момент оформления
+        client = self.client_for(self.buyer)
+        orders = self.add_orders(5, state='delivered')
+        output = self.archive(orders[:3])
+        self.assertIn('Перенесено в архив заказов: 3', output)
+        self.assertEqual(ArchivedOrder.objects.count(), 3)
+        self.assertEqual(Order.objects.count(), 2)
+        ProductInfo.objects.update(price=F('price') * 2)
+
+        received, params = [], {'limit': 2}
+        while page := client.get('/api/v1/order', params).json():
+            received += page
+            params = {'limit': 2, 'before': page[-1]['dt'],
+                      'before_id': page[-1]['id']}
+        self.assertEqual([entry['id'] for entry in received],
+                         [order.id for order in reversed(orders)])
+        self.assertEqual({entry['total_sum'] for entry in received}, {201})
+        self.assertEqual(
+            [item['product_info']['price']
+             for item in received[-1]['ordered_items']], [100, 101])
+
+    def test_history_same_dt(self):
+        # Заказы с одной датой в истории и архиве не теряются и не
+        # повторяются на границе страниц
+        client = self.client_for(self.buyer)
+        orders = self.add_orders(7, state='delivered')
+        self.archive(orders[:4])
+        same = ArchivedOrder.objects.latest('dt').dt
+        ArchivedOrder.objects.update(dt=same)
+        Order.objects.update(dt=same)
+
+        received, params = [], {'limit': 3}
+        while page := client.get('/api/v1/order', params).json():
+            received += [entry['id'] for entry in page]
+            params = {'limit': 3, 'before': page[-1]['dt'],
+                      'before_id': page[-1]['id']}
+        self.assertEqual(received,
+                         sorted((order.id for order in orders), reverse=True))
+        response = client.get('/api/v1/order', {'before': same.isoformat(),
+                                                'before_id': 'x'})
+        self.assertEqual(response.json()['Errors'],
+                         'Неверный параметр before_id')
+
+    def test_checkout(self):
+        client = self.client_for(self.buyer)
+
+        def checkout(offers):
+            self.fill_basket(offers)
+            basket = Order.objects.get(user=self.buyer, state='basket')
+            return lambda: client.post('/api/v1/order', {
+                'id': basket.id, 'contact': self.contact.id})
+
+        small = self.capture(checkout(self.add_offers(SMALL)))
+        large = self.capture(checkout(self.add_offers(LARGE)))
+        self.assertQueryBudget(small, large, 16)
+        self.assertEqual(
+            SalesDailyRollup.objects.filter(shop=self.shop).count(),
+            SMALL + LARGE)
+
+    def test_checkout_date(self):
+        # Дата заказа и подзаказов - момент оформления, а не создания корзины
+        self.fill_basket(self.add_offers(2))
+        basket = Order.objects.get(user=self.buyer, state='basket')
+        created = timezone.now() - timedelta(days=3)
+        Order.objects.filter(id=basket.id).update(dt=created)
+        self.client_for(self.buyer).post('/api/v1/order', {
+            'id': basket.id, 'contact': self.contact.id})
+        basket.refresh_from_db()
+        self.assertGreater(basket.dt, created + timedelta(days=2))
+        self.assertEqual(ShopOrder.objects.get(order=basket).dt, basket.dt)
+
+
+class PartnerQueryTests(QueryBudgetTestCase):
+
+    def test_orders(self):
+        client = self.client_for(self.owner)
+        self.add_orders(SMALL)
+        small = self.capture(lambda: client.get('/api/v1/partner/orders'))
+        self.add_orders(LARGE - SMALL)
+        large = self.capture(lambda: client.get('/api/v1/partner/orders'))
+        self.assertQueryBudget(small, large, 7)
+        self.assertNoFullScans(large)
+
+    def test_orders_pagination(self):
+        # Заказы с одинаковой датой не теряются на границе страниц
+        client = self.client_for(self.owner)
+        orders = self.add_orders(7)
+        ShopOrder.objects.update(dt=timezone.now())
+        received, params = [], {'limit': 3}
+        while True:
+            page = client.get('/api/v1/partner/orders', params).json()
+            if not page:
+                break
+            received += [entry['id'] for entry in page]
+            params = {'limit': 3, 'before': page[-1]['dt'],
+                      'before_id': page[-1]['id']}
+        self.assertEqual(received,
+                         sorted((order.id for order in orders), reverse=True))
+
+    def test_orders_archive(self):
+        # Архивные заказы остаются в истории магазина после удаления
+        # оперативных подзаказов
+        client = self.client_for(self.owner)
+        orders = self.add_orders(5, state='delivered')
+        self.archive(orders[:3])
+        self.assertEqual(ShopOrder.objects.count(), 2)
+
+        received, params = [], {'limit': 2}
+        while page := client.get('/api/v1/partner/orders', params).json():
+            received += page
+            params = {'limit': 2, 'before': page[-1]['dt'],
+                      'before_id': page[-1]['id']}
+        self.assertEqual([entry['id'] for entry in received],
+                         [order.id for order in reversed(orders)])
+        self.assertEqual({entry['total_sum'] for entry in received}, {201})
+        self.assertEqual({len(entry['ordered_items'])
+                          for entry in received}, {2})
+        self.assertEqual(received[-1]['contact']['city'], 'Москва')
+
+    def test_order_state(self):
+        client = self.client_for(self.owner)
+
+        def cancel(orders):
+            return lambda: client.post('/api/v1/partner/orders/state', {
+                'items': ','.join(str(order.id) for order in orders),
+                'state': 'canceled'})
+
+        orders = self.add_orders(SMALL + LARGE)
+        for order in orders:
+            record_order_sales(order)
+        small = self.capture(cancel(orders[:SMALL]))
+        large = self.capture(cancel(orders[SMALL:]))
+        self.assertQueryBudget(small, large, 9)
+        self.assertNoFullScans(large)
+        self.assertEqual(
+            Order.objects.filter(state='canceled').count(), SMALL + LARGE)
+        self.assertFalse(SalesDailyRollup.objects.filter(
+            units__gt=0).exists())
+
+    def test_order_state_rejected(self):
+        client = self.client_for(self.owner)
+        # Заказ с товарами двух магазинов: статус общий, один магазин не
+        # может его менять, сводки продаж другого магазина не трогаются
+        other = User.objects.create_user('other@example.com', 'password',
+                                         type='shop', is_active=True)
+        other_shop = Shop.objects.create(name='Другой', user=other)
+        other_product = Product.objects.create(name='Чужой товар',
+                                               category=self.category)
+        other_offer = ProductInfo.objects.create(
+            product=other_product, shop=other_shop, external_id=1,
+            quantity=10, price=500, price_rrc=600)
+        self.fill_basket(self.add_offers(2) + [other_offer])
+        shared = Order.objects.get(user=self.buyer, state='basket')
+        self.client_for(self.buyer).post('/api/v1/order', {
+            'id': shared.id, 'contact': self.contact.id})
+        # Заказ в статусе, из которого переход недопустим
+        sent, = self.add_orders(1, state='sent')
+
+        response = client.post('/api/v1/partner/orders/state', {
+            'items': f'{shared.id},{sent.id}', 'state': 'canceled'}).json()
+        self.assertEqual(response['Обновлено объектов'], 0)
+        self.assertEqual(response['Отклонено'], sorted([shared.id, sent.id]))
+        self.assertEqual(Order.objects.get(id=shared.id).state, 'new')
+        self.assertEqual(Order.objects.get(id=sent.id).state, 'sent')
+        self.assertEqual(SalesDailyRollup.objects.get(
+            shop=other_shop).revenue, 500)
+        self.assertFalse(SalesDailyRollup.objects.filter(
+            shop=self.shop, units=0).exists())
+
+    def test_order_state_price_change(self):
+        # Отмена вычитает из сводки цены на момент оформления, а не текущие
+        offers = self.add_offers(2)
+        self.fill_basket(offers)
+        order = Order.objects.get(user=self.buyer, state='basket')
+        self.client_for(self.buyer).post('/api/v1/order', {
+            'id': order.id, 'contact': self.contact.id})
+        self.assertEqual(sum(SalesDailyRollup.objects.values_list(
+            'revenue', flat=True)), 201)
+        ProductInfo.objects.update(price=F('price') * 3)
+
+        self.client_for(self.owner).post('/api/v1/partner/orders/state', {
+            'items': str(order.id), 'state': 'canceled'})
+        self.assertFalse(SalesDailyRollup.objects.filter(
+            revenue__gt=0).exists())
+        self.assertEqual(ShopOrder.objects.get(order=order).total_sum, 201)
+        self.assertEqual(sorted(OrderItem.objects.filter(
+            order=order).values_list('price', flat=True)), [100, 101])
+
+    def test_stats(self):
+        client = self.client_for(self.owner)
+
+        def add_rollups(count):
+            today = timezone.localdate()
+            offers = self.add_offers(count)
+            SalesDailyRollup.objects.bulk_create([
+                SalesDailyRollup(shop=self.shop, product_info=offer,
+                                 day=today - timedelta(days=index % 30),
+                                 revenue=offer.price, units=1,
+                                 orders_count=1)
+                for index, offer in enumerate(offers)
+            ])
+
+        add_rollups(SMALL)
+        small = self.capture(lambda: client.get('/api/v1/partner/stats'))
+        add_rollups(LARGE - SMALL)
+        large = self.capture(lambda: client.get('/api/v1/partner/stats'))
+        self.assertQueryBudget(small, large, 3)
+
+    def test_state(self):
+        client = self.client_for(self.owner)
+        small = self.capture(lambda: client.get('/api/v1/partner/state'))
+        self.add_offers(LARGE)
+        large = self.capture(lambda: client.get('/api/v1/partner/state'))
+        self.assertQueryBudget(small, large, 1)
+
+        # Смена статуса пересчитывает сводки предложений продуктов магазина
+        owner = User.objects.create_user('small@example.com', 'password',
+                                         type='shop', is_active=True)
+        Shop.objects.create(name='Маленький', user=owner)
+        small = self.capture(lambda: self.client_for(owner).post(
+            '/api/v1/partner/state', {'state': 'false'}))
+        large = self.capture(lambda: client.post('/api/v1/partner/state',
+                                                 {'state': 'false'}))
+        self.assertQueryBudget(small, large, 12)
+        self.assertNoFullScans(large)
+        self.assertFalse(ProductOffers.objects.exists())
+        client.post('/api/v1/partner/state', {'state': 'true'})
+        self.assertEqual(ProductOffers.objects.count(), LARGE)
+
+    def test_webhook(self):
+        client = self.client_for(self.owner)
+        queries = self.capture(lambda: client.post(
+            '/api/v1/partner/webhook', {'url': 'https://partner.example/'}))
+        self.assertLessEqual(len(queries), 2)
+        queries = self.capture(lambda: client.get('/api/v1/partner/webhook'))
+        self.assertLessEqual(len(queries), 1)
+
+    def test_update(self):
+        client = self.client_for(self.owner)
+
+        def price_list(count):
+            return json.dumps({
+                'shop': self.shop.name,
+                'categories': [{'id': 1, 'name': 'Категория'}],
+                'goods': [
+                    {'id': index, 'category': 1, 'model': f'M-{index}',
+                     'name': f'Товар {index}', 'price': 100,
+                     'price_rrc': 120, 'quantity': 5,
+                     'parameters': {'Цвет': 'черный', 'Вес': index}}
+                    for index in range(count)
+                ],
+            }).encode()
+
+        def update(count):
+            response = mock.Mock(content=price_list(count))
+            with mock.patch('requests.get', return_value=response):
+                return client.post('/api/v1/partner/update',
+                                   {'url': 'https://partner.example/p.yaml'})
+
+        small = self.capture(lambda: update(SMALL))
+        large = self.capture(lambda: update(LARGE))
+        self.assertQueryBudget(small, large, 26)
+        self.assertEqual(ProductInfo.objects.filter(shop=self.shop).count(),
+                         LARGE)
+        self.assertEqual(ProductOffers.objects.count(), LARGE)
+        self.assertEqual(
+            ProductInfo.objects.get(shop=self.shop, external_id=7).parameters,
+            {'Цвет': 'черный', 'Вес': '7'})
+
+    def test_stock(self):
+        client = self.client_for(self.owner)
+        self.add_offers(SMALL + LARGE)
+
+        def patch(offers, price):
+            return client.patch('/api/v1/partner/stock', json.dumps([
+                {'external_id': offer.external_id, 'price': price,
+                 'quantity': index}
+                for index, offer in enumerate(offers)
+            ]), content_type='application/json')
+
+        small = self.capture(lambda: patch(self.offers[:SMALL], 50))
+        large = self.capture(lambda: patch(self.offers[SMALL:], 60))
+        self.assertQueryBudget(small, large, 16)
+        self.assertNoFullScans(large)
+        self.assertEqual(ProductInfo.objects.filter(price=60).count(), LARGE)
+        self.assertEqual(ProductInfo.objects.get(
+            id=self.offers[SMALL + 5].id).quantity, 5)
+
+        # NDJSON: поля без значения не меняются, неизвестные ИД в ответе
+        offer = self.offers[0]
+        response = client.patch(
+            '/api/v1/partner/stock',
+            f'{{"external_id": {offer.external_id}, "price_rrc": 70}}\n\n'
+            '{"external_id": 999999, "quantity": 1}\n',
+            content_type='application/x-ndjson')
+        self.assertEqual(response.json()['Не найдено'], [999999])
+        offer.refresh_from_db()
+        self.assertEqual((offer.price, offer.price_rrc, offer.quantity),
+                         (50, 70, 0))
+
+        # Неверный элемент отменяет все изменения
+        response = client.patch('/api/v1/partner/stock', json.dumps([
+            {'external_id': offer.external_id, 'price': 1},
+            {'external_id': offer.external_id, 'quantity': -1},
+        ]), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        offer.refresh_from_db()
+        self.assertEqual(offer.price, 50)
+
+        # Значения вне диапазона PositiveIntegerField - ошибка проверки
+        for item in ({'quantity': 2 ** 63}, {'price': 2 ** 31},
+                     {'external_id': 2 ** 64, 'quantity': 1}):
+            response = client.patch('/api/v1/partner/stock', json.dumps([
+                {'external_id': offer.external_id, **item}
+            ]), content_type='application/json')
+            self.assertEqual(response.status_code, 400, item)
+        response = client.patch('/api/v1/partner/stock', json.dumps([
+            {'external_id': offer.external_id, 'quantity': 2 ** 31 - 1}
+        ]), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_sync_parameters(self):
+        offers = self.add_offers(SMALL)
+        ProductInfo.objects.update(parameters={})
+        ProductParameter.objects.filter(
+            product_info=offers[0], parameter=self.parameters[0]).update(
+            value='новое')
+
+        call_command('sync_product_parameters', batch_size=3,
+                     stdout=io.StringIO())
+        parameters = dict(ProductInfo.objects.values_list('id',
+                                                          'parameters'))
+        self.assertEqual(parameters[offers[0].id], {
+            'Параметр 0': 'новое', 'Параметр 1': '0', 'Параметр 2': '0'})
+        self.assertEqual(parameters[offers[-1].id], {
+            parameter.name: str(SMALL - 1) for parameter in self.parameters})
+
+
+class StockEventsTests(QueryBudgetTestCase):
+
+    async def open_stream(self, query):
+        # Подключение к ASGI приложению потока событий без сервера
+        received, sent = asyncio.Queue(), asyncio.Queue()
+        task = asyncio.ensure_future(stock_events_app(
+            {'type': 'http', 'method': 'GET', 'path': '/api/v1/events/stock',
+             'query_string': query.encode()}, received.get, sent.put))
+        start = await asyncio.wait_for(sent.get(), 1)
+        return task, received, sent, start
+
+    async def read_event(self, sent):
+        while True:
+            message = await asyncio.wait_for(sent.get(), 1)
+            body = message.get('body', b'').decode()
+            if body.startswith('event:'):
+                return body
+
+    def patch_stock(self, items):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client_for(self.owner).patch(
+                '/api/v1/partner/stock', json.dumps(items),
+                content_type='application/json')
+
+    def set_state(self, state):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client_for(self.owner).post('/api/v1/partner/state',
+                                                    {'state': state})
+
+    async def test_stream(self):
+        offers = await sync_to_async(self.add_offers)(2)
+        task, received, sent, start = await self.open_stream(
+            f'shop_id={self.shop.id}&category_id={self.category.id}')
+        self.assertEqual(start['status'], 200)
+
+        await sync_to_async(self.patch_stock)(
+            [{'external_id': offers[1].external_id, 'quantity': 3}])
+        body = await self.read_event(sent)
+        self.assertTrue(body.startswith('event: stock\n'))
+        event = json.loads(body.split('data: ', 1)[1])
+        self.assertEqual((event['id'], event['quantity'], event['price']),
+                         (offers[1].id, 3, offers[1].price))
+
+        await sync_to_async(self.set_state)('false')
+        body = await self.read_event(sent)
+        self.assertIn('"shop_id": %d, "state": false' % self.shop.id, body)
+
+        # Отключение клиента снимает подписку
+        await received.put({'type': 'http.disconnect'})
+        await asyncio.wait_for(task, 1)
+        self.assertFalse(broker.has_subscribers)
+
+    def test_import_removed(self):
+        # Товары, которых нет в новом прайс-листе, уходят в поток с
+        # нулевым остатком
+        offers = self.add_offers(3)
+        price_list = {
+            'shop': self.shop.name,
+            'categories': [{'id': self.category.id,
+                            'name': self.category.name}],
+            'goods': [{'id': 0, 'category': self.category.id,
+                       'model': 'M-0', 'name': 'Товар 0', 'price': 100,
+                       'price_rrc': 200, 'quantity': 100}],
+        }
+        with mock.patch('shop.services.publish_stock_removed') as publish, \
+                self.captureOnCommitCallbacks(execute=True):
+            import_price_list(self.shop, price_list)
+        (removed,), _ = publish.call_args
+        self.assertEqual(removed, [
+            {'id': offer.id, 'shop_id': self.shop.id, 'price': offer.price,
+             'price_rrc': offer.price_rrc, 'quantity': offer.quantity,
+             'category_id': self.category.id}
+            for offer in offers[1:]])
+
+        with mock.patch.object(broker, 'publish') as broker_publish, \
+                mock.patch.object(type(broker), 'has_subscribers', True):
+            publish_stock_removed(removed)
+        (events,), _ = broker_publish.call_args
+        self.assertEqual({(event['type'], event['quantity'])
+                          for event in events}, {('stock', 0)})
+
+    async def test_filters_and_limits(self):
+        other = await sync_to_async(Shop.objects.create)(name='Другой')
+        task, received, sent, _ = await self.open_stream(f'shop_id={other.id}')
+        await sync_to_async(self.set_state)('false')
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(self.read_event(sent), 0.1)
+
+        with self.settings(STOCK_EVENTS={**settings.STOCK_EVENTS,
+                                         'MAX_CONNECTIONS': 1}):
+            _, _, _, start = await self.open_stream('')
+        self.assertEqual(start['status'], 503)
+
+        # Медленный клиент: при переполнении очереди поток закрывается
+        subscription = next(iter(broker._subscriptions))
+        subscription.push([{'type': 'stock', 'shop_id': other.id}]
+                          * (settings.STOCK_EVENTS['QUEUE_SIZE'] + 1))
+        self.assertEqual(await self.read_event(sent),
+                         'event: overflow\ndata: {}\n\n')
+        await asyncio.wait_for(task, 1)
+        self.assertFalse(broker.has_subscribers)
+
+
+class AccountQueryTests(QueryBudgetTestCase):
+
+    def add_users(self, count):
+        User.objects.bulk_create([
+            User(email=f'user{index}@example.com', is_active=True)
+            for index in range(count)
+        ])
+
+    def test_register(self):
+        client = APIClient()
+
+        def register(email):
+            return lambda: client.post('/api/v1/user/register', {
+                'first_name': 'Иван', 'last_name': 'Иванов',
+                'email': email, 'password': 'Str0ng-password!',
+                'company': 'ООО', 'position': 'Менеджер'})
+
+        small = self.capture(register('new1@example.com'))
+        self.add_users(LARGE)
+        large = self.capture(register('new2@example.com'))
+        self.assertQueryBudget(small, large, 11)
+
+    def test_confirm(self):
+        client = APIClient()
+
+        def confirm():
+            user = User.objects.create_user(
+                f'new{User.objects.count()}@example.com', 'password')
+            token = ConfirmEmailToken.objects.get(user=user)
+            return lambda: client.post('/api/v1/user/register/confirm', {
+                'email': user.email, 'token': token.key})
+
+        small = self.capture(confirm())
+        self.add_users(LARGE)
+        large = self.capture(confirm())
+        self.assertQueryBudget(small, large, 5)
+
+    def test_login_logout(self):
+        client = APIClient()
+
+        def login():
+            return client.post('/api/v1/user/login', {
+                'email': self.buyer.email, 'password': 'password'})
+
+        Token.objects.create(user=self.buyer)
+        small = self.capture(login)
+        self.add_users(LARGE)
+        large = self.capture(login)
+        self.assertQueryBudget(small, large, 2)
+
+        queries = self.capture(
+            lambda: self.client_for(self.buyer).post('/api/v1/user/logout'))
+        self.assertLessEqual(len(queries), 3)
+        self.assertFalse(Token.objects.filter(user=self.buyer).exists())
+
+    def test_login_throttled(self):
+        # Лимиты считаются между запросами: превышение дает 429, а смена
+        # X-Forwarded-For не обходит лимит по IP
+        cache.clear()
+        client = APIClient()
+        rate, _ = parse_rate(
+            settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']['login.ip'])
+        for index in range(rate):
+            response = client.post(
+                '/api/v1/user/login',
+                {'email': f'user{index}@example.com', 'password': 'wrong'},
+                HTTP_X_FORWARDED_FOR=f'10.0.0.{index}')
+            self.assertEqual(response.status_code, 200)
+        with self.assertLogs('shop.throttling', 'WARNING'):
+            response = client.post(
+                '/api/v1/user/login',
+                {'email': 'other@example.com', 'password': 'wrong'},
+                HTTP_X_FORWARDED_FOR='10.0.1.1')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+        rate, _ = parse_rate(
+            settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']['login.email'])
+        with self.assertLogs('shop.throttling', 'WARNING') as logs:
+            statuses = [client.post('/api/v1/user/login',
+                                    {'email': self.buyer.email,
+                                     'password': 'wrong'},
+                                    REMOTE_ADDR=f'10.0.2.{index}').status_code
+                        for index in range(rate + 1)]
+        self.assertEqual(statuses, [200] * rate + [429])
+        self.assertIn('login.email', logs.output[0])
+
+    def test_token_revocation(self):
+        # Выход, смена пароля и деактивация закрывают доступ сразу, хотя
+        # токен уже лежит в кэше процесса и в общем кэше
+        def authorized_client():
+            token, _ = Token.objects.get_or_create(user=self.buyer)
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+            self.assertEqual(
+                client.get('/api/v1/user/contact').status_code, 200)
+            self.assertIsNotNone(token_cache.get(token.key))
+            return client
+
+        def revoke(change):
+            client = authorized_client()
+            with self.captureOnCommitCallbacks(execute=True):
+                change(client)
+            self.assertEqual(
+                client.get('/api/v1/user/contact').status_code, 401)
+
+        def deactivate_instance(client):
+            self.buyer.is_active = False
+            self.buyer.save()
+
+        def deactivate_queryset(client):
+            User.objects.filter(id=self.buyer.id).update(is_active=False)
+
+        revoke(lambda client: client.post('/api/v1/user/logout'))
+        revoke(lambda client: client.post('/api/v1/user/details',
+                                          {'password': 'N3w-passw0rd!'}))
+        self.assertFalse(Token.objects.filter(user=self.buyer).exists())
+        for deactivate in (deactivate_instance, deactivate_queryset):
+            revoke(deactivate)
+            User.objects.filter(id=self.buyer.id).update(is_active=True)
+            self.buyer.refresh_from_db()
+
+    def test_details(self):
+        client = self.client_for(self.buyer)
+
+        def update():
+            return client.post('/api/v1/user/details', {'first_name': 'Петр'})
+
+        small = self.capture(update)
+        self.add_users(LARGE)
+        large = self.capture(update)
+        self.assertQueryBudget(small, large, 3)
+
+    def test_contacts(self):
+        client = self.client_for(self.buyer)
+
+        def add_contacts(count):
+            return Contact.objects.bulk_create([
+                Contact(user=self.buyer, city='Москва', street='Тверская',
+                        phone=f'+7{index}')
+                for index in range(count)
+            ])
+
+        def delete(contacts):
+            return lambda: client.delete('/api/v1/user/contact', {
+                'items': ','.join(str(contact.id) for contact in contacts)})
+
+        # Удаление зависит от числа удаляемых контактов (Django удаляет
+        # пачками по 100), но не от числа контактов в базе
+        small_get = self.capture(lambda: client.get('/api/v1/user/contact'))
+        small_delete = self.capture(delete(add_contacts(1)))
+        contacts = add_contacts(LARGE)
+        large_get = self.capture(lambda: client.get('/api/v1/user/contact'))
+        large_delete = self.capture(delete(contacts[:1]))
+        self.assertQueryBudget(small_get, large_get, 1)
+        self.assertNoFullScans(large_get)
+        self.assertQueryBudget(small_delete, large_delete, 3)
+        self.capture(delete(contacts[1:]))
+        self.assertEqual(Contact.objects.filter(user=self.buyer).count(), 1)
+
+        queries = self.capture(lambda: client.post('/api/v1/user/contact', {
+            'city': 'Казань', 'street': 'Баумана', 'phone': '+7901'}))
+        self.assertLessEqual(len(queries), 2)
+        queries = self.capture(lambda: client.put('/api/v1/user/contact', {
+            'id': str(self.contact.id), 'city': 'Тверь'}))
+        self.assertLessEqual(len(queries), 2)
+
+
+class AdminQueryTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser(
+            'admin@example.com', 'password')
+        self.client.force_login(self.admin)
+
+    def changelist(self, model, query=''):
+        url = f'/admin/shop/{model}/{query}'
+        return lambda: self.client.get(url)
+
+    def reset_data(self):
+        self.offers = []
+        ProductInfo.objects.all().delete()
+        Order.objects.all().delete()
+
+    def add_data(self, count):
+        self.add_offers(count)
+        self.add_orders(count)
+
+    def test_changelists(self):
+        for model, budget in (('productinfo', 8), ('productparameter', 9),
+                              ('order', 8), ('orderitem', 8),
+                              ('shoporder', 9), ('product', 9)):
+            with self.subTest(model=model):
+                self.reset_data()
+                self.add_data(SMALL)
+                small = self.capture(self.changelist(model))
+                self.add_data(LARGE)
+                large = self.capture(self.changelist(model))
+                self.assertQueryBudget(small, large, budget)
+                self.assertNoFullScans(large)
+
+    def test_prefix_search(self):
+        self.add_data(LARGE)
+        queries = self.capture(
+            self.changelist('productinfo', '?q=Товар 10'))
+        self.assertNoFullScans(queries)
+        response = self.changelist('productinfo', '?q=Товар 10')()
+        # Товар 10 и Товар 100..109
+        self.assertEqual(response.context['cl'].result_count, 11)
+
+        queries = self.capture(
+            self.changelist('order', '?q=buyer@'))
+        self.assertNoFullScans(queries)
+
+    def run_action(self, model, action, **data):
+        # Действие над всеми строками списка ("выбрать все"): форма
+        # отправляет и отмеченную строку видимой страницы
+        return self.client.post(f'/admin/shop/{model}/', {
+            'action': action, 'select_across': 1, 'index': 0,
+            '_selected_action': [1], **data})
+
+    @staticmethod
+    def updates(queries, table):
+        return [query for query in queries
+                if query['sql'].startswith(f'UPDATE "{table}"')]
+
+    def test_export_csv(self):
+        def export(model):
+            def make_request():
+                response = self.run_action(model, 'export_csv')
+                self.lines = b''.join(response.streaming_content).decode(
+                    'utf-8-sig').splitlines()
+                return response
+            return make_request
+
+        for model, header in (
+                ('productinfo', 'id,external_id,shop,category,product,'
+                                'model,price,price_rrc,quantity'),
+                ('order', 'id,dt,state,email,city,phone,total_sum')):
+            with self.subTest(model=model):
+                self.reset_data()
+                self.add_data(SMALL)
+                small = self.capture(export(model))
+                self.add_data(LARGE)
+                large = self.capture(export(model))
+                self.assertQueryBudget(small, large, 7)
+                self.assertEqual(self.lines[0], header)
+                self.assertEqual(len(self.lines), SMALL + LARGE + 1)
+
+        order = Order.objects.latest('id')
+        self.assertTrue(self.lines[1].startswith(f'{order.id},'))
+        self.assertTrue(self.lines[1].endswith(
+            f',{sum(offer.price for offer in self.offers[:2])}'))
+
+        # Текст из прайса партнера не исполняется как формула
+        ProductInfo.objects.filter(id=self.offers[0].id).update(
+            model='=HYPERLINK("http://example.com")')
+        self.capture(export('productinfo'))
+        self.assertIn(f'{self.offers[0].id},', self.lines[-1])
+        self.assertIn(',"\'=HYPERLINK(""http://example.com"")",',
+                      self.lines[-1])
+
+    def test_product_info_edit_and_delete(self):
+        self.add_offers(3)
+        refresh_product_offers(ProductInfo.objects.values('product_id'))
+        rebuild_category_stats()
+        offer = self.offers[0]
+        url = f'/admin/shop/productinfo/{offer.id}/'
+
+        form = self.client.get(f'{url}change/').context['adminform'].form
+        data = {name: '' if value is None else value
+                for name, value in form.initial.items()
+                if name in form.fields}
+        with mock.patch('shop.signals.publish_stock_changes') as publish, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'{url}change/',
+                                        {**data, 'price': 50})
+        self.assertEqual(response.status_code, 302)
+        publish.assert_called_once_with([offer.id])
+        self.assertEqual(ProductOffers.objects.get(
+            product_id=offer.product_id).min_price, 50)
+
+        with mock.patch('shop.admin.publish_stock_removed') as publish, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'{url}delete/', {'post': 'yes'})
+        (removed,), _ = publish.call_args
+        self.assertEqual([(values['id'], values['price'])
+                          for values in removed], [(offer.id, 50)])
+        self.assertFalse(ProductOffers.objects.filter(
+            product_id=offer.product_id).exists())
+        stats = CategoryShopStats.objects.get(category=self.category,
+                                              shop=None)
+        self.assertEqual(stats.products_count, 2)
+
+        with mock.patch('shop.admin.publish_stock_removed') as publish, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.run_action('productinfo', 'delete_selected', post='yes')
+        self.assertEqual(len(publish.call_args.args[0]), 2)
+        self.assertFalse(ProductOffers.objects.exists())
+        self.assertFalse(CategoryShopStats.objects.filter(
+            category=self.category, products_count__gt=0).exists())
+
+    def test_bulk_price_and_quantity(self):
+        self.add_offers(LARGE)
+
+        queries = self.capture(
+            lambda: self.run_action('productinfo', 'set_price', value=500))
+        self.assertEqual(len(self.updates(queries, 'shop_productinfo')), 1)
+        self.assertFalse(ProductInfo.objects.exclude(price=500).exists())
+
+        self.run_action('productinfo', 'change_price_percent', value=-10)
+        # Изменения уходят в поток событий stock с ИД до UPDATE, даже если
+        # фильтр списка зависит от изменяемого поля
+        with mock.patch('shop.signals.publish_stock_changes') as publish, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/admin/shop/productinfo/?quantity__gt=7', {
+                'action': 'set_quantity', 'select_across': 1, 'index': 0,
+                '_selected_action': [1], 'value': 7})
+        (product_info_ids,), _ = publish.call_args
+        self.assertEqual(sorted(product_info_ids),
+                         [offer.id for offer in self.offers])
+        self.assertEqual(
+            set(ProductInfo.objects.values_list('price', 'quantity')),
+            {(450, 7)})
+
+        self.run_action('productinfo', 'set_quantity', value=-1)
+        self.assertContains(self.client.get('/admin/shop/productinfo/'),
+                            'не меньше 0')
+        self.assertFalse(ProductInfo.objects.exclude(quantity=7).exists())
+
+    def test_bulk_state(self):
+        new_orders = self.add_orders(5)
+        sent_orders = self.add_orders(3, state='sent')
+        for order in new_orders:
+            record_order_sales(order)
+        outbox = EmailOutbox.objects.count()
+
+        queries = self.capture(
+            lambda: self.run_action('order', 'set_state', state='canceled'))
+        self.assertEqual(len(self.updates(queries, 'shop_order')), 1)
+        self.assertEqual(
+            set(Order.objects.filter(id__in=[order.id for order in new_orders])
+                .values_list('state', flat=True)), {'canceled'})
+        self.assertEqual(
+            set(Order.objects.filter(id__in=[order.id
+                                             for order in sent_orders])
+                .values_list('state', flat=True)), {'sent'})
+        self.assertEqual(EmailOutbox.objects.count(), outbox + 5)
+        self.assertFalse(SalesDailyRollup.objects.exclude(units=0).exists())
+
+
+class DeliveryTests(QueryBudgetTestCase):
+    """
+    Доставка писем и уведомлений через локальные серверы-заглушки
+    """
+
+    def smtp_server(self, rejected=()):
+        server = StandInServer(SMTPHandler)
+        server.messages, server.sessions = [], 0
+        server.rejected = set(rejected)
+        self.addCleanup(server.stop)
+        self.enterContext(override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1', EMAIL_PORT=server.port,
+            EMAIL_USE_TLS=False, EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='',
+            DEFAULT_FROM_EMAIL='shop@example.com'))
+        return server
+
+    def send_outbox(self):
+        call_command('send_outbox_emails', '--max-attempts', '2',
+                     '--backoff', '60', stdout=io.StringIO())
+
+    def test_outbox(self):
+        server = self.smtp_server(rejected={'bounce@example.com'})
+        EmailOutbox.objects.all().delete()
+        for address in ('first@example.com', 'second@example.com',
+                        'bounce@example.com'):
+            EmailOutbox.objects.enqueue(subject='Заказ', body='Текст',
+                                        to=[address])
+
+        # Письма уходят через одно соединение, отказ сервера откладывает
+        # письмо с задержкой backoff
+        started = timezone.now()
+        self.send_outbox()
+        self.assertEqual(server.sessions, 1)
+        self.assertEqual(sorted(recipients for recipients, _ in
+                                server.messages),
+                         [['first@example.com'], ['second@example.com']])
+        self.assertEqual(EmailOutbox.objects.filter(status='sent').count(), 2)
+        bounced = EmailOutbox.objects.get(to=['bounce@example.com'])
+        self.assertEqual((bounced.status, bounced.attempts), ('pending', 1))
+        self.assertIn('550', bounced.last_error)
+        self.assertGreaterEqual(bounced.next_attempt_at,
+                                started + timedelta(seconds=60))
+
+        # До окончания задержки письмо не повторяется, после последней
+        # попытки получает статус failed
+        self.send_outbox()
+        self.assertEqual(EmailOutbox.objects.get(id=bounced.id).attempts, 1)
+        EmailOutbox.objects.filter(id=bounced.id).update(
+            next_attempt_at=timezone.now())
+        self.send_outbox()
+        bounced.refresh_from_db()
+        self.assertEqual((bounced.status, bounced.attempts), ('failed', 2))
+        self.assertEqual(len(server.messages), 2)
+
+    def test_outbox_claim(self):
+        # Письма, забранные другим обработчиком, не отправляются повторно
+        server = self.smtp_server()
+        EmailOutbox.objects.all().delete()
+        for index in range(3):
+            EmailOutbox.objects.enqueue(subject='Заказ', body='Текст',
+                                        to=[f'user{index}@example.com'])
+        claimed = claim_outbox_batch(2, lease=300)
+        self.assertEqual(len(claimed), 2)
+        self.assertEqual(len(claim_outbox_batch(10, lease=300)), 1)
+        self.assertEqual(claim_outbox_batch(10, lease=300), [])
+
+        EmailOutbox.objects.filter(id__in=[outbox.id for outbox in claimed]) \
+            .update(next_attempt_at=timezone.now())
+        self.send_outbox()
+        self.assertEqual(len(server.messages), 2)
+        self.assertEqual(EmailOutbox.objects.filter(status='sent').count(), 2)
+
+    def test_webhooks(self):
+        server = StandInServer(WebhookHandler)
+        server.requests, server.statuses = [], []
+        self.addCleanup(server.stop)
+        # Адрес из админки без ключа: ключ создается при сохранении
+        self.shop.webhook_url = f'http://127.0.0.1:{server.port}/hook'
+        self.shop.save()
+        self.assertEqual(len(self.shop.webhook_secret), 64)
+        events = WebhookEvent.objects.bulk_create([
+            WebhookEvent(shop=self.shop, event='order.created',
+                         payload={'order_id': index})
+            for index in range(3)
+        ])
+
+        def dispatch(**options):
+            return async_to_sync(dispatch_pending)(
+                per_shop=2, max_attempts=2, backoff=30, **options)
+
+        # События магазина уходят пачкой в одном подписанном POST
+        self.assertEqual(dispatch(), (2, 0))
+        headers, body = server.requests[0]
+        expected = hmac.new(
+            self.shop.webhook_secret.encode(),
+            headers[TIMESTAMP_HEADER].encode() + b'.' + body,
+            hashlib.sha256).hexdigest()
+        self.assertEqual(headers[SIGNATURE_HEADER], expected)
+        self.assertEqual([event['id'] for event in json.loads(body)['events']],
+                         [event.id for event in events[:2]])
+
+        # Ошибка магазина откладывает событие с задержкой backoff, после
+        # последней попытки оно получает статус failed
+        server.statuses = [500, 500]
+        started = timezone.now()
+        self.assertEqual(dispatch(), (0, 1))
+        failed = WebhookEvent.objects.get(id=events[2].id)
+        self.assertEqual((failed.status, failed.attempts, failed.last_error),
+                         ('pending', 1, 'HTTP 500'))
+        self.assertGreaterEqual(failed.next_attempt_at,
+                                started + timedelta(seconds=30))
+        self.assertEqual(dispatch(), (0, 0))
+        WebhookEvent.objects.filter(id=failed.id).update(
+            next_attempt_at=timezone.now())
+        self.assertEqual(dispatch(), (0, 1))
+        failed.refresh_from_db()
+        self.assertEqual((failed.status, failed.attempts), ('failed', 2))
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual(set(WebhookEvent.objects.filter(
+            id__in=[event.id for event in events[:2]]).values_list(
+            'status', flat=True)), {'delivered'})
+
+        # Без ключа события не отправляются с пустой подписью
+        Shop.objects.filter(id=self.shop.id).update(webhook_secret='')
+        WebhookEvent.objects.create(shop=self.shop, event='order.created')
+        self.assertEqual(dispatch(), (0, 0))
+        self.assertEqual(len(server.requests), 3)
+
+    def test_webhooks_claim(self):
+        # События, забранные другим запуском, не отправляются повторно
+        server = StandInServer(WebhookHandler)
+        server.requests, server.statuses = [], []
+        self.addCleanup(server.stop)
+        self.shop.webhook_url = f'http://127.0.0.1:{server.port}/hook'
+        self.shop.save()
+        WebhookEvent.objects.bulk_create([
+            WebhookEvent(shop=self.shop, event='order.created',
+                         payload={'order_id': index})
+            for index in range(3)
+        ])
+        (shop, claimed), = claim_pending_events(10, 2, lease=300)
+        self.assertEqual((shop, len(claimed)), (self.shop, 2))
+        (_, rest), = claim_pending_events(10, 2, lease=300)
+        self.assertEqual(len(rest), 1)
+        self.assertEqual(claim_pending_events(10, 2, lease=300), [])
+        self.assertEqual(async_to_sync(dispatch_pending)(), (0, 0))
+        self.assertEqual(server.requests, [])
+
+        # После окончания аренды события возвращаются в очередь
+        WebhookEvent.objects.filter(id__in=[event.id for event in claimed]) \
+            .update(next_attempt_at=timezone.now())
+        self.assertEqual(async_to_sync(dispatch_pending)(), (2, 0))
+        self.assertEqual(len(server.requests), 1)
+        self.assertEqual(WebhookEvent.objects.filter(
+            status='delivered').count(), 2)
+
+
+class PriceRefreshTests(QueryBudgetTestCase):
+    """
+    Плановое обновление прайс-листов с подмененным requests.get
+    """
+    interval, jitter = 3600, 60
+
+    def setUp(self):
+        super().setUp()
+        self.shop.url = 'https://shop.example/price.yaml'
+        self.shop.save()
+        with open(settings.BASE_DIR / 'data' / 'shop1.yaml', 'rb') as file:
+            self.price_list = file.read()
+
+    def refresh(self, concurrency=2):
+        return async_to_sync(refresh_due_shops)(
+            self.interval, self.jitter, concurrency, timeout=5)
+
+    def make_due(self):
+        PriceListRefresh.objects.update(next_run_at=timezone.now())
+
+    def assertScheduled(self, refresh, started):
+        # Следующий запуск через интервал со случайным сдвигом
+        self.assertGreaterEqual(
+            refresh.next_run_at,
+            started + timedelta(seconds=self.interval - self.jitter))
+        self.assertLessEqual(
+            refresh.next_run_at,
+            timezone.now() + timedelta(seconds=self.interval + self.jitter))
+
+    def test_new_shops_jitter(self):
+        # Новые магазины получают первый запуск в пределах jitter, а не все
+        # в одну секунду, и до него не загружаются
+        for index in range(20):
+            Shop.objects.create(name=f'Магазин {index}',
+                                url=f'https://shop{index}.example/')
+        started = timezone.now()
+        with mock.patch('requests.get') as get:
+            self.assertEqual(self.refresh(), [])
+        get.assert_not_called()
+        runs = list(PriceListRefresh.objects.values_list('next_run_at',
+                                                         flat=True))
+        self.assertEqual(len(runs), 21)
+        self.assertTrue(all(
+            started <= run <= started + timedelta(seconds=self.jitter + 1)
+            for run in runs))
+        self.assertGreater(len(set(runs)), 1)
+
+    def test_conditional_refresh(self):
+        PriceListRefresh.objects.create(shop=self.shop,
+                                        next_run_at=timezone.now())
+        ok = mock.Mock(status_code=200, content=self.price_list, headers={
+            'ETag': '"v1"', 'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT'})
+        started = timezone.now()
+        with mock.patch('requests.get', return_value=ok) as get:
+            refresh, = self.refresh()
+        self.assertEqual(get.call_args.kwargs['headers'], {})
+        refresh = PriceListRefresh.objects.get(shop=self.shop)
+        self.assertEqual((refresh.outcome, refresh.etag, refresh.error),
+                         ('ok', '"v1"', ''))
+        self.assertIsNotNone(refresh.duration)
+        self.assertScheduled(refresh, started)
+        self.assertEqual(
+            ProductInfo.objects.filter(shop=self.shop).count(),
+            len(load_price_list(self.price_list)['goods']))
+
+        # Повторная загрузка условная: 304 не запускает импорт
+        self.make_due()
+        not_modified = mock.Mock(status_code=304, content=b'', headers={})
+        with mock.patch('requests.get', return_value=not_modified) as get, \
+                mock.patch('shop.price_refresh._import') as run_import:
+            self.refresh()
+        self.assertEqual(get.call_args.kwargs['headers'], {
+            'If-None-Match': '"v1"',
+            'If-Modified-Since': 'Mon, 01 Jan 2024 00:00:00 GMT'})
+        run_import.assert_not_called()
+        refresh.refresh_from_db()
+        self.assertEqual((refresh.outcome, refresh.etag),
+                         ('not_modified', '"v1"'))
+
+        # Ошибка записывается, а магазин обновится по расписанию
+        self.make_due()
+        started = timezone.now()
+        with mock.patch('requests.get',
+                        side_effect=requests.ConnectionError('нет связи')):
+            self.refresh()
+        refresh.refresh_from_db()
+        self.assertEqual((refresh.outcome, refresh.error),
+                         ('error', 'нет связи'))
+        self.assertEqual(refresh.etag, '"v1"')
+        self.assertScheduled(refresh, started)
+
+    def test_concurrency_limit(self):
+        # Одновременно загружается не больше concurrency прайс-листов
+        shops = [Shop.objects.create(name=f'Магазин {index}',
+                                     url=f'https://shop{index}.example/')
+                 for index in range(6)]
+        PriceListRefresh.objects.bulk_create([
+            PriceListRefresh(shop=shop, next_run_at=timezone.now())
+            for shop in shops + [self.shop]
+        ])
+        lock = threading.Lock()
+        active, peak = 0, 0
+
+        def get(url, **kwargs):
+            nonlocal active, peak
+            with lock:
+                active += 1
+                peak = max(peak, active)
+            time.sleep(0.05)
+            with lock:
+                active -= 1
+            return mock.Mock(status_code=304, content=b'', headers={})
+
+        with mock.patch('requests.get', side_effect=get):
+            refreshes = self.refresh(concurrency=3)
+        self.assertEqual(len(refreshes), 7)
+        self.assertEqual(peak, 3)
+        self.assertEqual(set(PriceListRefresh.objects.values_list(
+            'outcome', flat=True)), {'not_modified'})
+
+
+class AsyncCatalogTests(QueryBudgetTestCase):
+    """
+    Асинхронные представления каталога отвечают так же, как синхронные
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.add_offers(5)
+        self.token = Token.objects.create(user=self.buyer)
+
+    async def get_both(self, path, **headers):
+        # Ответы синхронной и асинхронной версий одного адреса
+        sync_response = await sync_to_async(self.client.get)(
+            f'/api/v1/{path}', headers=headers)
+        async_response = await self.async_client.get(
+            f'/api/v1/async/{path}', headers=headers)
+        self.assertEqual(sync_response.status_code,
+                         async_response.status_code, path)
+        self.assertEqual(sync_response.json(), async_response.json(), path)
+        return async_response
+
+    async def test_catalog(self):
+        for path in ('categories', 'shops',
+                     f'products?shop_id={self.shop.id}'
+                     f'&category_id={self.category.id}',
+                     'products?limit=2&offset=1&sort=-price'):
+            response = await self.get_both(path)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.json(), path)
+
+        response = await self.get_both('products?price_min=дешево')
+        self.assertEqual(response.status_code, 400)
+
+    async def test_product_detail(self):
+        path = f'products/{self.offers[0].id}/'
+        authorization = {'Authorization': f'Token {self.token.key}'}
+
+        response = await self.get_both(path)
+        self.assertEqual(response.status_code, 403)
+        response = await self.get_both(path, **authorization)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], self.offers[0].id)
+        response = await self.get_both('products/0/', **authorization)
+        self.assertEqual(response.status_code, 404)
+
+        await Shop.objects.filter(id=self.shop.id).aupdate(state=False)
+        response = await self.get_both(path, **authorization)
+        self.assertEqual(response.status_code, 404)
+
+
+
+class ReplicaRouterTests(QueryBudgetTestCase):
+    """
+    Чтение с реплик только в запросах и без записей клиента
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.router = db_router.ReplicaRouter()
+        self.middleware = db_router.ReplicaStickinessMiddleware(self.view)
+        self.factory = RequestFactory()
+        self.write = False
+        self.routes = []
+        # Тест идет внутри транзакции, реплики и транзакция подменяются
+        self.atomic = mock.Mock(in_atomic_block=False)
+        for target in (
+                mock.patch.object(db_router, 'replica_aliases',
+                                  return_value=['replica']),
+                mock.patch.object(db_router, 'connections',
+                                  {'default': self.atomic})):
+            target.start()
+            self.addCleanup(target.stop)
+
+    def view(self, request):
+        self.routes.append((self.router.db_for_read(ProductInfo),
+                            self.router.db_for_read(User)))
+        if self.write:
+            self.router.db_for_write(Order)
+            self.routes.append((self.router.db_for_read(ProductInfo),
+                                self.router.db_for_read(User)))
+        return HttpResponse()
+
+    def request(self, method='get', **headers):
+        self.routes = []
+        self.middleware(getattr(self.factory, method)('/', headers=headers))
+        return self.routes
+
+    def test_outside_request(self):
+        # Команды и планировщик читают основную базу
+        self.assertEqual(self.router.db_for_read(ProductInfo), 'default')
+        self.request()
+        self.assertEqual(self.router.db_for_read(ProductInfo), 'default')
+
+    def test_request(self):
+        self.assertEqual(self.request(), [('replica', 'default')])
+        self.assertEqual(self.request('post'), [('default', 'default')])
+        self.atomic.in_atomic_block = True
+        self.assertEqual(self.request(), [('default', 'default')])
+
+    def test_sticky_after_write(self):
+        client = {'Authorization': 'Token client'}
+        other = {'Authorization': 'Token other'}
+        self.write = True
+        self.assertEqual(self.request(**client),
+                         [('replica', 'default'), ('default', 'default')])
+        self.write = False
+        self.assertEqual(self.request(**client), [('default', 'default')])
+        self.assertEqual(self.request(**other), [('replica', 'default')])
+
+        cache.clear()
+        self.assertEqual(self.request(**client), [('replica', 'default')])
+
+
+class MetricsTests(QueryBudgetTestCase):
+    """
+    Метрики запросов и доступ к /metrics
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.add_offers(3)
+        registry.clear()
+        self.addCleanup(registry.clear)
+
+    def test_access(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        with self.settings(METRICS_ALLOWED_IPS=['127.0.0.1']):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+        with self.settings(METRICS_TOKEN='secret',
+                           METRICS_ALLOWED_IPS=['127.0.0.1']):
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            response = self.client.get(
+                '/metrics', headers={'Authorization': 'Bearer secret'})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response['Content-Type'].startswith(
+                'text/plain'))
+
+    def test_execute_wrapper(self):
+        stats = RequestStats()
+        with connection.execute_wrapper(stats):
+            list(Shop.objects.all())
+            ProductInfo.objects.count()
+        self.assertEqual(stats.sql_count, 2)
+        self.assertEqual(len(stats.queries), 2)
+        self.assertIn('shop_productinfo', stats.queries[1][1])
+        self.assertGreater(stats.sql_time, 0)
+
+    def test_request_metrics(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/products')
+        self.client.get('/api/v1/products?price_min=дешево')
+        self.assertEqual(response.status_code, 200)
+
+        metrics = registry.snapshot()['shop:products']
+        self.assertEqual(metrics['count'], 2)
+        self.assertEqual(metrics['statuses'], {200: 1, 400: 1})
+        self.assertGreaterEqual(metrics['sql_count'], len(queries))
+        self.assertGreater(metrics['serializer_time'], 0)
+        self.assertGreater(metrics['response_bytes'], len(response.content))
+        self.assertEqual(sum(metrics['buckets']), 2)
+
+        with self.settings(METRICS_SLOW_REQUEST_SECONDS=0), \
+                self.assertLogs('shop.metrics', 'WARNING') as logs:
+            self.client.get('/api/v1/categories')
+        self.assertIn('shop:categories', logs.output[0])
+        self.assertIn('shop_category', logs.output[0])
+
+    def test_prometheus_format(self):
+        self.client.get('/api/v1/products')
+        self.client.get('/api/v1/products')
+        text = render_metrics()
+
+        sample = re.compile(r'^[a-z_]+(\{[a-z_]+="[^"]*"(,[a-z_]+="[^"]*")*'
+                            r'\})? [0-9.]+$')
+        for line in text.splitlines():
+            if not line.startswith('# TYPE '):
+                self.assertRegex(line, sample)
+        self.assertIn('http_request_duration_seconds_bucket'
+                      '{route="shop:products",le="+Inf"} 2', text)
+        self.assertIn('http_request_duration_seconds_count'
+                      '{route="shop:products"} 2', text)
+        self.assertIn('http_requests_total'
+                      '{route="shop:products",status="200"} 2', text)
+        buckets = [int(value) for value in re.findall(
+            r'_bucket\{route="shop:products",le="[^"]+"\} (\d+)', text)]
+        self.assertEqual(buckets, sorted(buckets))
@@ -0,0 +1,156 @@
+# throttling.py
+import hashlib
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.core.cache import cache
+from rest_framework.authentication import get_authorization_header
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+logger = logging.getLogger(__name__)
+
+_rejects = Counter()
+_rejects_lock = threading.Lock()
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def throttle_stats():
+    """
+    Число отклоненных запросов по ключам вида "scope.kind"
+    """
+    with _rejects_lock:
+        return dict(_rejects)
+
+
+def parse_rate(rate):
+    """
+    Разбор лимита вида "10/min" в пару (число запросов, окно в секундах)
+    """
+    num_requests, period = rate.split('/')
+    return int(num_requests), PERIODS[period[0]]
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """
+    Ограничение частоты запросов скользящим окном в общем кэше
+
+    Счетчики ведутся по фиксированным окнам, а текущая нагрузка
+    оценивается как счетчик текущего окна плюс доля предыдущего,
+    пропорциональная еще не истекшей его части. Лимит берется из
+    DEFAULT_THROTTLE_RATES по ключу "<throttle_scope представления>.<kind>";
+    если ключа нет, ограничение не применяется. Проверка выполняется до
+    вызова обработчика, то есть до хеширования паролей и запросов к базе.
+    """
+    kind = None
+
+    def get_ident_key(self, request):
+        raise NotImplementedError
+
+    def get_rate(self, view):
+        scope = getattr(view, 'throttle_scope', None)
+        if not scope:
+            return None, None
+        key = f'{scope}.{self.kind}'
+        return key, api_settings.DEFAULT_THROTTLE_RATES.get(key)
+
+    def allow_request(self, request, view):
+        key, rate = self.get_rate(view)
+        if rate is None:
+            return True
+        if getattr(view, 'throttle_unsafe_only', False) \
+                and request.method in SAFE_METHODS:
+            return True
+
+        ident = self.get_ident_key(request)
+        if not ident:
+            return True
+
+        num_requests, window = parse_rate(rate)
+        now = time.time()
+        current_window = int(now // window)
+        cache_key = f'throttle:{key}:{ident}'
+        current_key = f'{cache_key}:{current_window}'
+
+        previous_count, current_count = self._get_counts(cache_key,
+                                                         current_window)
+
+        elapsed = now / window - current_window
+        estimated = previous_count * (1 - elapsed) + current_count
+        if estimated >= num_requests:
+            self._wait = window * (1 - elapsed)
+            with _rejects_lock:
+                _rejects[key] += 1
+            logger.warning('Запрос отклонен ограничением %s для %s',
+                           key, request.path)
+            return False
+
+        cache.add(current_key, 0, timeout=window * 2)
+        try:
+            cache.incr(current_key)
+        except ValueError:
+            cache.set(current_key, 1, timeout=window * 2)
+        return True
+
+    @staticmethod
+    def _get_counts(cache_key, current_window):
+        previous_key = f'{cache_key}:{current_window - 1}'
+        current_key = f'{cache_key}:{current_window}'
+        counts = cache.get_many([previous_key, current_key])
+        return counts.get(previous_key, 0), counts.get(current_key, 0)
+
+    def wait(self):
+        return getattr(self, '_wait', None)
+
+
+class IPRateThrottle(SlidingWindowThrottle):
+    """
+    Ограничение по IP адресу клиента
+
+    Адрес берется из REMOTE_ADDR, X-Forwarded-For учитывается только за
+    доверенными прокси (REST_FRAMEWORK['NUM_PROXIES']).
+    """
+    kind = 'ip'
+
+    def get_ident_key(self, request):
+        return self.get_ident(request)
+
+
+class EmailRateThrottle(SlidingWindowThrottle):
+    """
+    Ограничение по email из тела запроса
+    """
+    kind = 'email'
+
+    def get_ident_key(self, request):
+        email = request.data.get('email')
+        if not isinstance(email, str):
+            return None
+        return hashlib.sha256(email.strip().lower().encode()).hexdigest()
+
+
+class TokenRateThrottle(SlidingWindowThrottle):
+    """
+    Ограничение по токену из заголовка Authorization
+    """
+    kind = 'token'
+
+    def get_ident_key(self, request):
+        auth = get_authorization_header(request).split()
+        if len(auth) != 2:
+            return None
+        return hashlib.sha256(auth[1]).hexdigest()
+
+
+class GlobalRateThrottle(SlidingWindowThrottle):
+    """
+    Общий лимит представления для сброса нагрузки при всплесках
+    """
+    kind = 'global'
+
+    def get_ident_key(self, request):
+        return 'all'
@@ -1,41 +1,72 @@
 # backend/urls.py
 from django.urls import path, include
-from django_rest_passwordreset.views import reset_password_request_token, \
-    reset_password_confirm
+from django_rest_passwordreset.views import ResetPasswordRequestToken, \
+    ResetPasswordConfirm
+
+from . import async_views
+from .throttling import IPRateThrottle
 
 from .views import (
-    PartnerUpdate, RegisterAccount, LoginAccount, CategoryView,
-    ShopView, ProductInfoView, ProductDetailView,
+    PartnerUpdate, RegisterAccount, LoginAccount, LogoutAccount,
+    CategoryView, ShopView, ProductInfoView, ProductDetailView,
+    ProductOffersView, ProductSuggestView,
     BasketView, AccountDetails, ContactView, OrderView,
-    PartnerState, PartnerOrders, ConfirmAccount
+    PartnerState, PartnerOrders, PartnerOrderState, PartnerStats,
+    PartnerWebhook, PartnerStock,
+    ConfirmAccount
 )
 
 app_name = 'shop'
 
 api_patterns = [
     path('partner/update', PartnerUpdate.as_view(), name='partner-update'),
+    path('partner/stock', PartnerStock.as_view(), name='partner-stock'),
     path('partner/state', PartnerState.as_view(), name='partner-state'),
     path('partner/orders', PartnerOrders.as_view(), name='partner-orders'),
+    path('partner/orders/state', PartnerOrderState.as_view(),
+         name='partner-orders-state'),
+    path('partner/stats', PartnerStats.as_view(), name='partner-stats'),
+    path('partner/webhook', PartnerWebhook.as_view(),
+         name='partner-webhook'),
     path('user/register', RegisterAccount.as_view(), name='user-register'),
     path('user/register/confirm', ConfirmAccount.as_view(),
          name='user-register-confirm'),
     path('user/details', AccountDetails.as_view(), name='user-details'),
     path('user/contact', ContactView.as_view(), name='user-contact'),
     path('user/login', LoginAccount.as_view(), name='user-login'),
-    path('user/password_reset', reset_password_request_token,
+    path('user/logout', LogoutAccount.as_view(), name='user-logout'),
+    path('user/password_reset',
+         ResetPasswordRequestToken.as_view(throttle_scope='password_reset'),
          name='password-reset'),
-    path('user/password_reset/confirm', reset_password_confirm,
+    path('user/password_reset/confirm',
+         ResetPasswordConfirm.as_view(
+             throttle_classes=(IPRateThrottle,),
+             throttle_scope='password_reset_confirm'),
          name='password-reset-confirm'),
     path('categories', CategoryView.as_view(), name='categories'),
     path('shops', ShopView.as_view(), name='shops'),
     # Конкретный товар ДОЛЖЕН быть выше общего списка товаров
     path('products/<int:pk>/', ProductDetailView.as_view(),
          name='product-detail'),
+    path('products/suggest', ProductSuggestView.as_view(),
+         name='product-suggest'),
+    path('products/<int:product_id>/offers', ProductOffersView.as_view(),
+         name='product-offers'),
     path('products', ProductInfoView.as_view(), name='products'),
     path('basket', BasketView.as_view(), name='basket'),
     path('order', OrderView.as_view(), name='order'),
 ]
 
+# Асинхронные версии каталога для запуска под ASGI (Diplom/asgi.py)
+async_patterns = [
+    path('categories', async_views.category_list, name='async-categories'),
+    path('shops', async_views.shop_list, name='async-shops'),
+    path('products/<int:pk>/', async_views.product_detail,
+         name='async-product-detail'),
+    path('products', async_views.product_list, name='async-products'),
+]
+
 urlpatterns = [
     path('api/v1/', include(api_patterns)),
+    path('api/v1/async/', include(async_patterns)),
 ]
@@ -1,27 +1,108 @@
 # views.py
+import logging
+from datetime import date, timedelta
+
 from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
 from django.core.validators import URLValidator
-from django.db import IntegrityError
-from django.db.models import Q, Sum, F
+from django.db import IntegrityError, transaction
+from django.db.models import Q, Sum, F, Prefetch, Exists, OuterRef
 from django.http import JsonResponse
-from requests import get
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework.authtoken.models import Token
 from rest_framework.generics import ListAPIView
+from rest_framework.parsers import JSONParser
 from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from ujson import loads as load_json
-from yaml import load as load_yaml, Loader
 
-from .models import Shop, Category, Product, ProductInfo, Parameter, \
-    ProductParameter, Order, OrderItem, \
-    Contact, ConfirmEmailToken
-from .serializers import UserSerializer, CategorySerializer, ShopSerializer, \
+from .models import Shop, ProductInfo, Order, OrderItem, \
+    Contact, ConfirmEmailToken, ShopOrder, ArchivedOrder, SalesDailyRollup, \
+    ParameterValue, ProductParameter, ProductOffers, ArchivedOrderItem, \
+    ArchivedShopOrder
+from .catalog import category_listing
+from .catalog_engine import get_catalog_engine
+from .parsers import NDJSONParser
+from .suggest import get_suggest_index
+from .serializers import UserSerializer, ShopSerializer, \
     ProductInfoSerializer, \
-    OrderItemSerializer, OrderSerializer, ContactSerializer
-from .signals import order_created
+    OrderSerializer, ContactSerializer, \
+    ShopOrderSerializer, ArchivedOrderSerializer, ProductOffersSerializer, \
+    ArchivedShopOrderSerializer
+from .services import split_order_by_shop, get_archive_horizon, \
+    record_order_sales, revert_orders_sales, load_price_list, \
+    import_price_list, update_stock, refresh_product_offers, \
+    rebuild_category_stats, fix_order_prices, numeric_value
+from .signals import order_created, order_state_changed, \
+    shop_state_changed
+from .throttling import IPRateThrottle, EmailRateThrottle, \
+    TokenRateThrottle, GlobalRateThrottle
+
+logger = logging.getLogger(__name__)
+
+
+def ordered_items_prefetch(lookup='ordered_items', queryset=None,
+                           to_attr=None):
+    """
+    Позиции заказов с товарами и категориями
+
+    Товар присоединяется через select_related: prefetch по прямому
+    внешнему ключу строит на SQLite цепочку OR по всем ключам, которая
+    не выполняется уже при тысяче товаров. Параметры читаются из JSON
+    поля товара.
+    """
+    if queryset is None:
+        queryset = OrderItem.objects.all()
+    return Prefetch(lookup, queryset=queryset.select_related(
+        'product_info__product__category'
+    ), to_attr=to_attr)
+
+
+def bracket_params(params, name):
+    """
+    Значения параметров запроса вида name[ключ]=значение
+    """
+    prefix = f'{name}['
+    return {key[len(prefix):-1]: value for key, value in params.items()
+            if key.startswith(prefix) and key.endswith(']')}
+
+
+def page_cursor(params):
+    """
+    Курсор страницы истории заказов: дата и ИД последнего полученного
+    заказа из параметров before и before_id
+
+    Неверные значения - ValueError с текстом ошибки для ответа.
+    """
+    before = params.get('before')
+    if not before:
+        return None, None
+    before_dt = parse_datetime(before)
+    if before_dt is None:
+        raise ValueError('Неверный параметр before')
+    before_id = params.get('before_id')
+    try:
+        return before_dt, None if before_id is None else int(before_id)
+    except ValueError:
+        raise ValueError('Неверный параметр before_id')
+
+
+def older_than(queryset, before_dt, before_id, id_field='order_id'):
+    """
+    Заказы страницы после курсора (дата, ИД заказа) от новых к старым
+
+    Заказы с одной датой различаются по ИД и не теряются на границе
+    страниц; без before_id курсор - только дата.
+    """
+    queryset = queryset.order_by('-dt', f'-{id_field}')
+    if before_dt is None:
+        return queryset
+    if before_id is None:
+        return queryset.filter(dt__lt=before_dt)
+    return queryset.filter(dt__lte=before_dt).exclude(
+        dt=before_dt, **{f'{id_field}__gte': before_id})
 
 
 class BaseAPIView(APIView):
@@ -67,6 +148,8 @@ class RegisterAccount(APIView):
     """
     Контроллер для регистрации новых пользователей
     """
+    throttle_classes = (IPRateThrottle, GlobalRateThrottle)
+    throttle_scope = 'register'
 
     def post(self, request, *args, **kwargs):
         """
@@ -94,9 +177,11 @@ class RegisterAccount(APIView):
         # Проверяем и сохраняем данные пользователя
         user_serializer = UserSerializer(data=request.data)
         if user_serializer.is_valid():
-            user = user_serializer.save()
-            user.set_password(request.data['password'])
-            user.save()
+            # Письмо с подтверждением ставится в очередь в той же транзакции
+            with transaction.atomic():
+                user = user_serializer.save()
+                user.set_password(request.data['password'])
+                user.save()
             return JsonResponse({'Status': True})
         else:
             return JsonResponse(
@@ -107,6 +192,8 @@ class ConfirmAccount(APIView):
     """
     Контроллер для подтверждения email адреса
     """
+    throttle_classes = (IPRateThrottle, EmailRateThrottle)
+    throttle_scope = 'confirm'
 
     def post(self, request, *args, **kwargs):
         """
@@ -136,6 +223,9 @@ class AccountDetails(BaseAPIView):
     """
     Контроллер для управления данными аккаунта пользователя
     """
+    throttle_classes = (TokenRateThrottle,)
+    throttle_scope = 'details'
+    throttle_unsafe_only = True
 
     def post(self, request, *args, **kwargs):
         """
@@ -175,6 +265,9 @@ class LoginAccount(APIView):
     """
     Контроллер для авторизации пользователей
     """
+    throttle_classes = (IPRateThrottle, EmailRateThrottle,
+                        GlobalRateThrottle)
+    throttle_scope = 'login'
 
     def post(self, request, *args, **kwargs):
         """
@@ -194,12 +287,36 @@ class LoginAccount(APIView):
         return JsonResponse({'Status': False, 'Errors': 'Ошибка авторизации'})
 
 
-class CategoryView(ListAPIView):
+class LogoutAccount(BaseAPIView):
+    """
+    Контроллер для выхода из системы
+    """
+
+    def post(self, request, *args, **kwargs):
+        """
+        Удаление токена пользователя
+        """
+        auth_check = self.check_authentication(request)
+        if auth_check:
+            return auth_check
+
+        Token.objects.filter(user_id=request.user.id).delete()
+        return JsonResponse({'Status': True})
+
+
+class CategoryView(APIView):
     """
     Контроллер для просмотра категорий товаров
     """
-    queryset = Category.objects.all()
-    serializer_class = CategorySerializer
+
+    def get(self, request, *args, **kwargs):
+        """
+        Категории с числом товаров всего, в наличии и по активным магазинам
+
+        Список собирается из сводки CategoryShopStats и кэшируется целиком
+        до следующего изменения каталога.
+        """
+        return Response(category_listing())
 
 
 class ShopView(ListAPIView):
@@ -210,44 +327,230 @@ class ShopView(ListAPIView):
     serializer_class = ShopSerializer
 
 
+# Сортировки каталога с ID для устойчивого порядка. Цену покрывают индексы
+# product_info_price_idx и product_info_shop_price_idx, остальные ключи
+# берутся из сводки предложений продукта ProductOffers
+PRODUCT_SORTS = {
+    'price': ('price', 'id'),
+    '-price': ('-price', '-id'),
+    'min_price': ('product__offers_summary__min_price', 'id'),
+    '-min_price': ('-product__offers_summary__min_price', 'id'),
+    'offers_count': ('product__offers_summary__offers_count', 'id'),
+    '-offers_count': ('-product__offers_summary__offers_count', 'id'),
+}
+
+
 class ProductInfoView(APIView):
     """
     Контроллер для поиска и фильтрации товаров
     """
+    max_page_size = 200
 
-    def get(self, request: Request, *args, **kwargs):
+    @staticmethod
+    def filters(params):
         """
-        Поиск товаров с фильтрацией по магазину и категории
+        Простые фильтры каталога: магазин, категория, цена и наличие
+        """
+        filters = {}
+        for name in ('shop_id', 'category_id', 'price_min', 'price_max'):
+            value = params.get(name)
+            try:
+                filters[name] = int(value) if value else None
+            except ValueError:
+                raise ValueError(f'Неверное значение {name}: {value}')
+        filters['in_stock'] = params.get('in_stock', '').lower() in (
+            'true', '1', 'yes', 'on')
+        return filters
+
+    @classmethod
+    def page_params(cls, params):
         """
+        Смещение и размер страницы (offset, limit) или None без limit
+        """
+        if 'limit' not in params:
+            return None
+        try:
+            limit = int(params['limit'])
+            offset = int(params.get('offset', 0))
+        except ValueError:
+            raise ValueError('Неверные параметры limit и offset')
+        return max(offset, 0), min(max(limit, 0), cls.max_page_size)
+
+    @classmethod
+    def build_queryset(cls, params):
+        """
+        Запрос товаров по параметрам поиска, общий для синхронного
+        и асинхронного представлений
+        """
+        filters = cls.filters(params)
         # Базовый запрос для активных магазинов
         query = Q(shop__state=True)
 
         # Фильтрация по магазину
-        shop_id = request.query_params.get('shop_id')
-        if shop_id:
-            query &= Q(shop_id=shop_id)
+        if filters['shop_id'] is not None:
+            query &= Q(shop_id=filters['shop_id'])
 
         # Фильтрация по категории
-        category_id = request.query_params.get('category_id')
-        if category_id:
-            query &= Q(product__category_id=category_id)
+        if filters['category_id'] is not None:
+            query &= Q(product__category_id=filters['category_id'])
+
+        # Диапазон цены и наличие
+        if filters['price_min'] is not None:
+            query &= Q(price__gte=filters['price_min'])
+        if filters['price_max'] is not None:
+            query &= Q(price__lte=filters['price_max'])
+        if filters['in_stock']:
+            query &= Q(quantity__gt=0)
+
+        # Фильтрация по значениям параметров: param[Цвет]=черный.
+        # Для частых параметров есть индексы по выражению ParameterValue
+        queryset = ProductInfo.objects.all()
+        for index, (name, value) in enumerate(
+                bracket_params(params, 'param').items()):
+            queryset = queryset.alias(
+                **{f'param_{index}': ParameterValue(name)}
+            ).filter(**{f'param_{index}': value})
+
+        # Диапазоны числовых параметров: param_min[Диагональ (дюйм)]=6.
+        # Подзапрос идет по индексу (parameter, value_numeric)
+        bounds = {}
+        for lookup, param in (('gte', 'param_min'), ('lte', 'param_max')):
+            for name, value in bracket_params(params, param).items():
+                # nan и inf отбрасываются, как при заполнении value_numeric
+                number = numeric_value(value)
+                if number is None:
+                    raise ValueError(
+                        f'Неверное значение {param}[{name}]: {value}')
+                bounds.setdefault(name, {})[
+                    f'value_numeric__{lookup}'] = number
+        for name, numeric_bounds in bounds.items():
+            query &= Q(id__in=ProductParameter.objects.filter(
+                parameter__name=name, **numeric_bounds
+            ).values('product_info_id'))
+
+        sort = params.get('sort')
+        if sort and sort not in PRODUCT_SORTS:
+            raise ValueError(f'Неверная сортировка: {sort}')
 
         # Выполнение запроса с оптимизацией
-        queryset = ProductInfo.objects.filter(query).select_related(
+        queryset = queryset.filter(query).select_related(
             'shop', 'product__category'
-        ).prefetch_related(
-            'product_parameters__parameter'
-        ).distinct()
+        )
+        if sort:
+            queryset = queryset.order_by(*PRODUCT_SORTS[sort])
+        return queryset
 
+    @staticmethod
+    def paginate(queryset, params, page):
+        """
+        Страница запроса; без сортировки страницы идут по ID
+        """
+        offset, limit = page
+        if not params.get('sort'):
+            queryset = queryset.order_by('id')
+        return queryset[offset:offset + limit]
+
+    @classmethod
+    def engine_page(cls, params, page, engine=None):
+        """
+        Страница через движок каталога в памяти или None, если движок
+        выключен или запрос ему не подходит (фильтры по параметрам,
+        сортировка по сводке предложений)
+        """
+        sort = params.get('sort') or None
+        if sort not in (None, 'price', '-price') or any(
+                bracket_params(params, name)
+                for name in ('param', 'param_min', 'param_max')):
+            return None
+        engine = engine or get_catalog_engine()
+        if engine is None:
+            return None
+        ids = engine.search(cls.filters(params), sort, *page)
+        # Товары страницы читаются из базы, статус магазина проверяется
+        # еще раз на случай устаревшего снимка
+        products = ProductInfo.objects.filter(
+            shop__state=True).select_related(
+            'shop', 'product__category').in_bulk(ids)
+        return [products[info_id] for info_id in ids if info_id in products]
+
+    def get(self, request: Request, *args, **kwargs):
+        """
+        Поиск товаров с фильтрацией по магазину и категории
+
+        С параметром limit товары отдаются страницами (offset - смещение).
+        Простые запросы страниц обслуживает движок каталога в памяти,
+        если он включен (CATALOG_ENGINE).
+        """
+        params = request.query_params
+        try:
+            queryset = self.build_queryset(params)
+            page = self.page_params(params)
+        except ValueError as error:
+            return JsonResponse({'Status': False, 'Error': str(error)},
+                                status=400)
+        if page is not None:
+            products = self.engine_page(params, page)
+            if products is None:
+                products = self.paginate(queryset, params, page)
+            queryset = products
         serializer = ProductInfoSerializer(queryset, many=True)
         return Response(serializer.data)
 
 
+class ProductSuggestView(APIView):
+    """
+    Контроллер для подсказок при вводе поискового запроса
+    """
+
+    def get(self, request, *args, **kwargs):
+        """
+        Продукты, название или модель которых начинается со слов запроса
+
+        Ответ строится по индексу в памяти процесса, без запросов к базе.
+        """
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            limit = 10
+        return Response(get_suggest_index().suggest(
+            request.query_params.get('q', ''), max(limit, 1)))
+
+
+class ProductOffersView(APIView):
+    """
+    Контроллер для сравнения предложений продукта в разных магазинах
+    """
+
+    def get(self, request, product_id, *args, **kwargs):
+        """
+        Сводка предложений продукта: цены, самый дешевый магазин, остаток
+        """
+        summary = ProductOffers.objects.filter(
+            product_id=product_id
+        ).select_related('product__category', 'cheapest_shop').first()
+        if not summary:
+            return JsonResponse(
+                {'Status': False, 'Error': 'Предложения не найдены'},
+                status=404)
+        return Response(ProductOffersSerializer(summary).data)
+
+
 class ProductDetailView(APIView):
     """
     Контроллер для получения детальной информации о конкретном товаре
     """
 
+    @staticmethod
+    def build_queryset(pk):
+        """
+        Запрос товара активного магазина по ID
+        """
+        return ProductInfo.objects.filter(
+            Q(shop__state=True) & Q(id=pk)
+        ).select_related(
+            'product__category', 'shop'
+        )
+
     def get(self, request, pk, *args, **kwargs):
         """
         Получение детальной информации о товаре по ID
@@ -260,13 +563,7 @@ class ProductDetailView(APIView):
 
         try:
             # Ищем конкретный товар по ID
-            product_info = ProductInfo.objects.filter(
-                Q(shop__state=True) & Q(id=pk)
-            ).select_related(
-                'product__category', 'shop'
-            ).prefetch_related(
-                'product_parameters__parameter'
-            ).first()
+            product_info = self.build_queryset(pk).first()
 
             if not product_info:
                 return JsonResponse(
@@ -289,6 +586,9 @@ class BasketView(BaseAPIView):
     """
     Контроллер для управления корзиной покупок
     """
+    throttle_classes = (TokenRateThrottle,)
+    throttle_scope = 'basket'
+    throttle_unsafe_only = True
 
     def get(self, request, *args, **kwargs):
         """
@@ -301,8 +601,7 @@ class BasketView(BaseAPIView):
         basket = Order.objects.filter(
             user_id=request.user.id, state='basket'
         ).prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter'
+            ordered_items_prefetch()
         ).annotate(
             total_sum=Sum(F('ordered_items__quantity') * F(
                 'ordered_items__product_info__price'))
@@ -324,34 +623,49 @@ class BasketView(BaseAPIView):
             return JsonResponse({'Status': False,
                                  'Errors': 'Не указаны товары для добавления'})
 
+        # ujson нужен только корзине, он загружается при первом запросе
+        from ujson import loads as load_json
         try:
             items_dict = load_json(items_string)
         except ValueError:
             return JsonResponse(
                 {'Status': False, 'Errors': 'Неверный формат данных'})
 
+        if not isinstance(items_dict, list) or not all(
+                isinstance(item, dict)
+                and isinstance(item.get('product_info'), int)
+                and isinstance(item.get('quantity', 1), int)
+                and item.get('quantity', 1) > 0
+                for item in items_dict):
+            return JsonResponse(
+                {'Status': False, 'Errors': 'Неверный формат данных'})
+
+        # Товары проверяются одним запросом, позиции создаются одной вставкой
+        product_ids = {item['product_info'] for item in items_dict}
+        existing_ids = set(ProductInfo.objects.filter(
+            id__in=product_ids).values_list('id', flat=True))
+        missing_ids = product_ids - existing_ids
+        if missing_ids:
+            return JsonResponse({'Status': False, 'Errors': {
+                'product_info': [f'Товар {product_id} не найден'
+                                 for product_id in sorted(missing_ids)]}})
+
         # Получение или создание корзины
         basket, _ = Order.objects.get_or_create(user_id=request.user.id,
                                                 state='basket')
-        created_count = 0
-
-        for item_data in items_dict:
-            item_data['order'] = basket.id
-            serializer = OrderItemSerializer(data=item_data)
-
-            if serializer.is_valid():
-                try:
-                    serializer.save()
-                    created_count += 1
-                except IntegrityError as error:
-                    return JsonResponse(
-                        {'Status': False, 'Errors': str(error)})
-            else:
-                return JsonResponse(
-                    {'Status': False, 'Errors': serializer.errors})
+        try:
+            with transaction.atomic():
+                created = OrderItem.objects.bulk_create([
+                    OrderItem(order_id=basket.id,
+                              product_info_id=item['product_info'],
+                              quantity=item.get('quantity', 1))
+                    for item in items_dict
+                ])
+        except IntegrityError as error:
+            return JsonResponse({'Status': False, 'Errors': str(error)})
 
         return JsonResponse(
-            {'Status': True, 'Создано объектов': created_count})
+            {'Status': True, 'Создано объектов': len(created)})
 
     def delete(self, request, *args, **kwargs):
         """
@@ -372,21 +686,13 @@ class BasketView(BaseAPIView):
             return JsonResponse(
                 {'Status': False, 'Errors': 'Не указаны товары для удаления'})
 
-        items_list = items_string.split(',')
-        basket, _ = Order.objects.get_or_create(user_id=request.user.id,
-                                                state='basket')
-
-        # Формирование условия для удаления
-        delete_query = Q()
-        valid_items = False
-
-        for item_id in items_list:
-            if item_id.isdigit():
-                delete_query |= Q(order_id=basket.id, id=item_id)
-                valid_items = True
-
-        if valid_items:
-            deleted_count = OrderItem.objects.filter(delete_query).delete()[0]
+        item_ids = [item_id for item_id in items_string.split(',')
+                    if item_id.isdigit()]
+        if item_ids:
+            deleted_count = OrderItem.objects.filter(
+                order__user_id=request.user.id, order__state='basket',
+                id__in=item_ids
+            ).delete()[0]
             return JsonResponse(
                 {'Status': True, 'Удалено объектов': deleted_count})
 
@@ -406,22 +712,28 @@ class BasketView(BaseAPIView):
             return JsonResponse({'Status': False,
                                  'Errors': 'Не указаны товары для обновления'})
 
+        # ujson нужен только корзине, он загружается при первом запросе
+        from ujson import loads as load_json
         try:
             items_dict = load_json(items_string)
         except ValueError:
             return JsonResponse(
                 {'Status': False, 'Errors': 'Неверный формат данных'})
 
-        basket, _ = Order.objects.get_or_create(user_id=request.user.id,
-                                                state='basket')
-        updated_count = 0
-
-        for item_data in items_dict:
-            if (isinstance(item_data.get('id'), int) and
-                    isinstance(item_data.get('quantity'), int)):
-                updated_count += OrderItem.objects.filter(
-                    order_id=basket.id, id=item_data['id']
-                ).update(quantity=item_data['quantity'])
+        quantities = {
+            item_data['id']: item_data['quantity'] for item_data in items_dict
+            if isinstance(item_data.get('id'), int)
+            and isinstance(item_data.get('quantity'), int)
+        }
+
+        # Позиции корзины выбираются и обновляются одним запросом каждое
+        items = list(OrderItem.objects.filter(
+            order__user_id=request.user.id, order__state='basket',
+            id__in=quantities
+        ).only('id', 'quantity'))
+        for item in items:
+            item.quantity = quantities[item.id]
+        updated_count = OrderItem.objects.bulk_update(items, ['quantity'])
 
         return JsonResponse(
             {'Status': True, 'Обновлено объектов': updated_count})
@@ -431,6 +743,8 @@ class PartnerUpdate(BaseAPIView):
     """
     Контроллер для обновления прайс-листов партнеров
     """
+    throttle_classes = (TokenRateThrottle,)
+    throttle_scope = 'partner_update'
 
     def post(self, request, *args, **kwargs):
         """
@@ -454,8 +768,9 @@ class PartnerUpdate(BaseAPIView):
 
         try:
             # Загрузка и обработка YAML данных
-            stream = get(url).content
-            data = load_yaml(stream, Loader=Loader)
+            # requests загружается при первом обновлении, а не при старте
+            import requests
+            data = load_price_list(requests.get(url).content)
 
             # Создание или обновление магазина
             shop, _ = Shop.objects.get_or_create(
@@ -463,44 +778,12 @@ class PartnerUpdate(BaseAPIView):
                 user_id=request.user.id
             )
 
-            # Обработка категорий
-            for category_data in data['categories']:
-                category, _ = Category.objects.get_or_create(
-                    id=category_data['id'],
-                    name=category_data['name']
-                )
-                category.shops.add(shop.id)
-                category.save()
+            import_price_list(shop, data)
 
-            # Очистка старых данных и добавление новых товаров
-            ProductInfo.objects.filter(shop_id=shop.id).delete()
-
-            for product_data in data['goods']:
-                product, _ = Product.objects.get_or_create(
-                    name=product_data['name'],
-                    category_id=product_data['category']
-                )
-
-                product_info = ProductInfo.objects.create(
-                    product_id=product.id,
-                    external_id=product_data['id'],
-                    model=product_data['model'],
-                    price=product_data['price'],
-                    price_rrc=product_data['price_rrc'],
-                    quantity=product_data['quantity'],
-                    shop_id=shop.id
-                )
-
-                # Обработка параметров товара
-                for param_name, param_value in product_data[
-                    'parameters'].items():
-                    parameter, _ = Parameter.objects.get_or_create(
-                        name=param_name)
-                    ProductParameter.objects.create(
-                        product_info_id=product_info.id,
-                        parameter_id=parameter.id,
-                        value=param_value
-                    )
+            # Дальше прайс-лист обновляется по расписанию с этого адреса
+            if shop.url != url:
+                shop.url = url
+                shop.save(update_fields=['url'])
 
             return JsonResponse({'Status': True})
 
@@ -508,6 +791,54 @@ class PartnerUpdate(BaseAPIView):
             return JsonResponse({'Status': False, 'Errors': str(e)})
 
 
+class PartnerStock(BaseAPIView):
+    """
+    Контроллер для частого обновления цен и остатков магазина
+    """
+    parser_classes = (JSONParser, NDJSONParser)
+    throttle_classes = (TokenRateThrottle,)
+    throttle_scope = 'partner_stock'
+    max_items = 10000
+
+    def patch(self, request, *args, **kwargs):
+        """
+        Обновление цен и остатков по внешнему ИД без загрузки прайс-листа
+
+        Тело: JSON массив (или {"items": [...]}) либо NDJSON с элементами
+        {"external_id", "price"?, "price_rrc"?, "quantity"?}. Изменения
+        применяются в одной транзакции.
+        """
+        permission_check = self.check_shop_permission(request)
+        if permission_check:
+            return permission_check
+
+        shop_id = Shop.objects.filter(user_id=request.user.id).values_list(
+            'id', flat=True).first()
+        if not shop_id:
+            return JsonResponse(
+                {'Status': False, 'Errors': 'Магазин не найден'})
+
+        items = request.data
+        if isinstance(items, dict):
+            items = items.get('items')
+        if not isinstance(items, list) or not 0 < len(items) <= self.max_items:
+            return JsonResponse(
+                {'Status': False,
+                 'Errors': f'Укажите от 1 до {self.max_items} товаров'},
+                status=400)
+
+        try:
+            result = update_stock(shop_id, items)
+        except ValueError as error:
+            return JsonResponse({'Status': False, 'Errors': str(error)},
+                                status=400)
+        return JsonResponse({
+            'Status': True,
+            'Обновлено объектов': result['updated'],
+            'Не найдено': result['missing'],
+        })
+
+
 class PartnerState(BaseAPIView):
     """
     Контроллер для управления статусом магазина
@@ -540,39 +871,279 @@ class PartnerState(BaseAPIView):
 
         try:
             bool_state = state.lower() in ('true', '1', 'yes', 'on')
-            Shop.objects.filter(user_id=request.user.id).update(
-                state=bool_state)
+            shops = Shop.objects.filter(user_id=request.user.id)
+            with transaction.atomic():
+                shops.update(state=bool_state)
+                offers = ProductInfo.objects.filter(
+                    shop__user_id=request.user.id)
+                refresh_product_offers(offers.values('product_id'))
+                rebuild_category_stats(offers.values('product__category_id'))
+            # ИД магазинов читаются, только если есть подписчики событий
+            transaction.on_commit(lambda: shop_state_changed.send(
+                sender=self.__class__,
+                shop_ids=shops.values_list('id', flat=True),
+                state=bool_state))
             return JsonResponse({'Status': True})
         except Exception as error:
             return JsonResponse({'Status': False, 'Errors': str(error)})
 
 
+class PartnerWebhook(BaseAPIView):
+    """
+    Контроллер для настройки уведомлений магазина о новых заказах
+    """
+
+    def get(self, request, *args, **kwargs):
+        """
+        Получение адреса уведомлений магазина
+        """
+        permission_check = self.check_shop_permission(request)
+        if permission_check:
+            return permission_check
+
+        shop = Shop.objects.filter(user_id=request.user.id).first()
+        if not shop:
+            return JsonResponse(
+                {'Status': False, 'Errors': 'Магазин не найден'})
+        return JsonResponse({'url': shop.webhook_url})
+
+    def post(self, request, *args, **kwargs):
+        """
+        Установка адреса уведомлений, пустой адрес отключает уведомления
+
+        Ключ подписи создается при первой установке адреса и возвращается
+        в ответе.
+        """
+        permission_check = self.check_shop_permission(request)
+        if permission_check:
+            return permission_check
+
+        shop = Shop.objects.filter(user_id=request.user.id).first()
+        if not shop:
+            return JsonResponse(
+                {'Status': False, 'Errors': 'Магазин не найден'})
+
+        url = request.data.get('url') or None
+        if url:
+            try:
+                URLValidator()(url)
+            except ValidationError as e:
+                return JsonResponse({'Status': False, 'Error': str(e)})
+
+        shop.webhook_url = url
+        shop.save(update_fields=['webhook_url', 'webhook_secret'])
+        return JsonResponse({'Status': True, 'Secret': shop.webhook_secret})
+
+
 class PartnerOrders(BaseAPIView):
     """
     Контроллер для получения заказов партнера
     """
+    page_size = 50
+    max_page_size = 200
 
     def get(self, request, *args, **kwargs):
         """
         Получение заказов связанных с магазином пользователя
+
+        Заказы отдаются страницами от новых к старым: limit задает размер
+        страницы, before и before_id - дату и ИД последнего полученного
+        заказа. Заказы с той же датой различаются по ИД, старые страницы
+        дочитываются из архива.
         """
         permission_check = self.check_shop_permission(request)
         if permission_check:
             return permission_check
 
-        # Получение заказов с аннотацией общей суммы
-        orders = Order.objects.filter(
-            ordered_items__product_info__shop__user_id=request.user.id
-        ).exclude(state='basket').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter'
-        ).select_related('contact').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F(
-                'ordered_items__product_info__price'))
-        ).distinct()
+        shop = Shop.objects.filter(user_id=request.user.id).only('id').first()
+        if not shop:
+            return Response([])
 
-        serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data)
+        try:
+            limit = min(int(request.query_params.get('limit',
+                                                     self.page_size)),
+                        self.max_page_size)
+        except ValueError:
+            return JsonResponse(
+                {'Status': False, 'Errors': 'Неверный параметр limit'})
+        limit = max(limit, 0)
+
+        try:
+            before_dt, before_id = page_cursor(request.query_params)
+        except ValueError as error:
+            return JsonResponse({'Status': False, 'Errors': str(error)})
+
+        # Подзаказы магазина выбираются по индексу (shop_id, -dt, -order_id)
+        shop_orders = older_than(
+            ShopOrder.objects.filter(shop_id=shop.id), before_dt, before_id)
+        shop_orders = list(shop_orders.select_related(
+            'order__contact'
+        ).prefetch_related(
+            ordered_items_prefetch(
+                'order__ordered_items',
+                OrderItem.objects.filter(product_info__shop_id=shop.id),
+                to_attr='shop_items')
+        )[:limit])
+
+        page = [((shop_order.dt, shop_order.order_id),
+                 ShopOrderSerializer(shop_order).data)
+                for shop_order in shop_orders]
+
+        # Архив читается только для страниц старше самого нового
+        # архивного заказа
+        horizon = get_archive_horizon()
+        page_is_full = len(shop_orders) == limit
+        if horizon and (not page_is_full or shop_orders[-1].dt <= horizon):
+            archived = older_than(
+                ArchivedShopOrder.objects.filter(shop_id=shop.id),
+                before_dt, before_id)
+            if page_is_full:
+                archived = archived.filter(dt__gte=shop_orders[-1].dt)
+            archived = archived.select_related('order').prefetch_related(
+                Prefetch('order__ordered_items',
+                         queryset=ArchivedOrderItem.objects.filter(
+                             shop_id=shop.id),
+                         to_attr='shop_items'))[:limit]
+            page.extend(((shop_order.dt, shop_order.order_id),
+                         ArchivedShopOrderSerializer(shop_order).data)
+                        for shop_order in archived)
+            page.sort(key=lambda entry: entry[0], reverse=True)
+
+        return Response([data for _, data in page[:limit]])
+
+
+class PartnerOrderState(BaseAPIView):
+    """
+    Контроллер для массовой смены статуса заказов магазина
+    """
+    max_items = 1000
+
+    def post(self, request, *args, **kwargs):
+        """
+        Перевод группы заказов в новый статус
+
+        Права магазина и допустимость перехода проверяются одним запросом,
+        статус меняется одним UPDATE, уведомления ставятся в очередь пачкой.
+        Статус общий для всего заказа, поэтому заказы, в которых есть
+        подзаказы других магазинов, отклоняются.
+        """
+        permission_check = self.check_shop_permission(request)
+        if permission_check:
+            return permission_check
+
+        required_check = self.validate_required_fields(request.data,
+                                                       {'items', 'state'})
+        if required_check:
+            return required_check
+
+        state = request.data['state']
+        allowed_from = Order.STATE_TRANSITIONS.get(state)
+        if not allowed_from:
+            return JsonResponse(
+                {'Status': False, 'Errors': 'Недопустимый статус'})
+
+        items = request.data['items']
+        if isinstance(items, str):
+            items = items.split(',')
+        try:
+            order_ids = {int(item_id) for item_id in items}
+        except (TypeError, ValueError):
+            return JsonResponse(
+                {'Status': False,
+                 'Errors': 'Неверный формат идентификаторов'})
+
+        if not order_ids or len(order_ids) > self.max_items:
+            return JsonResponse(
+                {'Status': False,
+                 'Errors': f'Укажите от 1 до {self.max_items} заказов'})
+
+        with transaction.atomic():
+            foreign_shop_orders = ShopOrder.objects.filter(
+                order_id=OuterRef('pk')).exclude(shop__user_id=request.user.id)
+            eligible_ids = list(Order.objects.filter(
+                id__in=order_ids,
+                state__in=allowed_from,
+                shop_orders__shop__user_id=request.user.id
+            ).exclude(Exists(foreign_shop_orders)).values_list(
+                'id', flat=True).order_by().distinct())
+
+            updated_count = Order.objects.filter(
+                id__in=eligible_ids, state__in=allowed_from
+            ).update(state=state)
+            if state == 'canceled':
+                revert_orders_sales(eligible_ids)
+
+            if eligible_ids:
+                order_state_changed.send(sender=self.__class__,
+                                         order_ids=eligible_ids, state=state)
+
+        return JsonResponse({
+            'Status': True,
+            'Обновлено объектов': updated_count,
+            'Отклонено': sorted(order_ids.difference(eligible_ids)),
+        })
+
+
+class PartnerStats(BaseAPIView):
+    """
+    Контроллер для статистики продаж магазина
+    """
+    default_period_days = 30
+    top_size = 10
+
+    def get(self, request, *args, **kwargs):
+        """
+        Выручка, проданные единицы и топ товаров за период
+
+        Ответ строится только по дневной сводке продаж, без обращения
+        к заказам.
+        """
+        permission_check = self.check_shop_permission(request)
+        if permission_check:
+            return permission_check
+
+        try:
+            date_to = date.fromisoformat(request.query_params['to']) \
+                if request.query_params.get('to') else timezone.localdate()
+            date_from = date.fromisoformat(request.query_params['from']) \
+                if request.query_params.get('from') \
+                else date_to - timedelta(days=self.default_period_days)
+        except ValueError:
+            return JsonResponse(
+                {'Status': False, 'Errors': 'Неверный формат даты'})
+
+        rollups = SalesDailyRollup.objects.filter(
+            shop__user_id=request.user.id,
+            day__gte=date_from, day__lte=date_to
+        )
+
+        days = list(rollups.values('day').annotate(
+            revenue=Sum('revenue'), units=Sum('units')
+        ).order_by('day'))
+
+        top_products = list(rollups.values(
+            'product_info_id', 'external_id'
+        ).annotate(
+            revenue=Sum('revenue'), units=Sum('units')
+        ).order_by('-revenue')[:self.top_size])
+        names = {
+            info['id']: info for info in ProductInfo.objects.filter(
+                id__in=[row['product_info_id'] for row in top_products]
+            ).values('id', 'model', 'product__name')
+        }
+        for row in top_products:
+            info = names.get(row['product_info_id'], {})
+            row['model'] = info.get('model')
+            row['name'] = info.get('product__name')
+
+        return Response({
+            'from': date_from,
+            'to': date_to,
+            'revenue': sum(row['revenue'] for row in days),
+            'units': sum(row['units'] for row in days),
+            'days': days,
+            'top_products': top_products,
+        })
 
 
 class ContactView(BaseAPIView):
@@ -627,10 +1198,8 @@ class ContactView(BaseAPIView):
                     'Errors': serializer.errors
                 })
 
-        except Exception as e:
-            import traceback
-            print(f" Ошибка при создании контакта: {str(e)}")
-            print(f" Traceback: {traceback.format_exc()}")
+        except Exception:
+            logger.exception('Ошибка при создании контакта')
             return JsonResponse({
                 'Status': False,
                 'Errors': 'Внутренняя ошибка сервера'
@@ -649,17 +1218,11 @@ class ContactView(BaseAPIView):
             return JsonResponse({'Status': False,
                                  'Errors': 'Не указаны контакты для удаления'})
 
-        items_list = items_string.split(',')
-        delete_query = Q()
-        valid_items = False
-
-        for contact_id in items_list:
-            if contact_id.isdigit():
-                delete_query |= Q(user_id=request.user.id, id=contact_id)
-                valid_items = True
-
-        if valid_items:
-            deleted_count = Contact.objects.filter(delete_query).delete()[0]
+        contact_ids = [contact_id for contact_id in items_string.split(',')
+                       if contact_id.isdigit()]
+        if contact_ids:
+            deleted_count = Contact.objects.filter(
+                user_id=request.user.id, id__in=contact_ids).delete()[0]
             return JsonResponse(
                 {'Status': True, 'Удалено объектов': deleted_count})
 
@@ -700,27 +1263,68 @@ class OrderView(BaseAPIView):
     """
     Контроллер для управления заказами пользователя
     """
+    throttle_classes = (TokenRateThrottle,)
+    throttle_scope = 'order'
+    throttle_unsafe_only = True
+    page_size = 50
+    max_page_size = 200
 
     def get(self, request, *args, **kwargs):
         """
         Получение истории заказов пользователя
+
+        История отдается страницами от новых заказов к старым (параметры
+        limit и курсор before, before_id), старые страницы дочитываются
+        из архива.
         """
         auth_check = self.check_authentication(request)
         if auth_check:
             return auth_check
 
-        orders = Order.objects.filter(
+        try:
+            limit = min(int(request.query_params.get('limit',
+                                                     self.page_size)),
+                        self.max_page_size)
+        except ValueError:
+            return JsonResponse(
+                {'Status': False, 'Errors': 'Неверный параметр limit'})
+        limit = max(limit, 0)
+
+        try:
+            before_dt, before_id = page_cursor(request.query_params)
+        except ValueError as error:
+            return JsonResponse({'Status': False, 'Errors': str(error)})
+
+        orders = older_than(Order.objects.filter(
             user_id=request.user.id
-        ).exclude(state='basket').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter'
+        ).exclude(state='basket'), before_dt, before_id, 'id')
+        orders = list(orders.prefetch_related(
+            ordered_items_prefetch()
         ).select_related('contact').annotate(
             total_sum=Sum(F('ordered_items__quantity') * F(
-                'ordered_items__product_info__price'))
-        ).distinct()
-
-        serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data)
+                'ordered_items__price'))
+        ).distinct()[:limit])
+
+        history = [((order.dt, order.id), OrderSerializer(order).data)
+                   for order in orders]
+
+        # Архив читается только для страниц старше самого нового
+        # архивного заказа
+        horizon = get_archive_horizon()
+        page_is_full = len(orders) == limit
+        if horizon and (not page_is_full or orders[-1].dt <= horizon):
+            archived = older_than(
+                ArchivedOrder.objects.filter(user_id=request.user.id),
+                before_dt, before_id, 'id')
+            if page_is_full:
+                archived = archived.filter(dt__gte=orders[-1].dt)
+            archived = archived.prefetch_related('ordered_items')[:limit]
+            history.extend(((order.dt, order.id),
+                            ArchivedOrderSerializer(order).data)
+                           for order in archived)
+            history.sort(key=lambda entry: entry[0], reverse=True)
+
+        return Response([data for _, data in history[:limit]])
 
     def post(self, request, *args, **kwargs):
         """
@@ -731,7 +1335,7 @@ class OrderView(BaseAPIView):
             return auth_check
 
         try:
-            print(f"🔍 DEBUG Order data: {request.data}")
+            logger.debug('Оформление заказа: %s', request.data)
 
             if not {'id', 'contact'}.issubset(request.data):
                 return JsonResponse({
@@ -759,26 +1363,32 @@ class OrderView(BaseAPIView):
                     'Errors': 'Контакт не найден'
                 })
 
-            # Обновляем заказ
-            order.contact = contact
-            order.state = 'new'
-            order.save()
-
-            # Отправляем сигнал о новом заказе
-            order_created.send(sender=self.__class__, user_id=request.user.id)
+            # Обновляем заказ и разбиваем его на подзаказы магазинов
+            with transaction.atomic():
+                order.contact = contact
+                order.state = 'new'
+                # Дата заказа - момент оформления, а не создания корзины
+                order.dt = timezone.now()
+                order.save()
+                fix_order_prices(order)
+                split_order_by_shop(order)
+                record_order_sales(order)
+
+                # Уведомление ставится в очередь в той же транзакции
+                order_created.send(sender=self.__class__,
+                                   user_id=request.user.id,
+                                   order_id=order.id)
 
             return JsonResponse({'Status': True})
 
-        except IntegrityError as e:
-            print(f" IntegrityError: {e}")
+        except IntegrityError:
+            logger.exception('Ошибка базы данных при оформлении заказа')
             return JsonResponse({
                 'Status': False,
                 'Errors': 'Ошибка базы данных'
             })
-        except Exception as e:
-            print(f" Unexpected error: {e}")
-            import traceback
-            print(f" Traceback: {traceback.format_exc()}")
+        except Exception:
+            logger.exception('Ошибка при оформлении заказа')
             return JsonResponse({
                 'Status': False,
                 'Errors': 'Внутренняя ошибка сервера'
@@ -0,0 +1,188 @@
+# webhooks.py
+import asyncio
+import hashlib
+import hmac
+import json
+import secrets
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Prefetch, Q
+from django.utils import timezone
+
+from .models import OrderItem, ShopOrder, WebhookEvent
+
+SIGNATURE_HEADER = 'X-Webhook-Signature'
+TIMESTAMP_HEADER = 'X-Webhook-Timestamp'
+
+
+def sign_payload(secret, timestamp, body):
+    """
+    Подпись тела запроса: HMAC-SHA256 от "<timestamp>.<body>"
+
+    Магазин проверяет подпись своим ключом и отбрасывает запросы
+    со старой меткой времени.
+    """
+    message = f'{timestamp}.'.encode() + body
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def queue_new_order_events(order_id):
+    """
+    Постановка события о новом заказе для каждого магазина заказа,
+    у которого указан адрес уведомлений
+    """
+    shop_orders = ShopOrder.objects.filter(
+        order_id=order_id, shop__webhook_url__isnull=False
+    ).exclude(shop__webhook_url='').select_related('order')
+    shop_orders = list(shop_orders.prefetch_related(Prefetch(
+        'order__ordered_items',
+        queryset=OrderItem.objects.select_related('product_info'))))
+
+    events = []
+    for shop_order in shop_orders:
+        items = [
+            {
+                'product_info': item.product_info_id,
+                'external_id': item.product_info.external_id,
+                'quantity': item.quantity,
+                'price': item.price,
+            }
+            for item in shop_order.order.ordered_items.all()
+            if item.product_info.shop_id == shop_order.shop_id
+        ]
+        events.append(WebhookEvent(
+            shop_id=shop_order.shop_id,
+            event='order.created',
+            payload={
+                'order_id': order_id,
+                'dt': shop_order.dt.isoformat(),
+                'total_sum': shop_order.total_sum,
+                'items': items,
+            },
+        ))
+    WebhookEvent.objects.bulk_create(events)
+
+
+def claim_pending_events(batch_size, per_shop, lease):
+    """
+    Забирает готовые к доставке события условным UPDATE и группирует их
+    по магазинам
+
+    События получают метку обработчика, а следующая попытка откладывается
+    на lease секунд: параллельный запуск их уже не выберет, а события
+    упавшего обработчика вернутся в очередь после окончания аренды.
+    Без ключа подпись была бы пустым ключом, такие события ждут ключа.
+    """
+    now = timezone.now()
+    due = WebhookEvent.objects.filter(status='pending',
+                                      next_attempt_at__lte=now)
+    counts = defaultdict(int)
+    ids = []
+    for event_id, shop_id in due.filter(
+            Q(shop__webhook_url__isnull=False) & ~Q(shop__webhook_url='')
+    ).exclude(shop__webhook_secret='').order_by('id').values_list(
+            'id', 'shop_id')[:batch_size]:
+        if counts[shop_id] < per_shop:
+            counts[shop_id] += 1
+            ids.append(event_id)
+    if not ids:
+        return []
+    claim = secrets.token_hex(16)
+    due.filter(id__in=ids).update(
+        claim=claim, next_attempt_at=now + timedelta(seconds=lease))
+
+    batches = defaultdict(list)
+    for event in WebhookEvent.objects.filter(
+            id__in=ids, claim=claim).select_related('shop').order_by('id'):
+        batches[event.shop].append(event)
+    return list(batches.items())
+
+
+@transaction.atomic
+def _record_results(results, max_attempts, backoff):
+    # Сохранение результатов доставки: одно UPDATE на успешные события
+    now = timezone.now()
+    delivered_ids = []
+    for events, error in results:
+        if error is None:
+            delivered_ids.extend(event.id for event in events)
+            continue
+        for event in events:
+            event.attempts += 1
+            event.last_error = error
+            if event.attempts >= max_attempts:
+                event.status = 'failed'
+            else:
+                event.next_attempt_at = now + timedelta(
+                    seconds=backoff * 2 ** (event.attempts - 1))
+        WebhookEvent.objects.bulk_update(
+            events, ['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+    if delivered_ids:
+        WebhookEvent.objects.filter(id__in=delivered_ids).update(
+            status='delivered', delivered_at=now, last_error='')
+
+
+async def _deliver(semaphore, shop, events, timeout):
+    # Отправка одной пачки событий магазину, возвращает (события, ошибка)
+    import requests
+    body = json.dumps({
+        'shop': shop.id,
+        'events': [
+            {
+                'id': event.id,
+                'event': event.event,
+                'created_at': event.created_at.isoformat(),
+                'data': event.payload,
+            }
+            for event in events
+        ],
+    }, ensure_ascii=False).encode()
+    timestamp = str(int(time.time()))
+    headers = {
+        'Content-Type': 'application/json',
+        TIMESTAMP_HEADER: timestamp,
+        SIGNATURE_HEADER: sign_payload(shop.webhook_secret, timestamp, body),
+    }
+
+    async with semaphore:
+        try:
+            response = await asyncio.to_thread(
+                requests.post, shop.webhook_url, data=body, headers=headers,
+                timeout=timeout)
+        except requests.RequestException as error:
+            return events, str(error)
+    if not 200 <= response.status_code < 300:
+        return events, f'HTTP {response.status_code}'
+    return events, None
+
+
+async def dispatch_pending(batch_size=500, per_shop=100, concurrency=10,
+                           max_attempts=8, backoff=30, timeout=10,
+                           lease=300):
+    """
+    Доставка накопленных событий: по одному подписанному POST на магазин,
+    не более concurrency запросов одновременно. События сначала
+    забираются claim_pending_events, поэтому параллельные запуски не
+    отправят одно событие дважды. Возвращает пару (доставлено событий,
+    ошибок доставки).
+    """
+    batches = await sync_to_async(claim_pending_events)(
+        batch_size, per_shop, lease)
+    if not batches:
+        return 0, 0
+
+    semaphore = asyncio.Semaphore(concurrency)
+    results = await asyncio.gather(*(
+        _deliver(semaphore, shop, events, timeout)
+        for shop, events in batches
+    ))
+    await sync_to_async(_record_results)(results, max_attempts, backoff)
+
+    delivered = sum(len(events) for events, error in results if error is None)
+    failed = sum(1 for _, error in results if error is not None)
+    return delivered, failed